@@ -16,6 +16,7 @@ os.chdir(os.path.dirname(__file__))
 commands = """\
 init
 backup
+watch
 refresh
 restore-dir
 restore-file
@@ -28,6 +29,8 @@ prune
 summary
 advanced
 advanced dbimport
+advanced dbcheck
+advanced checkpoint
 advanced prune-file
 advanced timestamp-include-filters
 utils
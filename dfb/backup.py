@@ -15,14 +15,21 @@ import queue
 import logging
 import math
 import gzip as gz
+from array import array
 from collections import defaultdict
+from collections.abc import Mapping
 from textwrap import dedent
 from threading import Thread
 from functools import partial
+from operator import itemgetter
 
 from . import LOCK, MIN_RCLONE
+from .concurrency import concurrency_limit
 from .dstdb import DFBDST, apath2rpath
-from .rclonerc import IGNORED_FILE_DATA, rcpathjoin
+from .hashcache import HashCache
+from .journal import PlanJournal
+from .localscan import LocalScanner, RcloneFilter, Unsupported
+from .rclonerc import IGNORED_FILE_DATA, multi_writable, rcpathjoin
 from .threadmapper import ReturnThread, thread_map_unordered as tmap
 from .utils import (
     star,
@@ -31,15 +38,31 @@ from .utils import (
     time_format,
     listify,
     smart_open,
+    spill_sorted,
+    time2all,
 )
 
 # For testing only
 from . import _FAIL
 
+try:  # Optional. Vectorizes compare() when available
+    import numpy as np
+except ImportError:
+    np = None
+
 logger = logging.getLogger(__name__)
 
 DFB_EMPTY = ".dfbempty"
 
+# Number of source files sorted in memory at a time with compare_method = "merge"
+MERGE_SORT_CHUNK = 200_000
+
+# Number of the same kind of message to log at INFO. The rest are logged at DEBUG
+MAX_LOGGED = 10
+
+# For --name-transform used by batched uploads
+MIN_RCLONE_BATCH = 1, 70, 0
+
 
 class NoCommonHashError(ValueError):
     pass
@@ -49,12 +72,168 @@ class LinkError(ValueError, OSError):
     pass
 
 
+def _batchable(file, *, max_size, ts):
+    """
+    Whether the file can be in a batched upload. It must be small and rclone's
+    'suffix_keep_extension' name transform must give its rpath, which is the case with
+    at most one '.' in the name (and not first or last)
+    """
+    name = os.path.basename(file["apath"])
+    if file["size"] > max_size or "\n" in file["apath"] or name == DFB_EMPTY:
+        return False
+    if name.endswith(".rclonelink"):  # Uploaded without metadata
+        return False
+    stem, dot, ext = name.partition(".")
+    if not stem or "." in ext or (dot and not ext):
+        return False
+    dirname = os.path.dirname(file["rpath"])
+    expected = f"{stem}.{ts}.{ext}" if dot else f"{stem}.{ts}"
+    return file["rpath"] == os.path.join(dirname, expected)
+
+
+def _batches(files, batchable, batch_files):
+    """Yield the files one at a time or, if batchable, in lists of 'batch_files'"""
+    batch = []
+    for file in files:
+        if not batchable(file):
+            yield file
+            continue
+        batch.append(file)
+        if len(batch) >= batch_files:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _stat_changed(planned, current):
+    """Whether a source file's size or mtime differs from when it was planned"""
+    if planned["size"] != current["size"]:
+        return True
+    mtimes = planned.get("mtime"), current.get("mtime")
+    if None in mtimes:
+        return mtimes[0] != mtimes[1]
+    return abs(mtimes[0] - mtimes[1]) > 1e-6
+
+
+def _write_groups(items, batch_files):
+    """
+    Group (file, rpath, content) 'items' by the directory of the rpath into lists of up
+    to 'batch_files'. Names that can't be in a multi-file upload are alone
+    """
+    groups = defaultdict(list)
+    for item in items:
+        dirname, name = os.path.split(item[1])
+        if not multi_writable(name):
+            yield dirname, [item]
+            continue
+        group = groups[dirname]
+        group.append(item)
+        if len(group) >= batch_files:
+            yield dirname, groups.pop(dirname)
+    yield from groups.items()
+
+
+def _split_lanes(files, large_file_size):
+    """
+    Split the 'files' iterator into (large, small, stop). 'small' must be consumed
+    for 'large' to get files (so in another thread); the large ones are queued for it.
+    Call stop() to end 'large' if 'small' won't be consumed to the end
+    """
+    large = queue.Queue()
+    done = object()
+
+    def _small():
+        try:
+            for file in files:
+                if file["size"] >= large_file_size:
+                    large.put(file)
+                else:
+                    yield file
+        finally:
+            large.put(done)
+
+    return iter(large.get, done), _small(), partial(large.put, done)
+
+
+class Scope:
+    """
+    Part of the source to back up: 'files' and, recursively, 'trees' as paths relative
+    to the source root. Everything outside of it is assumed unchanged.
+    """
+
+    def __init__(self, files=(), trees=()):
+        self.trees = []
+        for tree in sorted({tree.strip("/") for tree in trees}):
+            if not self.trees or not _under(tree, self.trees[-1]):  # Not nested
+                self.trees.append(tree)
+
+        files = {file.strip("/") for file in files}
+        self.files = sorted(file for file in files if file and not self.covers(file))
+
+    @classmethod
+    def from_file(cls, file, root=""):
+        """
+        Read a list of changed paths (see '--changed-from'). 'file' may be "-" for
+        stdin. Absolute paths under 'root' (of a local source) are made relative
+        """
+        if file == "-":
+            data = sys.stdin.buffer.read()
+        else:
+            with open(file, "rb") as fp:
+                data = fp.read()
+        sep = b"\0" if b"\0" in data else b"\n"
+
+        files, trees = [], []
+        for path in data.split(sep):
+            path = os.fsdecode(path.rstrip(b"\r") if sep == b"\n" else path)
+            if not path.strip():
+                continue
+            if root and os.path.isabs(path):
+                if not _under(path.rstrip("/"), root.rstrip("/")):
+                    logger.warning(f"Changed path {path!r} is not in {root!r}. Skipped")
+                    continue
+                path = path.removeprefix(root.rstrip("/"))
+            path = path.removeprefix("./")
+            (trees if path.endswith("/") else files).append(path)
+
+        scope = cls(files, trees)
+        logger.info(f"Read {scope} from {file!r}")
+        return scope
+
+    def covers(self, path):
+        """Whether 'path' is in one of the trees"""
+        return any(_under(path, tree) for tree in self.trees)
+
+    def __bool__(self):
+        return bool(self.files or self.trees)
+
+    def __repr__(self):
+        return f"Scope({len(self.files)} files, {len(self.trees)} trees)"
+
+
+def _under(path, tree):
+    return not tree or path == tree or path.startswith(tree + "/")
+
+
 class Backup:
-    def __init__(self, config):
+    def __init__(self, config, scope=None, resume=False):
         self.t0 = time.time()
         self.config = config
         self.errcount = 0
 
+        # Only list and compare this part of the source. Always staged and in memory
+        self.scope = scope
+        if scope is not None and config.cliconfig.subdir:
+            raise ValueError("Cannot use a subdir with a scoped backup")
+
+        # Continue the saved plan of an interrupted backup rather than listing
+        self.resume = resume
+        if resume and (scope is not None or config.cliconfig.subdir):
+            raise ValueError("Cannot resume with a subdir or a scope")
+        self.journal = None
+        self.resumed_at = None
+
     def run(self):
         config = self.config
         cliconfig = config.cliconfig
@@ -68,44 +247,84 @@ class Backup:
         for k, v in ver.items():
             logger.debug(f"   {k}: {v}")
 
-        ver = tuple(int(c) for c in self.src_rclone.version_dict["decomposed"])
+        self.rclone_version = ver = tuple(
+            int(c) for c in self.src_rclone.version_dict["decomposed"]
+        )
         if ver < MIN_RCLONE:
             raise ValueError(
                 "Unsupported rclone version. "
                 f"Must use {'.'.join(f'{i}' for i in MIN_RCLONE)} or newer"
             )
 
-        self.dstdb = DFBDST(config)
+        # Resume with the saved plan's timestamp. Set before the database is opened since
+        # its snapshot file and checkpoints are named from it too
+        journal = self._load_journal() if self.resume else None
+        self.dstdb = DFBDST(config, resumed_at=self.resumed_at)
+
+        # Dry-runs, dumps, and interactive runs need the full plan before acting so
+        # they are always staged. The pipeline makes the same decisions.
+        pipelined = config.pipeline and not (
+            cliconfig.dry_run
+            or cliconfig.dump
+            or cliconfig.interactive
+            or self.scope is not None
+            or self.resume
+        )
 
-        # Step 1: List Files locally and maybe on remote
-        self.list_files()  # self.src_files, self.dst_files
+        if pipelined:
+            if config.resume_journal:
+                logger.warning(
+                    "'resume_journal' is not used with 'pipeline'. "
+                    "This backup can't be resumed"
+                )
+            self.pipeline()  # Steps 1-4 with transfers starting while listing
+        elif self.resume:
+            self.load_plan(journal)  # Instead of steps 1-3
+        else:
+            # Step 1: List Files locally and maybe on remote
+            self.list_files()  # self.src_files, self.dst_files
 
-        # Step 2: Compare
-        self.compare()  # sets new, modified, deleted, and update_dstdb
+            # Step 2: Compare
+            self.compare()  # sets new, modified, deleted, and update_dstdb
 
-        # update dstdb for files that match on dst_compare so that they can
-        # use [src]compare next time.
-        self.dstdb.replace_many(self.update_dstdb)
+            # update dstdb for files that match on dst_compare so that they can
+            # use [src]compare next time.
+            self.dstdb.replace_many(self.update_dstdb)
 
-        # Step 3: Move Tracking
-        self.track_moves()  # updates new, deleted and adds moves (original_dfile,moved_sfile)
+            # Step 3: Move Tracking
+            self.track_moves()  # updates new, deleted and adds moves (original_dfile,moved_sfile)
 
-        self.action_summary()
+        if not pipelined:
+            self.action_summary()
 
-        if cliconfig.dry_run:
-            logger.info("DRY-RUN. Exit")
-            return
-        elif cliconfig.interactive:
-            r = input("Do you want to continue? [Y]/N:")
-            if r.lower().startswith("n"):
+            if cliconfig.dry_run:
+                logger.info("DRY-RUN. Exit")
                 return
+            elif cliconfig.interactive:
+                r = input("Do you want to continue? [Y]/N:")
+                if r.lower().startswith("n"):
+                    return
 
-        self.dump = []
+            self.dump = []
 
-        # Step 4: Transfers. If --dump, will not act but will populate self.dump
-        self.transfer()
-        self.reference() if config.rename_method == "reference" else self.move_by_copy()
-        self.delete()
+            # Save the plan so an interrupted backup can be resumed
+            if self.journal is None and config.resume_journal and not cliconfig.dump:
+                self.journal = PlanJournal.create(config, self)
+
+            # Step 4: Transfers. If --dump, will not act but will populate self.dump
+            # All DB writes go through one writer thread and are committed in groups
+            try:
+                with self.dstdb.group_commit() as writer:
+                    self.transfer()
+                    if config.rename_method == "reference":
+                        self.reference()
+                    else:
+                        self.move_by_copy()
+                    self.delete()
+                self.errcount += len(writer.failed)
+            finally:
+                if self.journal:
+                    self.journal.close()
 
         if file := cliconfig.dump:
             try:
@@ -130,19 +349,155 @@ class Backup:
 
         if not cliconfig.dry_run:
             self.dstdb.push_snapshots()
+            if every := config.checkpoint_every:
+                self.dstdb.checkpoint(every=every)
 
         self.call_shell(mode="post", stats=stats)
 
         if not cliconfig.dry_run:
             self.upload_logs()
 
+    def _load_journal(self):
+        """The saved plan of an interrupted backup. Its timestamp is used from now on"""
+        config = self.config
+
+        journal = PlanJournal.load(config)
+        info = journal.info
+        if (info["src"], info["dst"]) != (config.src, config.dst):
+            raise ValueError(
+                f"The saved plan is for {info['src']!r} to {info['dst']!r}. "
+                "Not resuming"
+            )
+        if info["rename_method"] != config.rename_method:
+            raise ValueError(
+                f"The saved plan used rename_method = {info['rename_method']!r}. "
+                "Not resuming"
+            )
+
+        self.resumed_at = config.now
+        config.now = time2all(info["ts"])
+        logger.info(f"Resuming the backup planned at {config.now.dt}")
+        return journal
+
+    def load_plan(self, journal):
+        """
+        Set new, modified, moves, and deleted from the saved plan ('journal') of an
+        interrupted backup. Items already in the database are skipped and the planned
+        source files are re-checked.
+        """
+        config = self.config
+        cliconfig = config.cliconfig
+        now = config.now
+
+        items = list(journal.remaining())
+
+        # Anything recorded was done even if the journal was not updated
+        apaths = [(f[1] if kind == "move" else f)["apath"] for kind, f in items]
+        db = self.dstdb.db()
+        rows = db.execute(
+            """
+            SELECT apath FROM items
+            WHERE timestamp = ? AND apath IN (SELECT value FROM json_each(?))""",
+            (now.ts, json.dumps(apaths)),
+        )
+        recorded = {row["apath"] for row in rows}
+        db.close()
+        for apath in recorded:
+            journal.done(apath)
+
+        self.src_files = {}
+        self.dst_files = {}
+        self.new, self.modified, self.moves, self.deleted = [], [], [], []
+        for kind, file in items:
+            if kind == "move":
+                dfile, sfile = file
+                if sfile["apath"] not in recorded:
+                    self.dst_files[dfile["apath"]] = dfile
+                    self.src_files[sfile["apath"]] = sfile
+                    self.moves.append((dfile, sfile))
+            elif file["apath"] in recorded:
+                continue
+            elif kind == "delete":
+                self.dst_files[file["apath"]] = file
+                self.deleted.append(file["apath"])
+            else:
+                self.src_files[file["apath"]] = file
+                getattr(self, kind).append(file["apath"])
+
+        logger.info(
+            f"{journal.count(done=True) + len(recorded)} planned items were done. "
+            f"{len(items) - len(recorded)} remain"
+        )
+        self._recheck_plan(journal)
+
+        if not (cliconfig.dump or cliconfig.dry_run):
+            self.journal = journal
+
+    def _recheck_plan(self, journal):
+        """
+        List the planned source files again. Those that changed size or mtime since
+        planning are updated (moved ones are uploaded instead) and those that are gone
+        are dropped from the plan
+        """
+        planned = [apath for apath in self.src_files if not apath.endswith(DFB_EMPTY)]
+        if not planned:
+            return
+
+        self.scope = Scope(files=planned)
+        try:
+            current = {file["apath"]: file for file in self.iter_src()}
+        except Unsupported as EE:
+            logger.warning(f"Cannot re-check the source: {EE}. Resuming as planned")
+            return
+        finally:
+            self.scope = None
+
+        moves = {sfile["apath"]: (dfile, sfile) for dfile, sfile in self.moves}
+        changed, gone = [], []
+        for apath in planned:
+            sfile = self.src_files[apath]
+            if (cur := current.get(apath)) is None:
+                gone.append(apath)
+                journal.done(apath)  # Nothing to do
+                del self.src_files[apath]
+            elif _stat_changed(sfile, cur):
+                changed.append(apath)
+                self.src_files[apath] = cur
+                if apath in moves:  # No longer known to be the same file
+                    self.new.append(apath)
+            else:
+                continue
+
+            if apath in moves:
+                self.moves.remove(moves[apath])
+
+        gone = set(gone)
+        self.new[:] = [apath for apath in self.new if apath not in gone]
+        self.modified[:] = [apath for apath in self.modified if apath not in gone]
+        logger.info(
+            f"Re-checked {len(planned)} planned source files. "
+            f"{len(changed)} changed and {len(gone)} gone since planning"
+        )
+        for apath in changed:
+            logger.debug(f"   Changed: {apath!r}")
+        for apath in gone:
+            logger.debug(f"   Gone: {apath!r}")
+
     def list_files(self, stats=None):
-        """List the source and refresh dest if needed"""
+        """
+        List the source and refresh dest if needed.
+
+        With compare_method = "merge", the source is instead sorted (spilling to disk)
+        into self.sorted_src and the destination is read in order in compare().
+        """
         config = self.config
         kwargs = dict(stats=stats or self.config.stats)
 
+        merge = self.merge
+        list_src = self.list_src_sorted if merge else self.list_src
+
         if self.config.cliconfig.refresh:
-            sthread = ReturnThread(target=self.list_src, kwargs=kwargs).start()
+            sthread = ReturnThread(target=list_src, kwargs=kwargs).start()
             dthread = ReturnThread(
                 target=self.dstdb.reset,
                 kwargs=kwargs | {"use_snapshots": config.cliconfig.use_snapshots},
@@ -150,29 +505,88 @@ class Backup:
             source_files = sthread.join()
             dthread.join()
 
-            self._proc_dst_files()
+            if not merge:
+                self._proc_dst_files()
         else:
             # when we don't have to refresh, do this before listing the source just
             # so the user has some idea of how many files to possibly expect
-            self._proc_dst_files()
+            if not merge:
+                self._proc_dst_files()
 
             logger.info("Listing source")
-            source_files = self.list_src(**kwargs)
+            source_files = list_src(**kwargs)
+
+        if merge:
+            self.sorted_src = source_files
+            return
 
-        self.src_files = {file["apath"]: file for file in source_files}
+        self.src_files = source_files
 
         logger.info(f"Found {len(self.src_files)} source Files")
 
+    @property
+    def merge(self):
+        """Whether to use compare_method = "merge". Scoped backups are in memory"""
+        return self.config.compare_method == "merge" and self.scope is None
+
     def _proc_dst_files(self):
-        d = self.dstdb.snapshot(path=self.config.cliconfig.subdir)
-        d = (self.dstdb.fullrow2dict(row) for row in d)
+        config = self.config
+        # Only look up the checksums if they will be compared
+        checksums = "hash" in {
+            config.compare,
+            config.dst_compare,
+            config.renames,
+            config.dst_renames,
+        }
+
+        if self.scope is None:
+            d = self.dstdb.snapshot(path=config.cliconfig.subdir, checksums=checksums)
+        else:
+            d = self._scoped_dst_rows(checksums)
+
+        d = (self.dstdb.fullrow2lazy(row) for row in d)
         self.dst_files = {file["apath"]: file for file in d}
         logger.info(f"Backup contains {len(self.dst_files)} current files")
 
+    def _scoped_dst_rows(self, checksums):
+        """The current rows of the destination in the scope"""
+        scope = self.scope
+        for tree in scope.trees:
+            rows = self.dstdb.snapshot(path=tree, checksums=checksums)
+            # The directory lookup is case-insensitive but the source is not
+            yield from (row for row in rows if _under(row["apath"], tree))
+
+        if scope.files:
+            cond = "apath IN (SELECT value FROM json_each(:scope_files))"
+            yield from self.dstdb.snapshot(
+                conditions=[(cond, {"scope_files": json.dumps(scope.files)})],
+                checksums=checksums,
+            )
+
     def list_src(self, stats=None):
+        files = SourceFiles(self.iter_src(stats=stats))
+        logger.debug(f"Listed {len(files)} files")
+        return files
+
+    def list_src_sorted(self, stats=None):
+        """
+        List the source sorted by apath. Returns an iterator that is merged from
+        sorted temporary files so that the full listing is never in memory.
+        """
+        files = spill_sorted(
+            self.iter_src(stats=stats),
+            key=itemgetter("apath"),
+            chunk_size=MERGE_SORT_CHUNK,
+        )
+        logger.debug("Listed and sorted source files")
+        return files
+
+    def iter_src(self, stats=None):
+        """Iterate the source files (as dicts) in listing order"""
         config = self.config
 
-        fsroot = config.rc.features(config.src).get("Root", "")
+        features = config.rc.features(config.src)
+        fsroot = features.get("Root", "")
         if fsroot and not os.path.exists(fsroot):
             fsroot = ""
 
@@ -191,18 +605,33 @@ class Backup:
 
         logger.debug(f"{compute_hashes = }, {modtime = }")
 
-        hash_flags = []
+        # The cache replaces rclone's hashing when it can be used. Local only
+        subdir = config.cliconfig.subdir or ""  # Make it empty instead of None
+        hash_cache = None
         if compute_hashes:
+            prune = not subdir and self.scope is None
+            hash_cache = HashCache.from_config(config, fsroot, prune=prune)
+
+        hash_flags = []
+        if compute_hashes and not hash_cache:
             hash_flags.append("--hash")
             for htype in listify(config.hash_type):
                 hash_flags.extend(["--hash-type", htype])
 
-        subdir = config.cliconfig.subdir or ""  # Make it empty instead of None
         if subdir:
             msg = f"subdir {subdir!r} specified. Filters may break!"
             logger.warning(msg)
 
-        rcfiles = config.src_rclone.listremote(
+        rcfiles = None
+        if self.scope is not None:
+            logger.info(f"Listing {self.scope} of the source")
+            rcfiles = self._scoped_listing(features, fsroot, hash_flags, modtime)
+        elif config.local_scanner:
+            rcfiles = self._local_scanner(features, fsroot, subdir, hash_flags)
+
+        rcfiles = rcfiles or config.src_rclone.listremote_partitioned(
+            partitions=config.list_partitions,
+            depth=config.list_partition_depth,
             filter_flags=config.filter_flags,
             # fast_list=... # Would be in rclone_flags. Already set
             mimetype=False,
@@ -214,52 +643,58 @@ class Backup:
             subdir=subdir,
         )
 
-        files = []
         dirs = set()
         parents = set()
 
-        t0 = time.time()
-        c = 0
+        def _listed():
+            t0 = time.time()
+            c = 0
 
-        for item in rcfiles:
-            if item["IsDir"]:
-                dirs.add(os.path.join(subdir, item["Path"]))
+            for item in rcfiles:
+                if item["IsDir"]:
+                    dirs.add(os.path.join(subdir, item["Path"]))
 
-                # could be nested w/o files so add the parent just in case
-                pdir = os.path.join(subdir, os.path.dirname(item["Path"]))
-                parents.add(pdir.removesuffix("/"))
+                    # could be nested w/o files so add the parent just in case
+                    pdir = os.path.join(subdir, os.path.dirname(item["Path"]))
+                    parents.add(pdir.removesuffix("/"))
 
-                continue
-            else:
-                file = item
+                    continue
+                else:
+                    file = item
 
-            c += 1
-            new = {
-                "apath": os.path.join(subdir, file.pop("Path")),
-                "size": file.pop("Size"),
-                "mtime": file.pop("ModTime", None),
-            }
+                c += 1
+                new = {
+                    "apath": os.path.join(subdir, file.pop("Path")),
+                    "size": file.pop("Size"),
+                    "mtime": file.pop("ModTime", None),
+                }
 
-            if hashes := file.pop("Hashes", None):
-                new["checksum"] = hashes
+                if hashes := file.pop("Hashes", None):
+                    new["checksum"] = hashes
 
-            for k, v in file.items():
-                if k in IGNORED_FILE_DATA:
-                    continue
-                new[k] = v
+                for k, v in file.items():
+                    if k in IGNORED_FILE_DATA:
+                        continue
+                    new[k] = v
 
-            files.append(new)
-            parents.add(os.path.dirname(new["apath"]))
+                parents.add(os.path.dirname(new["apath"]))
+                yield new
 
-            if stats and (time.time() - t0) >= stats:  # TODO TEST
-                logger.info(f"Source Listing Status: {c} items")
-                t0 = time.time()
+                if stats and (time.time() - t0) >= stats:  # TODO TEST
+                    logger.info(f"Source Listing Status: {c} items")
+                    t0 = time.time()
 
-        # Testing
-        if "missing_hashes" in _FAIL:
-            for file in files:
-                file.pop("checksum", None)
-        # end testing
+        files = _listed()
+        if hash_cache:
+            files = hash_cache.fill(files)
+
+        for new in files:
+            # Testing
+            if "missing_hashes" in _FAIL:
+                new.pop("checksum", None)
+            # end testing
+
+            yield new
 
         empty = dirs - parents
         if config.empty_directory_markers:
@@ -269,19 +704,114 @@ class Backup:
                     "mtime": -12345,
                     "size": 0,
                 }
-                files.append(new)
+                yield new
 
-        logger.debug(f"Listed {len(files)} files")
-        return files
+    def _local_scanner(self, features, fsroot, subdir, hash_flags):
+        """The native local lister if it can be used. Otherwise None to use rclone"""
+        try:
+            scanner = self._new_scanner(features, fsroot, subdir, hash_flags)
+        except Unsupported as EE:
+            logger.info(f"Cannot use 'local_scanner': {EE}. Listing with rclone")
+            return
 
-    def compare(self):
+        logger.debug(f"Listing {scanner.root!r} with the local scanner")
+        return iter(scanner)
+
+    def _scoped_listing(self, features, fsroot, hash_flags, modtime):
+        """
+        List only the scope. Natively if possible, otherwise by stat'ing each file and
+        listing each tree with rclone then applying the filters from the root
+        """
         config = self.config
+        scope = self.scope
+        try:
+            scanner = self._new_scanner(features, fsroot, "", hash_flags)
+            return scanner.scoped(scope.files, scope.trees)
+        except Unsupported as EE:
+            logger.debug(f"Listing the scope with rclone: {EE}")
+
+        filters = RcloneFilter(config.filter_flags)
+        if filters.if_present or filters.one_file_system:
+            raise Unsupported(
+                "'--exclude-if-present' and '--one-file-system' need a full listing"
+            )
 
+        def _stat(path):
+            item = config.rc.stat(
+                (config.src, path),
+                modtime=modtime,
+                hashes=bool(hash_flags),
+                hashtypes=listify(config.hash_type),
+                metadata=config.metadata,
+                epoch_time=True,
+            )
+            return path, item
+
+        def _listed():
+            for path, item in tmap(_stat, scope.files, Nt=config.concurrency):
+                if item and filters.include_path(path, item["Size"]):
+                    item["Path"] = path
+                    yield item
+
+            for tree in scope.trees:
+                if tree:
+                    if not filters.include_path(tree, is_dir=True):
+                        continue
+                    # Not operations/stat with rc.stat() since it is files only
+                    params = {"fs": config.src, "remote": tree}
+                    item = config.rc.call("operations/stat", params=params)["item"]
+                    if not (item and item["IsDir"]):
+                        continue
+                    yield {"Path": tree, "IsDir": True}
+
+                for item in config.src_rclone.listremote(
+                    subdir=tree,
+                    mimetype=False,
+                    modtime=modtime,
+                    metadata=config.metadata,
+                    epoch_time=True,
+                    flags=hash_flags,
+                ):
+                    path = os.path.join(tree, item["Path"])
+                    if filters.include_path(path, item["Size"], is_dir=item["IsDir"]):
+                        item["Path"] = path
+                        yield item
+
+        return _listed()
+
+    def _new_scanner(self, features, fsroot, subdir, hash_flags):
+        """LocalScanner of the source. Raises Unsupported if it can't be used"""
+        config = self.config
+        if not fsroot or not features.get("String", "").startswith("Local file"):
+            raise Unsupported("'src' is not local")
+        if hash_flags:
+            raise Unsupported("hashes are computed by rclone. See 'hash_cache'")
+        if config.metadata:
+            raise Unsupported("'metadata' is set")
+        return LocalScanner(
+            os.path.join(fsroot, subdir),
+            filter_flags=config.filter_flags,
+            rclone_flags=config.rclone_flags,
+        )
+
+    def compare(self):
         self.new = []
         self.modified = []
-        self.deleted = list(set(self.dst_files) - set(self.src_files))
         self.update_dstdb = []
 
+        if self.merge:
+            return self._compare_merge()
+
+        if (
+            np is not None
+            and isinstance(self.src_files, SourceFiles)
+            and self.config.compare in {"size", "mtime"}
+            and self._compare_vectorized()
+        ):
+            return
+
+        self.deleted = list(set(self.dst_files) - set(self.src_files))
+
         for apath, sfile in self.src_files.items():
             try:
                 dfile = self.dst_files[apath]
@@ -289,24 +819,306 @@ class Backup:
                 self.new.append(apath)
                 continue
 
-            if os.path.basename(apath) == DFB_EMPTY:
-                compare = True  # Always compare empties to true regardless of attribs
+            if not self._compare_pair(apath, sfile, dfile):
+                self.modified.append(apath)
+
+    def _compare_vectorized(self):
+        """
+        compare() with numpy array comparisons of size and mtime. The per-file
+        _compare_pair is only used for the residue: files with dstinfo (which use
+        dst_compare and may need updating), empty dir markers, and sizes that don't fit
+        the arrays.
+
+        Returns False, having done nothing, if the destination can't be put in arrays.
+        """
+        config = self.config
+        src, dst = self.src_files, self.dst_files
+
+        src_apaths = list(src)
+        dst_apaths = list(dst)
+
+        # Align on the index of the source rather than sorting
+        srow = np.frombuffer(src.rows(dst_apaths), dtype=np.int64)
+        both = srow >= 0
+        ms = srow[both]  # source rows of the files in both
+
+        dsize, dmtime, dinfo = [], [], []
+        for dfile in dst.values():
+            dsize.append(dfile["size"])
+            dmtime.append(dfile["mtime"])  # None becomes NaN which never matches
+            dinfo.append(bool(dfile["dstinfo"]))
+
+        try:
+            dsize = np.array(dsize, dtype=np.int64)[both]
+            dmtime = np.array(dmtime, dtype=np.float64)[both]
+        except (TypeError, ValueError, OverflowError) as EE:  # e.g. NULL sizes
+            logger.debug(f"Cannot vectorize compare. {EE}")
+            return False
+        dinfo = np.array(dinfo, dtype=bool)[both]
+
+        same = np.frombuffer(src.sizes, dtype=np.int64)[ms] == dsize
+        if config.compare == "mtime":
+            smtime = np.frombuffer(src.mtimes, dtype=np.float64)[ms]
+            with np.errstate(invalid="ignore"):
+                same &= np.abs(smtime - dmtime) < config.dt
+
+        residue = dinfo.copy()
+        special = set(src.odd_rows())
+        if config.empty_directory_markers:  # Only then are they in the source
+            special.update(
+                row
+                for row, apath in enumerate(src_apaths)
+                if os.path.basename(apath) == DFB_EMPTY
+            )
+        if special:
+            residue |= np.isin(ms, list(special))
+
+        modified = np.zeros(len(src_apaths), dtype=bool)
+        modified[ms[~same & ~residue]] = True
+        for ii in np.flatnonzero(residue).tolist():
+            apath = src_apaths[ms[ii]]
+            if not self._compare_pair(apath, src[apath], dst[apath]):
+                modified[ms[ii]] = True
+
+        matched = np.zeros(len(src_apaths), dtype=bool)
+        matched[ms] = True
+
+        self.new = [src_apaths[ii] for ii in np.flatnonzero(~matched).tolist()]
+        self.modified = [src_apaths[ii] for ii in np.flatnonzero(modified).tolist()]
+        self.deleted = [dst_apaths[ii] for ii in np.flatnonzero(~both).tolist()]
+
+        logger.debug(
+            f"Vectorized compare of {len(ms)} files. "
+            f"{int(residue.sum())} compared individually"
+        )
+        return True
+
+    def _compare_merge(self):
+        """
+        Compare from the merge-join stream. Only the changed files are kept so
+        src_files has just the new and modified files and dst_files just the deleted
+        ones. That is all that is needed after this.
+        """
+        self.src_files = {}
+        self.dst_files = {}
+        self.deleted = []
+
+        counts = defaultdict(int)
+        records = self.merge_compare(self.sorted_src, self._sorted_dst())
+        for status, sfile, dfile in records:
+            counts[status] += 1
+            if status == "unchanged":
+                continue
+            if status == "deleted":
+                self.deleted.append(dfile["apath"])
+                self.dst_files[dfile["apath"]] = dfile
+                continue
+
+            self.src_files[sfile["apath"]] = sfile
+            if status == "new":
+                self.new.append(sfile["apath"])
             else:
-                compare = self.file_compare(sfile, dfile)
+                self.modified.append(sfile["apath"])
 
-            if not compare:
-                self.modified.append(apath)
+        logger.info(
+            f"Found {sum(counts.values()) - counts['deleted']} source Files. "
+            f"Backup contains {sum(counts.values()) - counts['new']} current files"
+        )
+
+    def _sorted_dst(self):
+        # A generator so that the DB is opened by the thread that reads it
+        config = self.config
+        d = self.dstdb.snapshot(
+            path=config.cliconfig.subdir,
+            checksums="hash"
+            in {config.compare, config.dst_compare, config.renames, config.dst_renames},
+            add_query="ORDER BY apath",
+        )
+        yield from map(self.dstdb.fullrow2lazy, d)
+
+    def iter_compare(self):
+        """
+        Like merge_compare but compares each source file against the in-memory
+        dst_files as it is listed. The "deleted" ones come at the end.
+        """
+        seen = set()
+        for sfile in self.iter_src(stats=self.config.stats):
+            apath = sfile["apath"]
+            seen.add(apath)
+            try:
+                dfile = self.dst_files[apath]
+            except KeyError:
+                yield "new", sfile, None
                 continue
 
-            # They match! But see if we need to update the dstdb with the better
-            # information at source. This enables things like using mtime for
-            # source-to-source but not for source-to-dest
-            if dfile["dstinfo"]:
-                logger.debug(f"Updating {apath!r} with src info")
-                new = dfile.copy()
-                new.update(sfile)
-                new["dstinfo"] = 0
-                self.update_dstdb.append(new)
+            if self._compare_pair(apath, sfile, dfile):
+                yield "unchanged", sfile, dfile
+            else:
+                yield "modified", sfile, dfile
+
+        for apath in self.dst_files.keys() - seen:
+            yield "deleted", None, self.dst_files[apath]
+
+    def merge_compare(self, src_files, dst_files):
+        """
+        Merge-join the source and destination files, both sorted by apath, and yield
+        (status, sfile, dfile) as they are decided. Status is "new", "modified",
+        "deleted", or "unchanged". sfile or dfile is None when not present.
+
+        Python str ordering matches SQLite's default (BINARY) ordering of the UTF-8
+        text so the destination can come straight from an "ORDER BY apath" cursor.
+        """
+        src_files, dst_files = iter(src_files), iter(dst_files)
+        sfile, dfile = next(src_files, None), next(dst_files, None)
+
+        while sfile is not None or dfile is not None:
+            if dfile is None or (sfile is not None and sfile["apath"] < dfile["apath"]):
+                yield "new", sfile, None
+                sfile = next(src_files, None)
+            elif sfile is None or dfile["apath"] < sfile["apath"]:
+                yield "deleted", None, dfile
+                dfile = next(dst_files, None)
+            else:
+                if self._compare_pair(sfile["apath"], sfile, dfile):
+                    yield "unchanged", sfile, dfile
+                else:
+                    yield "modified", sfile, dfile
+                sfile, dfile = next(src_files, None), next(dst_files, None)
+
+    def _compare_pair(self, apath, sfile, dfile):
+        """
+        Compare a file that is in both. Returns True if it is unchanged. Adds it to
+        update_dstdb if the dstdb needs the src info
+        """
+        if os.path.basename(apath) == DFB_EMPTY:
+            compare = True  # Always compare empties to true regardless of attribs
+        else:
+            compare = self.file_compare(sfile, dfile)
+
+        if not compare:
+            return False
+
+        # They match! But see if we need to update the dstdb with the better
+        # information at source. This enables things like using mtime for
+        # source-to-source but not for source-to-dest
+        if dfile["dstinfo"]:
+            logger.debug(f"Updating {apath!r} with src info")
+            new = dfile.copy()
+            new.update(sfile)
+            new["dstinfo"] = 0
+            self.update_dstdb.append(new)
+
+        return True
+
+    def pipeline(self):
+        """
+        Steps 1-4 of run() but new and modified files are uploaded as soon as they are
+        listed and compared. Rename tracking, the moves, and the deletes need the full
+        listing so they are done at the end. New files that may turn out to be moves
+        (there is a current file of the same size) wait for rename tracking.
+
+        With compare_method = "merge", the source has to be listed in full to be
+        sorted so uploads start during the compare rather than during the listing.
+        """
+        config = self.config
+        cliconfig = config.cliconfig
+
+        if cliconfig.refresh:
+            self.dstdb.reset(stats=config.stats, use_snapshots=cliconfig.use_snapshots)
+
+        if config.compare_method == "merge":
+            logger.info("Listing source")
+            sorted_src = self.list_src_sorted(stats=config.stats)
+            records = self.merge_compare(sorted_src, self._sorted_dst())
+        else:
+            self._proc_dst_files()
+            logger.info("Listing source")
+            records = self.iter_compare()
+
+        if config.renames or config.dst_renames:
+            sizes = self.dstdb.snapshot(path=cliconfig.subdir, select="DISTINCT size")
+            sizes = {row["size"] for row in sizes}
+        else:
+            sizes = set()
+
+        self.new, self.modified, self.deleted, self.update_dstdb = [], [], [], []
+        self.src_files = {}  # Only the changes. Filled as they are decided
+        dst_files = {}
+        sent = set()
+        counts = defaultdict(int)
+        errors = []
+
+        stats = StatsThread(self.config, 0, 0, daemon=True).start()
+
+        def _listed():
+            # Runs in the transfer's input thread. An exception there would never
+            # reach the workers so it is saved and raised below.
+            try:
+                for status, sfile, dfile in records:
+                    counts[status] += 1
+                    if status == "unchanged":
+                        continue
+                    if status == "deleted":
+                        self.deleted.append(dfile["apath"])
+                        dst_files[dfile["apath"]] = dfile
+                        continue
+
+                    apath = sfile["apath"]
+                    self.src_files[apath] = sfile
+                    if status == "modified":
+                        self.modified.append(apath)
+                    else:
+                        self.new.append(apath)
+                        if self._maybe_moved(sfile, sizes):
+                            continue  # wait for track_moves
+
+                    sent.add(apath)
+                    stats.add(sfile["size"])
+                    yield apath
+            except Exception as EE:
+                errors.append(EE)
+
+        def _held():
+            for apath in self.new:
+                if apath not in sent:
+                    stats.add(self.src_files[apath]["size"])
+                    yield apath
+
+        with self.dstdb.group_commit() as writer:
+            try:
+                self.transfer(_listed(), stats)
+                if errors:
+                    raise errors[0]
+
+                self.dst_files = dst_files  # Only the deleted, like "merge"
+                logger.info(
+                    f"Found {sum(counts.values()) - counts['deleted']} source Files. "
+                    f"Backup contains {sum(counts.values()) - counts['new']} "
+                    "current files"
+                )
+
+                self.dstdb.replace_many(self.update_dstdb)
+                self.track_moves()
+                self.action_summary()
+
+                self.transfer(_held(), stats)
+            finally:
+                stats.join()
+
+            if config.rename_method == "reference":
+                self.reference()
+            else:
+                self.move_by_copy()
+            self.delete()
+        self.errcount += len(writer.failed)
+
+    def _maybe_moved(self, sfile, sizes):
+        """Whether a new file could be matched by track_moves to a deleted one"""
+        if os.path.basename(sfile["apath"]) == DFB_EMPTY:
+            return False
+        if self.config.min_rename_size and sfile["size"] <= self.config.min_rename_size:
+            return False
+        return sfile["size"] in sizes
 
     def file_compare(self, sfile, dfile, attrib=None):
         config = self.config
@@ -388,14 +1200,18 @@ class Backup:
         # renamed, it looks like the old file is deleted and the
         # new file is created. So the candidates are pretty simple.
         #
-        # Since size must *always* match, we make a dictionary by sizes
-        # to reduce the pool
-
-        del_by_size = defaultdict(list)
+        # Rather than file_compare each new file against every deleted file of the
+        # same size, the deleted files are indexed by what must match for their
+        # attribute so each new file only looks up its real candidates. A unique
+        # candidate is then confirmed with file_compare.
+        index = RenameIndex(self.config)
         for apath in self.deleted:
             dfile = self.dst_files[apath]
-            del_by_size[dfile["size"]].append(dfile)
+            # Note that in the config dst_renames is already set to the correct
+            # values if it was None
+            index.add(dfile, dst_renames if dfile.get("dstinfo", 0) else renames)
 
+        counts = defaultdict(int)
         for apath in self.new:
             if os.path.basename(apath) == DFB_EMPTY:
                 continue
@@ -406,32 +1222,29 @@ class Backup:
                 self.config.min_rename_size
                 and sfile["size"] <= self.config.min_rename_size
             ):
-                logger.debug(
-                    f"Skipped rename track on {sfile['apath']!r}. "
-                    f"size = {sfile['size']} <= min_rename_size = "
-                    f"{self.config.min_rename_size}"
-                )
+                counts["small"] += 1
                 continue
 
-            dfiles0 = del_by_size[sfile["size"]]  # list of candidate paths
-            dfiles = []
-            for dfile in dfiles0:
-                # Note that in the config dst_renames is already set to the correct
-                # values if it was None
-                attrib = dst_renames if dfile.get("dstinfo", 0) else renames
-                if not attrib:
-                    continue
-
-                if self.file_compare(sfile, dfile, attrib=attrib):
-                    dfiles.append(dfile)
+            dfiles = index.candidates(sfile)
 
             if len(dfiles) == 1:
-                self.moves.append((dfiles[0], sfile))  # dfile,moved sfile
+                dfile, attrib = dfiles[0]
+                if self.file_compare(sfile, dfile, attrib=attrib):
+                    self.moves.append((dfile, sfile))  # dfile,moved sfile
             elif not dfiles:
-                logger.debug(f"no moves for deleted file {apath!r}")
-                continue
+                counts["unmatched"] += 1
             else:
-                logger.info(f"Too many matches for {apath!r}. Not moving")
+                # Only the first few are shown. The rest are in the total below
+                counts["ambiguous"] += 1
+                log = logger.info if counts["ambiguous"] <= MAX_LOGGED else logger.debug
+                log(f"Too many matches for {apath!r}. Not moving")
+
+        logger.info(
+            f"Rename tracking: {len(self.moves)} moved. "
+            f"{counts['ambiguous']} with too many matches (not moved). "
+            f"{counts['unmatched']} unmatched. "
+            f"{counts['small']} skipped <= min_rename_size"
+        )
 
         # Now we need to remove the moves from new and delete
         undelete = set()
@@ -444,17 +1257,33 @@ class Backup:
         # DO NOT UNDELETE!!! We still want them to be "deleted" with a delete marker
         # NO: self.deleted[:] = list(set(self.deleted) - undelete)
 
-    def transfer(self):
+    def transfer(self, apaths=None, stats=None):
+        """
+        Upload new and modified files. From pipeline(), 'apaths' is an iterator of
+        files as they are decided and 'stats' is already running and counting them.
+        """
         config = self.config
         # dst_rclone = self.config.dst_rclone
 
         # The upload pipeline is done in a functional programing(esque) fashion
         # to better enable concurrency.
 
-        comb = self.new + self.modified
-
-        N = len(comb)
-        totsize = sum(self.src_files[f]["size"] for f in comb)
+        pipelined = apaths is not None
+        lanes = config.large_file_size is not None
+        batches = config.batch_max_size is not None and config.batch_files > 1
+        if batches and self.rclone_version < MIN_RCLONE_BATCH:
+            logger.warning(
+                "Batched uploads need rclone "
+                f"{'.'.join(f'{i}' for i in MIN_RCLONE_BATCH)} or newer. Not used"
+            )
+            batches = False
+        if not pipelined:
+            apaths = self.new + self.modified
+            N = len(apaths)
+            totsize = sum(self.src_files[f]["size"] for f in apaths)
+            if lanes:  # Largest first so that the large lane starts right away
+                sizes = {apath: self.src_files[apath]["size"] for apath in apaths}
+                apaths.sort(key=sizes.get, reverse=True)
 
         def _apath2file(apath):
             ts = self.config.now.ts
@@ -465,7 +1294,6 @@ class Backup:
             file["dstinfo"] = False  # Since this is coming from the source
             return file
 
-        apaths = iter(comb)
         files = map(_apath2file, apaths)
 
         if config.cliconfig.dump:
@@ -475,8 +1303,11 @@ class Backup:
         rc = self.config.rc
         rc.start()
 
-        def _transfer(file):
+        last_start = [None]  # Of any transfer. For the tail
+
+        def _transfer(file, rclone_config=None):
             try:
+                last_start[0] = time.time()
                 sfile = self.config.src, file["apath"]
                 dfile = self.config.dst, file["rpath"]
 
@@ -498,7 +1329,8 @@ class Backup:
                     _config={
                         "NoCheckDest": True,
                         "metadata": meta,
-                    },
+                    }
+                    | (rclone_config or {}),
                 )
                 return file
             except Exception as EE:
@@ -506,21 +1338,140 @@ class Backup:
                 with LOCK:
                     self.errcount += 1
 
-        stats = StatsThread(self.config, N, totsize, daemon=True).start()
+        batch_count = iter(range(sys.maxsize))
 
-        files = tmap(_transfer, files, Nt=config.concurrency)
-        files = filter(bool, files)
-        # We could theoretically do an insert_many but that could lock the DB and/or
-        # require we accumulate. Instead, let it go right to insert which closes the DB
-        # each time. This is trivial compared to upload times. Plus, we want an upload
-        # to be recorded in the DB right away
-        files = map(self.dstdb.insert, files)
+        def _transfer_batch(files):
+            """
+            Upload the files in one rclone copy job. rclone's name transform adds the
+            timestamp like apath2rpath (see _batchable). Files that are not at the
+            destination afterwards are uploaded one at a time so errors are per file
+            """
+            last_start[0] = time.time()
+            ts = config.now.dt  # Formatted like in the rpath
+            nn = next(batch_count)
+            src_list = config.tmpdir / f"batch{nn}.src.txt"
+            dst_list = config.tmpdir / f"batch{nn}.dst.txt"
+            src_list.write_text(
+                "".join(f"{file['apath']}\n" for file in files), encoding="utf8"
+            )
+            dst_list.write_text(
+                "".join(f"{file['rpath']}\n" for file in files), encoding="utf8"
+            )
 
-        # Make them work
-        for file in files:
-            stats += 1
+            logger.info(f"Uploading a batch of {len(files)} files")
+            for file in files:
+                logger.debug(f"Batch {nn}: {file['apath']!r} to {file['rpath']!r}")
+
+            try:
+                rc.call(
+                    "sync/copy",
+                    srcFs=config.src,
+                    dstFs=config.dst,
+                    _filter={"FilesFromRaw": [str(src_list)]},
+                    _config={
+                        "NoCheckDest": True,
+                        "metadata": config.metadata,
+                        "NameTransform": [f"file,suffix_keep_extension=.{ts}"],
+                    },
+                )
+            except Exception as EE:
+                logger.debug(f"Batch {nn} error: {EE}. Checking each file")
+
+            try:
+                found = rc.list(
+                    (config.dst, ""),
+                    filter_params={"FilesFromRaw": [str(dst_list)]},
+                    modtime=False,
+                    only="files",
+                    fast_list=False,
+                )
+                found = {item["Path"] for item in found}
+            except Exception as EE:
+                logger.warning(f"Could not check batch {nn}: {EE}")
+                found = set()
+            finally:
+                src_list.unlink()
+                dst_list.unlink()
+
+            done = [file for file in files if file["rpath"] in found]
+            if missed := [file for file in files if file["rpath"] not in found]:
+                logger.info(
+                    f"Uploading {len(missed)} files of batch {nn} one at a time"
+                )
+            return done + [_transfer(file) for file in missed]
+
+        def _transfer_unit(unit):
+            """A file or a list of them for a batch. Returns a list"""
+            if isinstance(unit, list):
+                return _transfer_batch(unit)
+            return [_transfer(unit)]
+
+        if not pipelined:
+            stats = StatsThread(self.config, N, totsize, daemon=True).start()
 
-        stats.join()
+        def _record(results):
+            files = (file for files in results for file in files if file)
+            # Inside of group_commit (see run()), these are queued to the writer thread
+            # which commits them in groups. An upload is still recorded within at most
+            # a second or so and the workers never wait on the DB.
+            files = map(self._insert, files)
+
+            # Make them work
+            try:
+                for file in files:
+                    stats.increment()
+            finally:
+                results.close()  # Don't start more uploads if recording failed
+
+        t0 = time.time()
+        large_thread = None
+        if lanes:
+            large, files, stop_large = _split_lanes(files, config.large_file_size)
+            rclone_config = {"MultiThreadCutoff": config.large_file_size}
+            rclone_config |= config.large_file_rclone_config
+            large = tmap(
+                lambda file: [_transfer(file, rclone_config=rclone_config)],
+                large,
+                Nt=config.large_file_concurrency,
+            )
+            large_thread = ReturnThread(target=_record, args=(large,)).start()
+
+        if batches:
+            batchable = partial(
+                _batchable, max_size=config.batch_max_size, ts=config.now.dt
+            )
+            files = _batches(files, batchable, config.batch_files)
+
+        # When pipelined, take files as fast as they come so the listing never waits
+        # on the uploads
+        files = tmap(
+            _transfer_unit,
+            files,
+            Nt=concurrency_limit(
+                config,
+                lanes and config.small_file_concurrency,
+                name="transfers",
+            ),
+            Nin_buffer=-1 if pipelined else 1,
+        )
+        try:
+            _record(files)
+        finally:
+            try:
+                if large_thread:
+                    stop_large()  # Already done unless the small lane failed
+                    large_thread.join()  # Raises its errors
+            finally:
+                if not pipelined:
+                    stats.join()
+
+        # The tail is after the last transfer started, when slots are left idle
+        if last_start[0]:
+            t1 = time.time()
+            logger.info(
+                f"Transfers took {time_format(t1 - t0)}. "
+                f"Tail after the last one started: {time_format(t1 - last_start[0])}"
+            )
 
     def reference(self):
         config = self.config
@@ -553,35 +1504,21 @@ class Backup:
         rc = self.config.rc
         rc.start()
 
-        def _upload_ref(file):
-            original = file["original"]
+        def _ref(file):
             ref_rpath = file["ref_rpath"]
-            rpath = file["rpath"]
-
             ref = {
                 "ver": 2,
-                "rel": os.path.relpath(rpath, os.path.dirname(ref_rpath)),
+                "rel": os.path.relpath(file["rpath"], os.path.dirname(ref_rpath)),
             }
-            reftxt = json.dumps(ref)
-            try:
-                logger.info(
-                    f"Moving {original!r} to "
-                    f"{file['apath']!r} with "
-                    f"{ref_rpath!r}."
-                )
-                rc.write(
-                    (config.dst, ref_rpath),
-                    reftxt,
-                )
-                return file
-            except Exception as EE:
-                logger.error(f"Reference Error: {file['apath']!r}. {EE}")
-                with LOCK:
-                    self.errcount += 1
+            logger.info(
+                f"Moving {file['original']!r} to "
+                f"{file['apath']!r} with "
+                f"{ref_rpath!r}."
+            )
+            return ref_rpath, json.dumps(ref)
 
-        files = tmap(_upload_ref, files, Nt=config.concurrency)
-        files = filter(bool, files)
-        files = map(self.dstdb.insert, files)
+        files = self._write_small(files, _ref, action="Reference")
+        files = map(self._insert, files)
 
         # Make them work
         for file in files:
@@ -593,11 +1530,15 @@ class Backup:
         # The upload pipeline is done in a functional programing(esque) fashion
         # to better enable concurrency.
         moves = iter(self.moves)
+        # The copies keep the hashes even if they weren't loaded for the compare
+        hashes = self.dstdb.checksums(dfile for dfile, _ in self.moves)
 
         def _build_copiedfile(original_dfile, moved_sfile):
             ts = self.config.now.ts
 
             new = original_dfile.copy()
+            if found := hashes.get((new["apath"], new["timestamp"])):
+                new.setdefault("checksum", found)
             new.update(moved_sfile)
 
             new["original"] = original_dfile["apath"]
@@ -640,9 +1581,9 @@ class Backup:
                 with LOCK:
                     self.errcount += 1
 
-        files = tmap(_copy, files, Nt=config.concurrency)
+        files = tmap(_copy, files, Nt=concurrency_limit(config, name="copies"))
         files = filter(bool, files)
-        files = map(self.dstdb.insert, files)
+        files = map(self._insert, files)
 
         # Make them work
         for file in files:
@@ -655,11 +1596,15 @@ class Backup:
         # The upload pipeline is done in a functional programing(esque) fashion
         # to better enable concurrency.
         apaths = iter(self.deleted)
+        # Delete markers keep the hashes even if they weren't loaded for the compare
+        hashes = self.dstdb.checksums(self.dst_files[apath] for apath in self.deleted)
 
         def _apath2file(apath):
             ts = self.config.now.ts
 
             file = self.dst_files[apath].copy()
+            if found := hashes.get((file["apath"], file["timestamp"])):
+                file.setdefault("checksum", found)
             file["rpath"] = rpath = apath2rpath(file["apath"], ts, flag="D")
             file["timestamp"] = ts
             file["dstinfo"] = False  # Since this is coming from the source
@@ -676,23 +1621,70 @@ class Backup:
         rc.start()
 
         def _delete(file):
-            dfile = file["rpath"]
+            logger.info(f"Deleting {file['apath']!r} with {file['rpath']!r}.")
+            return file["rpath"], b"DEL"
+
+        files = self._write_small(files, _delete, action="Delete")
+        files = map(self._insert, files)
+
+        # Make them work
+        for file in files:
+            pass
+
+    def _insert(self, file):
+        """Insert into the dstdb. It is marked done in the plan journal once committed"""
+        return self.dstdb.insert(file, on_commit=self._journal_done)
+
+    def _journal_done(self, files):
+        if self.journal:
+            for file in files:
+                self.journal.done(file["apath"])
+
+    def _write_small(self, files, write, *, action):
+        """
+        Write small files such as delete markers and references. 'write(file)' logs the
+        action and returns (rpath, content). Files in the same directory are sent
+        together per 'write_batch_files', falling back to one at a time if that fails.
+        Yields the written files; errors are logged and counted.
+        """
+        config = self.config
+        rc = config.rc
+        batch_files = config.write_batch_files or 1
+
+        def _write_one(file, rpath, content):
             try:
-                logger.info(f"Deleting {file['apath']!r} with {dfile!r}.")
-                rc.write((config.dst, dfile), b"DEL")
+                rc.write((config.dst, rpath), content)
                 return file
             except Exception as EE:
-                logger.error(f"Delete Error: {file['apath']!r}. {EE}")
+                logger.error(f"{action} Error: {file['apath']!r}. {EE}")
                 with LOCK:
                     self.errcount += 1
 
-        files = tmap(_delete, files, Nt=config.concurrency)
-        files = filter(bool, files)
-        files = map(self.dstdb.insert, files)
+        def _write_group(group):
+            dirname, items = group
+            if len(items) > 1:
+                try:
+                    rc.write_many(
+                        (config.dst, dirname),
+                        {os.path.basename(rpath): body for _, rpath, body in items},
+                    )
+                    return [file for file, _, _ in items]
+                except Exception as EE:
+                    logger.debug(
+                        f"Writing {len(items)} files to {dirname!r} at once failed. "
+                        f"Writing them one at a time. {EE}"
+                    )
+            return [_write_one(*item) for item in items]
 
-        # Make them work
-        for file in files:
-            pass
+        items = ((file, *write(file)) for file in files)
+        if batch_files > 1:
+            groups = _write_groups(items, batch_files)
+        else:
+            groups = ((None, [item]) for item in items)
+
+        Nt = concurrency_limit(config, name=f"{action.lower()} writes")
+        for written in tmap(_write_group, groups, Nt=Nt):
+            yield from filter(bool, written)
 
     def action_summary(self):
         self.action_summary_text = []
@@ -792,7 +1784,7 @@ class Backup:
         if not config.logfile.exists():
             return
 
-        name = f"{self.config.now.dt}Z.log"
+        name = f"{(self.resumed_at or config.now).dt}Z.log"
         log_dests = [rcpathjoin(l, name) for l in listify(config.log_dest)]
 
         log_dests.append((config.dst, f".dfb/logs/{name}"))
@@ -818,6 +1810,83 @@ class Backup:
                 logger.error(f"Failed: {e}")
 
 
+class RenameIndex:
+    """
+    Index of deleted (destination) files for rename tracking keyed by what must
+    match under each file's attribute:
+
+        "size"  : size
+        "mtime" : (size, mtime bucket of width dt). Matches are in adjacent buckets
+        "hash"  : (size, hash name, value). Files that share no hash types with the
+                  new file match by size (as in Backup.file_compare) so they are also
+                  kept by (size, hash names)
+
+    candidates() gives the same matches as calling file_compare against every
+    deleted file of the same size but without the scan or its logging.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.by_size = defaultdict(list)
+        self.by_mtime = defaultdict(list)
+        self.by_hash = defaultdict(list)
+        self.by_hashtypes = defaultdict(lambda: defaultdict(list))  # size: types: [.]
+
+    def add(self, dfile, attrib):
+        size = dfile["size"]
+        if attrib == "size":
+            self.by_size[size].append(dfile)
+        elif attrib == "mtime":
+            if (bucket := self._bucket(dfile.get("mtime"))) is not None:
+                self.by_mtime[size, bucket].append(dfile)
+        elif attrib == "hash":
+            dcheck = dfile.get("checksum", {}) or {}
+            for name, value in dcheck.items():
+                self.by_hash[size, name, value].append(dfile)
+            self.by_hashtypes[size][frozenset(dcheck)].append(dfile)
+        # else: Not tracked
+
+    def _bucket(self, mtime):
+        dt = self.config.dt
+        if not isinstance(mtime, (int, float)) or math.isnan(mtime) or dt <= 0:
+            return None  # Can never be within dt
+        return math.floor(mtime / dt)
+
+    def candidates(self, sfile):
+        """List of (dfile, attrib) that match sfile"""
+        size = sfile["size"]
+        out = [(dfile, "size") for dfile in self.by_size.get(size, [])]
+
+        if (bucket := self._bucket(sfile.get("mtime"))) is not None:
+            smtime = sfile["mtime"]
+            for b in (bucket - 1, bucket, bucket + 1):
+                for dfile in self.by_mtime.get((size, b), []):
+                    if abs(smtime - dfile["mtime"]) < self.config.dt:
+                        out.append((dfile, "mtime"))
+
+        scheck = sfile.get("checksum", {}) or {}
+        seen = set()
+        for name, value in scheck.items():
+            for dfile in self.by_hash.get((size, name, value), []):
+                if id(dfile) in seen:
+                    continue
+                seen.add(id(dfile))
+                dcheck = dfile["checksum"]
+                shared = set(scheck).intersection(dcheck)
+                if all(dcheck[h] == scheck[h] for h in shared):
+                    out.append((dfile, "hash"))
+
+        for names, dfiles in self.by_hashtypes.get(size, {}).items():
+            if names.isdisjoint(scheck):  # Nothing to compare. Falls back to size
+                if self.config.error_on_missing_hash:
+                    raise NoCommonHashError(
+                        "Non compatible (or non existent) hashes. Change attributes"
+                    )
+                out.extend((dfile, "hash") for dfile in dfiles)
+
+        return out
+
+
 class StatsThread(Thread):
     def __init__(self, config, N, totsize, *args, **kwargs):
         self.config = config
@@ -841,13 +1910,17 @@ class StatsThread(Thread):
             self.fcount += n
         return self
 
+    def add(self, size):
+        """Add a file to the totals when they aren't known at the start"""
+        with LOCK:
+            self.N += 1
+            self.totsize += size
+
     __iadd__ = increment  # += n
 
     def run(self):
         inf = float("inf")
 
-        totnum, totunits = human_readable_bytes(self.totsize)
-
         self.config.rc.call("core/stats-reset")
         self.config.rc.call("core/stats")  # sets to 0
         while True:
@@ -867,6 +1940,7 @@ class StatsThread(Thread):
             msg.append(f"xfer {len(stats.get('transferring',''))};")
 
             bytesnum, bytesunits = human_readable_bytes(stats.get("bytes", 0))
+            totnum, totunits = human_readable_bytes(self.totsize)
             msg.append(
                 f"{self.fcount}/{self.N} "  # stats['totalTransfers'] includes active so use self.fcount
                 f"({bytesnum:6.2f} {bytesunits} / {totnum:<6.2f} {totunits});"
@@ -893,3 +1967,95 @@ class StatsThread(Thread):
         self.stop.put(True)
         super().join(*a, **k)
         logger.debug("Joined stats thread")
+
+
+class SourceFiles(Mapping):
+    """
+    Compact, columnar container of the source listing. Maps apath to the file dict as
+    listed but stores each apath once (as the index key), the sizes and mtimes in
+    arrays, and anything else (checksums, metadata, etc) in a side map.
+
+    Looking up a file builds a new dict so changes to it are not kept.
+    """
+
+    def __init__(self, files=()):
+        self._index = {}  # apath: row
+        self._sizes = array("q")
+        self._mtimes = array("d")  # NaN for None
+        self._intmtimes = bytearray()  # 1 if the mtime was an int. Kept exact in JSON
+        self._extra = {}  # row: dict of everything else
+
+        for file in files:
+            self.add(file)
+
+    def add(self, file):
+        file = file.copy()
+        apath = file.pop("apath")
+        size = file.pop("size")
+        mtime = file.pop("mtime", None)
+
+        # Anything that doesn't fit exactly goes in the side map
+        if type(size) is not int or not -(2**63) <= size < 2**63:
+            file["size"], size = size, -1
+        intmtime = type(mtime) is int and float(mtime) == mtime
+        if not (intmtime or type(mtime) is float):
+            if mtime is not None:
+                file["mtime"] = mtime
+            mtime = math.nan
+
+        if (row := self._index.get(apath)) is not None:  # Replace
+            self._sizes[row] = size
+            self._mtimes[row] = mtime
+            self._intmtimes[row] = intmtime
+            self._extra.pop(row, None)
+        else:
+            row = self._index[apath] = len(self._sizes)
+            self._sizes.append(size)
+            self._mtimes.append(mtime)
+            self._intmtimes.append(intmtime)
+
+        if file:
+            self._extra[row] = file
+
+    @property
+    def sizes(self):
+        """Array of sizes by row. See rows()"""
+        return self._sizes
+
+    @property
+    def mtimes(self):
+        """Array of mtimes by row with NaN for None. See rows()"""
+        return self._mtimes
+
+    def rows(self, apaths):
+        """The row of each apath (in the order of iteration) or -1 if missing"""
+        get = self._index.get
+        return array("q", (get(apath, -1) for apath in apaths))
+
+    def odd_rows(self):
+        """Rows where the size didn't fit in the array"""
+        return [row for row, extra in self._extra.items() if "size" in extra]
+
+    def __getitem__(self, apath):
+        row = self._index[apath]
+        mtime = self._mtimes[row]
+        if math.isnan(mtime):
+            mtime = None
+        elif self._intmtimes[row]:
+            mtime = int(mtime)
+        file = {"apath": apath, "size": self._sizes[row], "mtime": mtime}
+        if extra := self._extra.get(row):
+            file.update(extra)
+        return file
+
+    def __contains__(self, apath):
+        return apath in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def keys(self):
+        return self._index.keys()  # A set-like view for set operations
@@ -253,6 +253,29 @@ def parse(argv=None, shebanged=False):
             ⚠⚠⚠USE WITH CAUTION!⚠⚠⚠
             """,
     )
+    backup.add_argument(
+        "--changed-from",
+        metavar="FILE or -",
+        help="""
+            Only back up the paths listed in FILE (or stdin with "-"), separated by
+            NUL or newlines, such as from 'zfs diff' or an application log. They are
+            relative to the source or absolute under a local source. Paths ending in 
+            '/' are directories that are listed recursively. Listed paths that no 
+            longer exist are deleted. Everything else is assumed unchanged.
+            Filters still apply. Cannot be used with '--subdir'.
+            """,
+    )
+    backup.add_argument(
+        "--resume",
+        action="store_true",
+        help="""
+            Continue the saved plan of the last backup (see 'resume_journal') rather
+            than listing and comparing again. It uses the plan's timestamp and only
+            does what was not done. Planned source files are listed again; ones that
+            changed are uploaded as they are now and ones that are gone are skipped.
+            Cannot be used with '--subdir', '--changed-from', or '--refresh'.
+            """,
+    )
     backup.add_argument(
         "--refresh",
         action="store_true",
@@ -277,6 +300,49 @@ def parse(argv=None, shebanged=False):
             """,
     )
 
+    #################################################
+    ## Watch
+    #################################################
+
+    watch = subparsers["watch"] = subpar.add_parser(
+        "watch",
+        parents=[global_parent, config_global],
+        help="Watch a local source and back up changes as they happen",
+        description="""
+            Watch a local source with inotify (Linux only) and back up changes as they
+            happen. Starts with a full backup then, every interval, only lists and 
+            compares the changed files and directories. Runs a full backup again if 
+            events were missed and on a schedule. Runs until stopped.
+            """,
+    )
+    watch.add_argument(
+        "--interval",
+        type=float,
+        default=60,
+        metavar="SECONDS",
+        help="""
+            Time to collect changes before backing them up. Default: %(default)s
+            """,
+    )
+    watch.add_argument(
+        "--full-every",
+        type=float,
+        default=86400,
+        metavar="SECONDS",
+        help="""
+            Run a full backup at least this often to catch anything that was missed
+            such as changes to the filters. Set to 0 to disable. Default: %(default)s
+            """,
+    )
+    watch.set_defaults(  # Used by each backup
+        subdir="",
+        dry_run=False,
+        interactive=False,
+        dump=None,
+        refresh=False,
+        use_snapshots=True,
+    )
+
     #################################################
     ## Backup
     #################################################
@@ -722,6 +788,41 @@ def parse(argv=None, shebanged=False):
             """,
     )
 
+    #################################################
+    ## Advanced dbcheck
+    #################################################
+    dbcheck = subparsers["dbcheck"] = adv_subpar.add_parser(
+        "dbcheck",
+        parents=[global_parent, config_global],
+        help="Check the consistency of the local database",
+        description="""
+            [ADVANCED] Rebuild the table of current files from all versions in the
+            local database and compare it with the stored one. Mismatches are listed
+            and, by default, fixed. This does not refresh from the destination.
+            """,
+    )
+    dbcheck.add_argument(
+        "--fix",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Replace the stored table with the rebuilt one. Default: %(default)s.",
+    )
+
+    #################################################
+    ## Advanced checkpoint
+    #################################################
+    subparsers["checkpoint"] = adv_subpar.add_parser(
+        "checkpoint",
+        parents=[global_parent, config_global],
+        help="Write a consolidated snapshot checkpoint",
+        description="""
+            [ADVANCED] Compact all snapshot files into a single checkpoint in
+            '.dfb/snapshots/checkpoints/'. Refresh (and dbimport) will start from the
+            newest checkpoint and only read the snapshot files written after it. Older
+            snapshot files are not deleted. See also the 'checkpoint_every' setting.
+            """,
+    )
+
     #################################################
     ## Advanced prune path
     #################################################
@@ -933,12 +1034,15 @@ def _cli(cliconfig):
     verbosity = 0
     if cliconfig.command in {
         "backup",
+        "watch",
         "refresh",
         "restore-dir",
         "restore-file",
         "prune",
         "prune-file",
         "dbimport",
+        "dbcheck",
+        "checkpoint",
     }:
         verbosity += 1
     verbosity += getattr(cliconfig, "verbose", 0) - getattr(cliconfig, "quiet", 0)
@@ -993,14 +1097,52 @@ def _cli(cliconfig):
         ###########################################
         # This will handle the refresh on it's own so it can be concurrent
         if cliconfig.command == "backup":
-            from .backup import Backup
+            from .backup import Backup, Scope
 
             config._set_auto()
 
-            back = Backup(config)  # Two steps so the object is initialized even
-            back.run()  # ... if it fails
+            scope = None
+            if cliconfig.changed_from:
+                features = config.rc.features(config.src)
+                local = features.get("String", "").startswith("Local file")
+                root = features.get("Root", "") if local else ""
+                scope = Scope.from_file(cliconfig.changed_from, root=root)
+
+            if cliconfig.resume and (scope is not None or cliconfig.refresh):
+                raise ValueError(
+                    "Cannot use '--resume' with '--changed-from' or '--refresh'"
+                )
+
+            # Two steps so the object is initialized even if it fails
+            back = Backup(config, scope=scope, resume=cliconfig.resume)
+            back.run()
             return back
 
+        elif cliconfig.command == "watch":
+            from .watch import Watch
+
+            config._set_auto()
+
+            def new_config():
+                new = Config(
+                    cliconfig.config,
+                    tmpdir=cliconfig.temp_dir,
+                    verbosity=verbosity,
+                    add_params={"subdir": ""},
+                )
+                new.cliconfig = cliconfig
+                new.parse(override_txt="\n".join(cliconfig.override))
+                new._set_auto()
+                return new
+
+            Watch(
+                config,
+                new_config,
+                interval=cliconfig.interval,
+                full_every=cliconfig.full_every,
+            ).run()
+            return config
+
         elif cliconfig.command == "refresh":
             from .dstdb import DFBDST
 
@@ -1022,6 +1164,16 @@ def _cli(cliconfig):
                 upload=cliconfig.upload,
             )
             return config
+        elif cliconfig.command == "dbcheck":
+            from .dstdb import DFBDST
+
+            bad = DFBDST(config).check_latest(fix=cliconfig.fix)
+            return bad
+        elif cliconfig.command == "checkpoint":
+            from .dstdb import DFBDST
+
+            DFBDST(config).checkpoint()
+            return config
         elif cliconfig.command == "snapshot":
             from .listing import snapshot
 
@@ -0,0 +1,139 @@
+"""
+Adaptive concurrency. See the 'adaptive_concurrency' setting.
+
+An AdaptiveLimit is passed to thread_map_unordered as Nt. While it runs, rclone's
+core/stats are sampled and the number of workers is adjusted with additive increase,
+multiplicative decrease (AIMD):
+
+- New errors: multiply by DECREASE
+- Throughput fell by more than TOLERANCE after an increase: undo it
+- Workers waited for a slot (more work than workers): add one
+"""
+
+import math
+import time
+import queue
+import logging
+from threading import Thread
+
+from .threadmapper import Limit
+from .utils import human_readable_bytes
+
+logger = logging.getLogger(__name__)
+
+DECREASE = 0.5
+TOLERANCE = 0.2
+
+
+def concurrency_limit(config, value=None, *, name="workers"):
+    """
+    Nt for thread_map_unordered. The fixed 'value' (default 'concurrency') or, with
+    'adaptive_concurrency', an AdaptiveLimit starting from it
+    """
+    value = value or config.concurrency
+    if not config.adaptive_concurrency:
+        return value
+    return AdaptiveLimit(
+        config.rc,
+        value,
+        min=config.adaptive_concurrency_min,
+        max=config.adaptive_concurrency_max or 4 * value,
+        interval=config.adaptive_concurrency_interval,
+        name=name,
+    )
+
+
+class AdaptiveLimit(Limit):
+    """Limit adjusted from rclone's stats every 'interval' seconds while open"""
+
+    def __init__(self, rc, value, *, min=1, max=None, interval=10, name="workers"):
+        super().__init__(value, min=min, max=max)
+        self.rc = rc
+        self.interval = interval
+        self.name = name
+
+        self.waits = 0  # Workers that waited for a slot since the last update
+        self._last = None  # (bytes, done, errors) at the last update
+        self._rate = None  # (bytes/s, done/s)
+        self._increased = self._decreased = False
+
+        self._stop = queue.Queue()
+        self._thread = None
+
+    def __enter__(self):
+        with self._cond:
+            if self.active >= self._value:
+                self.waits += 1
+        return super().__enter__()
+
+    def open(self):
+        logger.debug(
+            f"Adaptive concurrency of {self.name}: "
+            f"{self.value} in [{self.min}, {self.max}]"
+        )
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.put(True)
+        self._thread.join()
+        logger.debug(f"Final concurrency of {self.name}: {self.value}")
+
+    def _run(self):
+        t0 = time.monotonic()
+        while True:
+            try:
+                if self._stop.get(block=True, timeout=self.interval):
+                    break
+            except queue.Empty:
+                pass
+
+            try:
+                stats = self.rc.call("core/stats")
+            except Exception as EE:
+                logger.debug(f"Could not get stats for adaptive concurrency: {EE}")
+                continue
+
+            t1 = time.monotonic()
+            self.update(stats, t1 - t0)
+            t0 = t1
+
+    def update(self, stats, dt):
+        """Adjust the limit from core/stats 'stats' taken 'dt' seconds after the last"""
+        with self._cond:
+            waits, self.waits = self.waits, 0
+
+        last = self._last
+        self._last = now = (
+            stats.get("bytes", 0),
+            stats.get("transfers", 0) + stats.get("deletes", 0),
+            stats.get("errors", 0),
+        )
+        # First sample or the stats were reset (e.g. by StatsThread)
+        if not last or any(n < l for n, l in zip(now, last)) or dt <= 0:
+            self._rate = None
+            return
+
+        rate = tuple((n - l) / dt for n, l in zip(now[:2], last[:2]))
+        old = self.value
+        if errors := now[2] - last[2]:
+            self.value = math.floor(old * DECREASE)
+            reason = f"{errors} new error{'s' if errors != 1 else ''}"
+        elif self._increased and self._rate and _fell(rate, self._rate):
+            self.value = old - 1
+            speed = human_readable_bytes(rate[0], fmt=True)
+            reason = f"throughput fell to {speed}/s and {rate[1]:0.1f} files/s"
+        elif waits and not self._decreased:
+            self.value = old + 1
+            reason = "workers waited for a slot"
+
+        self._increased = self.value > old
+        self._decreased = self.value < old
+        self._rate = rate
+        if self.value != old:
+            logger.info(f"Concurrency of {self.name}: {old} -> {self.value} ({reason})")
+
+
+def _fell(rate, prev):
+    """Whether both bytes/s and files/s fell by more than TOLERANCE"""
+    return all(r < (1 - TOLERANCE) * p for r, p in zip(rate, prev))
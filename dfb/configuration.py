@@ -298,6 +298,7 @@ class Config:
             "renames": {"size", "mtime", "hash", "auto", False, None},
             "dst_renames": {"size", "mtime", "hash", "auto", False, None},
             "rename_method": {"reference", "copy", False, None},
+            "compare_method": {"memory", "merge"},
             "get_modtime": {True, False, "auto"},
             "get_hashes": {True, False, "auto"},
         }
@@ -335,9 +336,19 @@ class Config:
             self._config.get("_uuid", self._config["config_id"])
         )
 
-        if mrs := self._config["min_rename_size"]:
-            from .utils import parse_bytes
+        from .utils import parse_bytes
+
+        self._config["refresh_memory_budget"] = parse_bytes(
+            self._config["refresh_memory_budget"]
+        )
+
+        if (bms := self._config["batch_max_size"]) is not None:
+            self._config["batch_max_size"] = parse_bytes(bms)
 
+        if (lfs := self._config["large_file_size"]) is not None:
+            self._config["large_file_size"] = parse_bytes(lfs)
+
+        if mrs := self._config["min_rename_size"]:
             self._config["min_rename_size"] = mrs1 = parse_bytes(mrs)
             logger.debug(f"Parsed min_rename_size {mrs!r} as {mrs1!r} bytes")
 
@@ -487,6 +498,12 @@ rename_method = "reference"  # 'reference', 'copy'
 # normal prefixes or an integer byte count (e.g. 2097152, "2 KiB", "10 MB", "15 MiB")
 min_rename_size = 0
 
+# How the source and the backup are compared. "memory" holds both listings in memory.
+# "merge" sorts the source listing (spilling to temporary files as needed) and merges
+# it with the database in order so memory scales with the number of changes rather
+# than the number of files. Useful for very large sources.
+compare_method = "memory"  # "memory", "merge"
+
 ##############################################
 ##             rclone Settings              ##
 ##         (optional, intermediate)         ##
@@ -508,6 +525,13 @@ rclone_env = {}
 # Flags for refresh specifically. Example: --fast-list
 dst_list_rclone_flags = []
 
+# Split the source and destination listings into this many concurrent 'rclone lsjson'
+# calls. The directories at 'list_partition_depth' are found with a shallow listing and
+# divided among them. Useful on remotes without ListR (--fast-list). Not used with
+# '--include', '--include-from', '--files-from', or '--ignore-case' filters.
+list_partitions = 1
+list_partition_depth = 1
+
 # Executable
 rclone_exe = "rclone"
 
@@ -520,6 +544,58 @@ rclone_exe = "rclone"
 # --s3-upload-concurrency.
 concurrency = os.cpu_count()
 
+# Save the plan of each backup in '<config_id>.plan.db' alongside the database and mark
+# what is done as it goes. An interrupted backup can then be continued with
+# 'dfb backup --resume' without listing again. Only the planned source files are listed
+# again to catch any changes since. Writing the plan costs time on large backups so it
+# is off by default. Pipelined backups (see 'pipeline') are never journaled and cannot
+# be resumed.
+resume_journal = False
+
+# Adapt the number of concurrent transfers, moves, deletes, references, prunes, and
+# restores while running from rclone's stats, sampled every
+# 'adaptive_concurrency_interval' seconds. Starting from 'concurrency', a worker is added
+# while there is more work than workers, the last one is removed if throughput then
+# fell, and they are halved on new errors. Stays within 'adaptive_concurrency_min' and
+# 'adaptive_concurrency_max' (None is 4 times the start). Changes are logged.
+adaptive_concurrency = False
+adaptive_concurrency_min = 1
+adaptive_concurrency_max = None
+adaptive_concurrency_interval = 10  # seconds
+
+# Start uploading new and modified files while the source is still being listed rather
+# than after. Moves and deletes are still done at the end. Dry-runs, --dump, and
+# --interactive are always done in stages.
+pipeline = False
+
+# Transfer files of at least 'large_file_size' in their own lane with
+# 'large_file_concurrency' at a time, starting with the largest, so a few big files
+# don't all end up at the end. They also get 'large_file_rclone_config', rclone's
+# global options by their rc '_config' names, such as for multi-thread streams (the
+# cutoff is set to 'large_file_size'). The rest use 'small_file_concurrency' (None uses
+# 'concurrency'). None disables the lanes. Sizes are like 'min_rename_size'.
+large_file_size = None
+large_file_concurrency = 2
+large_file_rclone_config = {"MultiThreadStreams": 8}
+small_file_concurrency = None
+
+# Upload files up to 'batch_max_size' in batches of 'batch_files' with one rclone copy
+# job each rather than one call per file. The rpath is set with rclone's name transform
+# so names with more than one '.' are still uploaded on their own. Files missing after
+# a batch are retried on their own. Needs rclone 1.70. None disables batches.
+batch_max_size = None
+batch_files = 1000
+
+# Write delete markers and reference files with one upload per directory of up to
+# 'write_batch_files' files (e.g. 100) rather than one per file. On an error, the files
+# are written one at a time. None or 1 disables it.
+write_batch_files = None
+
+# Number of reference files to read at once when resolving references in a refresh
+# without snapshots. None uses 'concurrency'. The contents are cached locally alongside
+# the database so they are only ever downloaded once.
+reference_concurrency = None
+
 # Tolerance on mtimes
 dt = 1.0  # seconds
 
@@ -535,6 +611,16 @@ hash_type = None
 # Whether to always request hashes. "auto" maps to False for now
 get_hashes = False  # True, False, "auto"
 
+# Cache the hashes of a local source in '<config_id>.hashes.db' alongside the database.
+# Files whose path, size, mtime, and inode are unchanged are not hashed again; the rest
+# are hashed in parallel. Only for local sources and md5, sha1, sha256, sha512, crc32.
+hash_cache = False
+
+# List a local source with a native, threaded scanner rather than 'rclone lsjson'. Falls
+# back to rclone when the filters or flags are not supported, when rclone would compute
+# hashes (see 'hash_cache'), or with 'metadata' (needs file birth times).
+local_scanner = False
+
 # Request and transfer (if possible) metadata. Metadata is also stored in the snapshot
 # files in case the dst doesn't support it. However, it must be restored manually if not
 # supported. Changes in file metadata will *not* force a backup again.
@@ -548,6 +634,14 @@ log_dest = None
 # processed and cleaned as needed
 config_id = f"{src}-{dst}"
 
+# Approximate memory for the database (primarily the staged snapshots) during a
+# refresh. Beyond this, it is spilled to temporary files on disk.
+refresh_memory_budget = "256 MB"
+
+# Write a checkpoint (see `advanced checkpoint`) after a backup when there have been at
+# least this many snapshot files since the last one. None or 0 to disable.
+checkpoint_every = None
+
 # Specify where to store the file database. Default (None) is
 # `<rclone cache dir>/DFB/<config_id>.db`.
 dbcache_dir = None
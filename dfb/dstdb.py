@@ -9,17 +9,22 @@ import time
 import io
 import json
 import logging
+import re
 import string
 import shutil
+import queue
 import gzip as gz
+from collections.abc import MutableMapping
+from contextlib import contextmanager
 from functools import partialmethod
+from itertools import islice
+from threading import Thread
 from textwrap import dedent, indent
 
 from . import __version__, nowfun, rpath2apath, apath2rpath
 from .utils import (
     time2all,
     MyRow,
-    star,
     listify,
     smart_open,
     randstr,
@@ -27,13 +32,42 @@ from .utils import (
     NoTimestampInNameError,
 )
 from .timestamps import timestamp_parser
-from .rclonerc import IGNORED_FILE_DATA, rcpathjoin
+from .rclonerc import IGNORED_FILE_DATA, RcloneError, rcpathjoin
 from .threadmapper import thread_map_unordered as tmap
 
 
 logger = logging.getLogger(__name__)
 
 
+def parse_version(version):
+    """
+    Parse a dfb version string ('20241121.0') into a comparable tuple. Missing or
+    unparsable versions are treated as older than everything.
+    """
+    try:
+        return tuple(int(v) for v in str(version).split("."))
+    except (TypeError, ValueError):
+        return (0,)
+
+
+# The ids of a directory and all directories below it. Replace PATH with the parameter.
+# Case-insensitive to match the 'LIKE' that this replaced.
+SUBDIRS_QUERY = """
+    WITH RECURSIVE subdirs(id) AS (
+        SELECT id FROM dirs WHERE path = PATH COLLATE NOCASE
+        UNION ALL
+        SELECT dirs.id FROM dirs JOIN subdirs ON dirs.parent = subdirs.id
+    )
+    SELECT id FROM subdirs"""
+
+
+# The checksums of a row as "type:value type:value". Decoded by fullrow2dict
+HASHES_SELECT = """(
+        SELECT group_concat(hashtype || ':' || value, ' ') FROM checksums 
+        WHERE checksums.apath = TABLE.apath AND checksums.timestamp = TABLE.timestamp
+    ) AS hashes"""
+
+
 def sqldebug(sql):
     return
     sql = "\n".join(line for line in sql.split("\n") if line.strip())
@@ -59,15 +93,20 @@ class DFBDST:
         ("remain", "TEXT"),
     )
 
-    def __init__(self, config):
+    def __init__(self, config, *, resumed_at=None):
         self.config = config
         self.dst_rclone = dst_rclone = config._config["dst_rclone"]
         self.dbcache_dir = config.dbcache_dir
 
+        # A resumed backup (see Backup.load_plan) records at the planned timestamp
+        # ('now') so its snapshot also gets when it ran, not to replace the first one
+        name = f"{self.config.now.dt}Z"
+        if resumed_at:
+            name += f".resumed{resumed_at.dt}Z"
         self.snap_file = (
             self.config.snap_cache_dir
             / self.config.now.obj.strftime("%Y/%m")
-            / f"{self.config.now.dt}Z.jsonl"
+            / f"{name}.jsonl"
         )
         self.snap_file.parent.mkdir(exist_ok=True, parents=True)
 
@@ -75,6 +114,7 @@ class DFBDST:
         dbpath.parent.mkdir(exist_ok=True, parents=True)
 
         self.dbpath = dbpath
+        self._writer = None
 
         self.init()
 
@@ -82,14 +122,31 @@ class DFBDST:
         db = sqlite3.connect(self.dbpath, check_same_thread=True)
         db.row_factory = MyRow
         db.set_trace_callback(sqldebug)
+
+        # WAL (set in init) is safe with NORMAL. Commits are still atomic but not
+        # synced until a checkpoint. Only the very last commits could be lost on
+        # a power failure and refresh can always recover.
+        db.execute("PRAGMA synchronous = NORMAL")
+        db.execute(f"PRAGMA cache_size = -{self.CACHE_KIB}")
         return db
 
+    CACHE_KIB = 64 * 1024  # 64 MiB. Per connection
+
+    def _unlink(self):
+        """Remove the DB including the WAL files"""
+        for suffix in ["", "-wal", "-shm"]:
+            Path(f"{self.dbpath}{suffix}").unlink(missing_ok=True)
+
     def init(self):
         # We will only write to the DB in the main thread but will
         # read in many
         items = ",".join((" ".join(row)) for row in self.COLS)
         db = self.db()
 
+        # Persistent in the file. Lets readers (e.g. listing while a backup is
+        # running) not block the writer and makes small commits much cheaper.
+        db.execute("PRAGMA journal_mode = WAL")
+
         # test:
         try:
             with db:
@@ -100,12 +157,16 @@ class DFBDST:
                     ORDER BY key""",
                     ("created", "version"),
                 ).fetchall()
-                if len(r) == 2:  # Note it is ORDER BY so the order wont change
-                    created, version = [i["val"] for i in r]
-                    logger.debug(f"dstdb exists. {created = } {version = }")
-                    return
         except:
             logger.debug("Recreate dstdb")
+            r = []
+
+        if len(r) == 2:  # Note it is ORDER BY so the order wont change
+            created, version = [i["val"] for i in r]
+            logger.debug(f"dstdb exists. {created = } {version = }")
+            self.migrate(db, version)
+            db.close()
+            return
 
         with db:
             db.execute(
@@ -131,14 +192,377 @@ class DFBDST:
                 """,
                 ("created", self.config.now.obj.isoformat()),
             )
+
+        # New DBs go through the same migrations as old ones so there is only one
+        # definition of the schema. This also sets the version
+        self.migrate(db, None)
+        db.close()
+
+    # Schema migrations. Each is a (version, method name) pair where version is the
+    # dfb version that introduced it. They are applied in order to any DB whose kv
+    # 'version' is older and then the 'version' is set to the current __version__.
+    # Methods must be idempotent (e.g. 'IF NOT EXISTS') and take a connection.
+    MIGRATIONS = (
+        ("20261017.0", "_migrate_indexes"),
+        ("20261017.0", "_migrate_latest"),
+        ("20261017.0", "_migrate_dirs"),
+        ("20261017.0", "_migrate_checksums"),
+    )
+
+    # Migrations that change items or latest. It is rebuilt once after all of them
+    REBUILD_LATEST = {"_migrate_latest", "_migrate_dirs", "_migrate_checksums"}
+
+    def migrate(self, db, version):
+        """
+        Apply any migrations newer than 'version' (None means a new DB) and update the
+        stored version.
+        """
+        dbver = parse_version(version)
+        todo = [name for ver, name in self.MIGRATIONS if parse_version(ver) > dbver]
+
+        if version is not None and version == __version__ and not todo:
+            return
+
+        for name in todo:
+            logger.info(f"Migrating dstdb from {version = } with {name!r}")
+            getattr(self, name)(db)
+
+        if self.REBUILD_LATEST.intersection(todo):
+            self._rebuild_latest(db)
+
+        with db:
+            db.execute("REPLACE INTO kv VALUES (?,?)", ("version", __version__))
+
+    @staticmethod
+    def _migrate_indexes(db):
+        """
+        Secondary indexes. Without these, lookups by rpath (references, pruning,
+        versions --ref-count), the unresolved-reference scan, timestamp ranges, and
+        case-insensitive ordering are all full table scans.
+        """
+        with db:
+            db.executescript(
+                """
+                -- _update_references, Prune.byrpaths, delete_rpath, ref counts
+                CREATE INDEX IF NOT EXISTS items_rpath ON items(rpath);
+
+                -- Partial index of the (few) references that still need resolving
+                CREATE INDEX IF NOT EXISTS items_unresolved_ref 
+                    ON items(rpath) WHERE isref = 2;
+
+                -- before/after ranges. Includes size and isref so that timestamps
+                -- and summary aggregates (and totals) are covered by the index
+                CREATE INDEX IF NOT EXISTS items_timestamp 
+                    ON items(timestamp, size, isref);
+
+                -- ORDER BY LOWER(apath),timestamp in group_by_apath and listings
+                CREATE INDEX IF NOT EXISTS items_lower_apath 
+                    ON items(LOWER(apath), timestamp);
+                """
+            )
+            db.execute("PRAGMA optimize")
+
+    @classmethod
+    def _migrate_latest(cls, db):
+        """
+        The 'latest' table is the most recent row for every apath (including delete
+        markers). It is a materialized version of the "no before/after" snapshot and
+        is kept up to date on every write. See _update_latest.
+        """
+        items = ",".join((" ".join(row)) for row in cls.COLS)
+        with db:
             db.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS
+                latest(
+                    {items},
+                    PRIMARY KEY (apath)
+                )"""
+            )
+
+    @classmethod
+    def _migrate_dirs(cls, db):
+        """
+        Directory table, dirs(id, parent, name, path), with the root as id 0, and a
+        dir_id on items (and latest) for the parent directory of each apath. These let
+        listing a directory, or a subtree, use an index rather than a LIKE on apath.
+        dir_id is maintained by _update_dirs on every write.
+        """
+        with db:
+            for table in ["items", "latest"]:
+                cols = db.execute(f"PRAGMA table_info({table})").fetchall()
+                cols = [row["name"] for row in cols]
+                if "dir_id" not in cols:
+                    db.execute(f"ALTER TABLE {table} ADD COLUMN dir_id INTEGER")
+
+            db.executescript(
                 """
-                INSERT OR IGNORE INTO kv VALUES (?,?)
+                CREATE TABLE IF NOT EXISTS 
+                dirs(
+                    id INTEGER PRIMARY KEY,
+                    parent INTEGER,
+                    name TEXT,
+                    path TEXT
+                );
+                INSERT OR IGNORE INTO dirs VALUES (0, NULL, '', '');
+
+                CREATE UNIQUE INDEX IF NOT EXISTS dirs_path ON dirs(path);
+                CREATE UNIQUE INDEX IF NOT EXISTS dirs_parent ON dirs(parent, name);
+
+                -- Path lookups are case-insensitive like the LIKE they replace
+                CREATE INDEX IF NOT EXISTS dirs_path_nocase 
+                    ON dirs(path COLLATE NOCASE);
+
+                CREATE INDEX IF NOT EXISTS items_dir ON items(dir_id);
+                CREATE INDEX IF NOT EXISTS latest_dir ON latest(dir_id);
+
+                -- Partial index of the rows that still need a dir_id
+                CREATE INDEX IF NOT EXISTS items_nodir 
+                    ON items(apath) WHERE dir_id IS NULL;
+                """
+            )
+        with db:
+            cls._update_dirs(db)
+
+    @classmethod
+    def _migrate_checksums(cls, db):
+        """
+        Checksums are stored in checksums(apath, timestamp, hashtype, value), keyed
+        like the items, rather than as JSON in the items 'checksum' column (which is
+        now always NULL). They are only read when asked for. See HASHES_SELECT and
+        fullrow2dict. Also re-encodes 'remain' compactly.
+        """
+        with db:
+            db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS 
+                checksums(
+                    apath TEXT,
+                    timestamp INTEGER,
+                    hashtype TEXT,
+                    value TEXT,
+                    PRIMARY KEY (apath, timestamp, hashtype)
+                ) WITHOUT ROWID;
+
+                -- Lookups by hash
+                CREATE INDEX IF NOT EXISTS checksums_value 
+                    ON checksums(hashtype, value);
+                """
+            )
+
+        rowid = -1
+        while True:
+            with db:
+                rows = db.execute(
+                    """
+                    SELECT rowid, * FROM items 
+                    WHERE rowid > ? AND (checksum IS NOT NULL OR remain IS NOT NULL)
+                    ORDER BY rowid LIMIT 50000""",
+                    (rowid,),
+                ).fetchall()
+                if not rows:
+                    break
+                rowid = rows[-1]["rowid"]
+
+                files = [cls.fullrow2dict(row) for row in rows]
+                for file in files:
+                    del file["rowid"]
+                cls._write_checksums(db, files)
+                db.executemany(
+                    "UPDATE items SET checksum = NULL, remain = ? WHERE rowid = ?",
+                    (
+                        (cls.dict2fullrow(file)[-1], row["rowid"])
+                        for file, row in zip(files, rows)
+                    ),
+                )
+
+    @staticmethod
+    def _write_checksums(db, files):
+        """
+        Store the checksums of the files, replacing any of the same item. References
+        without a 'checksum' get their referent's. Should be called in the same
+        transaction as the change to items
+        """
+        db.executemany(
+            "DELETE FROM checksums WHERE apath = ? AND timestamp = ?",
+            ((file["apath"], file["timestamp"]) for file in files),
+        )
+        rows = (
+            (file["apath"], file["timestamp"], hashtype, value)
+            for file in files
+            for hashtype, value in (file.get("checksum", None) or {}).items()
+            if value
+        )
+        db.executemany("INSERT INTO checksums VALUES (?,?,?,?)", rows)
+        db.executemany(
+            """
+            INSERT OR IGNORE INTO checksums 
+            SELECT ?, ?, c.hashtype, c.value FROM items o 
+            JOIN checksums c ON c.apath = o.apath AND c.timestamp = o.timestamp
+            WHERE o.rpath = ? AND NOT o.isref""",
+            (
+                (file["apath"], file["timestamp"], file["rpath"])
+                for file in files
+                if file.get("isref") and "checksum" not in file
+            ),
+        )
+
+    @classmethod
+    def _delete_rpaths(cls, db, rpaths):
+        """
+        Delete all items that point to 'rpaths', including references, with their
+        checksums. Updates latest and dirs. Should be called in a transaction
+        """
+        rpaths = [(rpath,) for rpath in rpaths]
+        apaths = set()
+        for rpath in rpaths:
+            res = db.execute("SELECT apath FROM items WHERE rpath = ?", rpath)
+            apaths.update(row["apath"] for row in res)
+
+        db.executemany(
+            """
+            DELETE FROM checksums 
+            WHERE (apath, timestamp) IN (
+                SELECT apath, timestamp FROM items WHERE rpath = ?
+            )""",
+            rpaths,
+        )
+        db.executemany("DELETE FROM items WHERE rpath = ?", rpaths)
+        cls._update_latest(db, apaths)
+        cls._prune_dirs(db, apaths)
+
+    @staticmethod
+    def _update_dirs(db):
+        """
+        Set the dir_id for all items without one, adding to the dirs table as
+        needed. Should be called in the same transaction as the change to items and
+        before _update_latest so that it gets copied.
+        """
+        ids = {}
+
+        def _dir_id(path):
+            if path in ids:
+                return ids[path]
+
+            row = db.execute("SELECT id FROM dirs WHERE path = ?", (path,)).fetchone()
+            if row:
+                ids[path] = row[0]
+                return row[0]
+
+            parent = _dir_id(os.path.dirname(path))
+            ids[path] = db.execute(
+                "INSERT INTO dirs (parent, name, path) VALUES (?,?,?)",
+                (parent, os.path.basename(path), path),
+            ).lastrowid
+            return ids[path]
+
+        while True:
+            res = db.execute(
+                "SELECT DISTINCT apath FROM items WHERE dir_id IS NULL LIMIT 50000"
+            )
+            apaths = [row[0] for row in res]
+            if not apaths:
+                break
+            db.executemany(
+                "UPDATE items SET dir_id = ? WHERE apath = ? AND dir_id IS NULL",
+                ((_dir_id(os.path.dirname(apath)), apath) for apath in apaths),
+            )
+
+    @staticmethod
+    def _prune_dirs(db, apaths):
+        """
+        Remove the directories of 'apaths', and their parents, that no longer have any
+        items or subdirectories. Call after deleting items
+        """
+        paths = set()
+        for apath in apaths:
+            while path := os.path.dirname(apath):
+                paths.add(path)
+                apath = path
+
+        for path in sorted(paths, key=lambda path: path.count("/"), reverse=True):
+            db.execute(
+                """
+                DELETE FROM dirs 
+                WHERE 
+                    path = ?
+                    AND NOT EXISTS (SELECT 1 FROM items WHERE items.dir_id = dirs.id)
+                    AND NOT EXISTS (SELECT 1 FROM dirs AS sub WHERE sub.parent = dirs.id)
                 """,
-                ("version", __version__),
+                (path,),
             )
-        db.commit()
+
+    @classmethod
+    def _insert_sql(cls, action="INSERT"):
+        """SQL to insert (or replace) dict2fullrow rows. dir_id is set later"""
+        names = ",".join(name for name, _ in cls.COLS)
+        marks = ",".join("?" for _ in cls.COLS)
+        return f"{action} INTO items ({names}) VALUES ({marks})"
+
+    @staticmethod
+    def _rebuild_latest(db, table="latest"):
+        """Rebuild the (existing) latest table from items"""
+        with db:
+            db.execute(f"DELETE FROM {table}")
+            db.execute(
+                f"""
+                INSERT INTO {table}
+                SELECT * FROM items
+                GROUP BY apath HAVING MAX(timestamp)"""
+            )
+
+    @staticmethod
+    def _update_latest(db, apaths):
+        """
+        Update the latest table for the given apaths. Should be called inside the
+        same transaction as the change to items.
+        """
+        apaths = [(apath,) for apath in set(apaths)]
+        db.executemany("DELETE FROM latest WHERE apath = ?", apaths)
+        db.executemany(
+            """
+            INSERT INTO latest
+            SELECT * FROM items WHERE apath = ?
+            ORDER BY timestamp DESC LIMIT 1""",
+            apaths,
+        )
+
+    def check_latest(self, fix=True):
+        """
+        Rebuild the latest table from items and compare. Returns the list of apaths
+        that did not match. If fix, will replace the latest table with the rebuilt one
+        """
+        db = self.db()
+        with db:
+            db.execute("CREATE TEMP TABLE latest_check AS SELECT * FROM latest LIMIT 0")
+        self._rebuild_latest(db, table="temp.latest_check")
+
+        bad = db.execute(
+            """
+            SELECT apath FROM (
+                SELECT * FROM latest_check EXCEPT SELECT * FROM latest
+            )
+            UNION
+            SELECT apath FROM (
+                SELECT * FROM latest EXCEPT SELECT * FROM latest_check
+            )
+            ORDER BY apath"""
+        )
+        bad = [row["apath"] for row in bad]
+
+        n = db.execute("SELECT COUNT(*) AS n FROM latest_check").fetchone()["n"]
+        logger.info(f"Checked {n} current entries. {len(bad)} did not match")
+        for apath in bad:
+            logger.info(f"   mismatch: {apath!r}")
+
+        if bad and fix:
+            with db:
+                db.execute("DELETE FROM latest")
+                db.execute("INSERT INTO latest SELECT * FROM latest_check")
+            logger.info("Replaced 'latest' with rebuilt table")
+
         db.close()
+        return bad
 
     def reset(self, stats=None, *, use_snapshots):
         if self.config.disable_refresh:
@@ -146,40 +570,65 @@ class DFBDST:
             logger.error("Run with `--override 'disable_refresh = False'` to override")
             raise ValueError("Refresh Disabled")
 
-        self.dbpath.unlink()
+        self._unlink()
         self.init()
 
-        files = list(self._relist(stats=stats))  # Need them all to get snapshots
-        logger.info(
-            f"Found {len(files)} at dest "
-            f"with {sum(f.get('isref',0) == 2 for f in files)} reference(s)"
-        )
+        db = self.db()
+        # The snapshot staging table lives in temp storage and will spill to disk
+        # beyond this
+        budget = self.config.refresh_memory_budget
+        db.execute(f"PRAGMA cache_size = -{max(budget // 1024, 2048)}")
 
+        # Load the snapshots first so they can be applied to each listed file as it
+        # arrives. The listing is then never held in memory
         if use_snapshots:
-            self._load_snapshots()
-            files = (self._apply_snapshot_file(file) for file in files)
+            self._load_snapshots(db)
 
-        db = self.db()
-        for ii, file in enumerate(files):
-            db.execute(
-                f"INSERT INTO items VALUES ({','.join('?' for _ in DFBDST.COLS)})",
-                DFBDST.dict2fullrow(file),
-            )
-            if ii % 100 == 0:  # Frequent commits but not every time.
-                db.commit()
-        db.commit()
+        counts = {"files": 0, "refs": 0}
+
+        def _count(file):
+            counts["files"] += 1
+            counts["refs"] += file.get("isref", 0) == 2
+            return file
+
+        files = map(_count, self._relist(stats=stats))
+
+        sql = self._insert_sql()
+        while chunk := list(islice(files, self.RESET_CHUNK)):
+            if use_snapshots:
+                snaps = self._staged_snapshots(db, chunk)
+                chunk = [
+                    self._apply_snapshot_file(file, snaps.get(self._stage_key(file)))
+                    for file in chunk
+                ]
+            with db:
+                db.executemany(sql, map(DFBDST.dict2fullrow, chunk))
+                self._write_checksums(db, chunk)
+                self._update_dirs(db)
         db.close()
 
+        logger.info(
+            f"Found {counts['files']} at dest with {counts['refs']} reference(s)"
+        )
+
         # Update those with isref = 2. Do this after full listing
         self._update_references()
 
+        db = self.db()
+        self._rebuild_latest(db)
+        db.close()
+
+    RESET_CHUNK = 50_000  # Rows per transaction in reset()
+
     def _relist(self, stats=None):
         self._snapshot_list = []
 
         config = self.config
         flags = config.dst_list_rclone_flags
 
-        files = config.dst_rclone.listremote(
+        files = config.dst_rclone.listremote_partitioned(
+            partitions=config.list_partitions,
+            depth=config.list_partition_depth,
             mimetype=False,
             # Notice modtime and hashes are only if needed and not using get_modtime
             # or get_hashes
@@ -230,134 +679,374 @@ class DFBDST:
             yield new
 
     def _update_references(self):
+        """
+        Resolve all unresolved references (isref = 2). The reference files are read
+        concurrently (reference_concurrency) with the raw contents cached by rpath
+        (and size) in a local DB that survives refreshes. Then all references are
+        resolved in one join against a temp table of referents.
+        """
         db = self.db()
-        with db:
-            files = db.execute("""SELECT * FROM items WHERE isref = 2""")
-            files = files.fetchall()
+        res = db.execute("SELECT rpath, size FROM items WHERE isref = 2")
+        sizes = {row["rpath"]: row["size"] for row in res}
+        rpaths = list(sizes)
 
-        if not files:
+        if not rpaths:
+            db.close()
             return
 
-        logger.info(f"Need to fetch {len(files)} references")
+        cache = self.refcache()
+        contents = {}
+        for ii in range(0, len(rpaths), 500):
+            chunk = rpaths[ii : ii + 500]
+            res = cache.execute(
+                f"SELECT * FROM refs WHERE rpath IN ({','.join('?' for _ in chunk)})",
+                chunk,
+            )
+            # They should never change but make sure the listed size still matches
+            contents.update(
+                (row["rpath"], row["content"])
+                for row in res
+                if row["size"] == sizes[row["rpath"]]
+            )
 
-        # Multi-thread reading from the remote to get the new rpath
-        # and reading from the DB to get the info
-        rc = self.config.rc
-        rc.start()
+        missing = [rpath for rpath in rpaths if rpath not in contents]
+        logger.info(
+            f"Need to resolve {len(rpaths)} references. "
+            f"{len(rpaths) - len(missing)} cached. Fetching {len(missing)}"
+        )
 
-        def _get_referent(file):
-            refferer = file["rpath"]
-            referent = rc.read((self.config.dst, refferer)).decode()
+        # Multi-thread reading from the remote. Cache in the main thread
+        if missing:
+            rc = self.config.rc
+            rc.start()
 
-            # Handle different versions here
-            try:
-                referent = json.loads(referent)
-            except json.JSONDecodeError:
-                logger.debug(f"Reading reference. Assuming V1")
-                referent = {"ver": 1, "path": referent}
-
-            ver = referent["ver"]
-            if ver == 1:
-                logger.debug(f"Reference {refferer!r} is v1 (implied)")
-                return file, referent["path"]
-            elif ver == 2:
-                logger.debug(f"Reference {refferer!r} is v2")
-                path = os.path.join(os.path.dirname(refferer), referent["rel"])
-                path = os.path.normpath(path)
-                return file, path
-            raise ValueError("Unrecognized Version")
+            def _read(rpath):
+                return rpath, rc.read((self.config.dst, rpath))
 
-        files = tmap(_get_referent, files, Nt=1)  # self.config.concurrency)
+            Nt = self.config.reference_concurrency or self.config.concurrency
+            for ii, (rpath, content) in enumerate(tmap(_read, missing, Nt=Nt)):
+                contents[rpath] = content
+                cache.execute(
+                    "REPLACE INTO refs VALUES (?,?,?)", (rpath, sizes[rpath], content)
+                )
+                logger.debug(f"read reference {rpath!r}")
+                # Reading is slow so commit often to make sure we don't lose much
+                if ii % 100 == 0:
+                    cache.commit()
+            cache.commit()
+        cache.close()
+
+        referents = (
+            (rpath, self._parse_reference(rpath, contents[rpath])) for rpath in rpaths
+        )
 
-        def _update(file, referent):
-            referent = referent.strip("\n")
-            refferer = file["rpath"]
-            # Get the original information
-            row = db.execute(
+        with db:
+            db.execute(
+                "CREATE TEMP TABLE refmap(ref_rpath TEXT PRIMARY KEY, referent TEXT)"
+            )
+            db.executemany("INSERT INTO refmap VALUES (?,?)", referents)
+
+            notfound = db.execute(
                 """
-                SELECT * FROM items 
-                WHERE rpath = ? AND NOT isref""",
-                (referent,),
-            ).fetchone()
-
-            if not row:
-                txt = f"WARNING: File {refferer!r} references {referent!r} "
-                txt += "but it is missing. Will just be treated as deleted"
+                SELECT ref_rpath, referent FROM refmap
+                WHERE referent NOT IN (SELECT rpath FROM items WHERE NOT isref)"""
+            ).fetchall()
+            for row in notfound:
+                txt = f"WARNING: File {row['ref_rpath']!r} references "
+                txt += f"{row['referent']!r} but it is missing. "
+                txt += "Will just be treated as deleted"
                 logger.warning(txt)
-                row = DFBDST.fullrow2dict(file)
-                row["size"] = -1
-                return row
-
-            row = DFBDST.fullrow2dict(row)
-            row.pop("Size", None)
-            # Reset some values
-            row["apath"] = file["apath"]
-            row["timestamp"] = file["timestamp"]
-            row["isref"] = 1  # Resolved reference
-            row["ref_rpath"] = refferer
-            return row
-
-        files = map(star(_update), files)
-
-        # Insert into DB in the main thread.
-        for ii, file in enumerate(files):
+            db.executemany(
+                "UPDATE items SET size = -1 WHERE rpath = ?",
+                ((row["ref_rpath"],) for row in notfound),
+            )
+
+            # Take everything from the referent except the apath and timestamp
+            db.execute(
+                """
+                INSERT OR REPLACE INTO checksums
+                SELECT r.apath, r.timestamp, c.hashtype, c.value
+                FROM refmap m
+                JOIN items r ON r.rpath = m.ref_rpath AND r.isref = 2
+                JOIN items o ON o.rpath = m.referent AND NOT o.isref
+                JOIN checksums c ON c.apath = o.apath AND c.timestamp = o.timestamp"""
+            )
             db.execute(
-                f"REPLACE INTO items VALUES ({','.join('?' for _ in DFBDST.COLS)})",
-                DFBDST.dict2fullrow(file),
+                """
+                REPLACE INTO items
+                SELECT 
+                    o.rpath, r.apath, r.timestamp, o.size, o.mtime, o.checksum,
+                    1, r.rpath, o.dstinfo, o.remain, r.dir_id
+                FROM refmap m
+                JOIN items r ON r.rpath = m.ref_rpath AND r.isref = 2
+                JOIN items o ON o.rpath = m.referent AND NOT o.isref"""
             )
-            logger.info(f"updated reference {file['ref_rpath']!r}")
-            # Fetching references is slow so commit more often to make sure we don't
-            # lose much. Plus, we are waiting for updates
-            if ii % 10 == 0:
-                db.commit()
-        db.commit()
+            db.execute("DROP TABLE refmap")
         db.close()
 
-    def _load_snapshots(self):
-        # May have to rethink this for memory but that would be a *lot* of files
-        self._snapshot_dict = {}
-        self._snapshot_dict_ref = {}
+        logger.info(f"Resolved {len(rpaths) - len(notfound)} references")
 
+    def refcache(self):
+        """
+        Connection to the local cache of reference file contents. Reference files are
+        never modified so these never go stale. Not removed on refresh.
+        """
+        db = sqlite3.connect(self.dbcache_dir / f"{self.config.config_id}.refs.db")
+        db.row_factory = MyRow
+        db.set_trace_callback(sqldebug)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS "
+            "refs(rpath TEXT PRIMARY KEY, size INTEGER, content BLOB)"
+        )
+        return db
+
+    @staticmethod
+    def _parse_reference(refferer, content):
+        """Return the referent rpath from the reference file contents"""
+        referent = content.decode() if isinstance(content, bytes) else content
+
+        # Handle different versions here
+        try:
+            referent = json.loads(referent)
+        except json.JSONDecodeError:
+            logger.debug(f"Reading reference. Assuming V1")
+            referent = {"ver": 1, "path": referent}
+
+        ver = referent["ver"]
+        if ver == 1:
+            logger.debug(f"Reference {refferer!r} is v1 (implied)")
+            path = referent["path"]
+        elif ver == 2:
+            logger.debug(f"Reference {refferer!r} is v2")
+            path = os.path.join(os.path.dirname(refferer), referent["rel"])
+            path = os.path.normpath(path)
+        else:
+            raise ValueError("Unrecognized Version")
+        return path.strip("\n")
+
+    def _load_snapshots(self, db):
+        """
+        Load the snapshot lines (starting at the newest checkpoint) into a temp staging
+        table (on db) keyed by rpath, or ref_rpath for references. Later snapshots
+        replace earlier ones. Use _staged_snapshots() to look them up.
+        """
+        snaps = self._sync_snapshots()
+
+        db.execute("DROP TABLE IF EXISTS temp.snapstage")
+        db.execute(
+            """
+            CREATE TEMP TABLE snapstage(
+                isref INTEGER, 
+                key TEXT, 
+                line TEXT, 
+                PRIMARY KEY (isref, key)
+            )"""
+        )
+
+        def _rows(snap):
+            for line in smart_open(str(snap), "rt"):
+                item = json.loads(line)
+                if (
+                    item.get("_action", None) in {"prune", "comment"}
+                    or item["size"] < 0
+                ):
+                    continue
+                yield self._stage_key(item) + (line,)
+
+        for snap in snaps:
+            c = 0
+            rows = _rows(snap)
+            while chunk := list(islice(rows, self.RESET_CHUNK)):
+                with db:
+                    db.executemany("REPLACE INTO snapstage VALUES (?,?,?)", chunk)
+                c += len(chunk)
+            logger.info(f"Loaded {c} items from {snap.name}")
+
+    def _sync_snapshots(self):
+        """
+        Download the snapshots needed to rebuild the state: the newest checkpoint (if
+        any) and everything after it. Returns the local paths in the order to apply
+        """
         logger.debug("Loading snapshots from remote")
 
         rc = self.config.rc
         rc.start()
 
-        # Do a sync all at once so it can be threaded with rclone directly
+        remote = rcpathjoin(self.config.dst, ".dfb/snapshots")
+        try:
+            listing = rc.list((remote, ""), modtime=False, only="files")
+        except RcloneError as EE:
+            if "directory not found" not in str(EE):
+                raise
+            listing = []
+        paths = [file["Path"] for file in listing if ".jsonl" in file["Path"]]
+        paths = self._select_snapshots(paths)
+
+        snap_dest = self.dbcache_dir / self.config.config_id
+        if not paths:
+            return []
+
+        filesfrom = self.config.tmpdir / f"snapshots.{randstr(6)}.txt"
+        filesfrom.write_text("".join(f"{path}\n" for path in paths))
+
+        # Do a copy all at once so it can be threaded with rclone directly. Only of
+        # the needed files
         params = {}
         params["_config"] = {
             "SizeOnly": True,  # These files shouldn't change. No need to worry about mtime
-            "UseListR": True,  # Not too many files and could be much better
             "Transfers": self.config.concurrency,
         }
-
-        params["srcFs"] = rcpathjoin(self.config.dst, ".dfb/snapshots")
-        snap_dest = self.dbcache_dir / self.config.config_id
+        params["_filter"] = {"FilesFromRaw": [str(filesfrom)]}
+        params["srcFs"] = remote
         params["dstFs"] = str(snap_dest)
-        rc.call("sync/sync", params=params)
-        logger.debug(f"sync snaps with {params = }")
+        rc.call("sync/copy", params=params)
+        logger.debug(f"copy {len(paths)} snaps with {params = }")
 
-        for snap in sorted(snap_dest.rglob("**/*.jsonl*"), key=lambda p: p.name):
-            c = 0
-            for line in smart_open(str(snap)):
-                line = json.loads(line)
-                if (
-                    line.get("_action", None) in {"prune", "comment"}
-                    or line["size"] < 0
-                ):
-                    continue
+        return [snap_dest / path for path in paths]
+
+    @staticmethod
+    def _select_snapshots(paths):
+        """
+        Given the paths of snapshot files, return the newest checkpoint (if there is
+        one) and everything that was uploaded after it, in the order to apply.
+        Paths are strings with "/" for the directories.
+        """
+
+        def _stamp(path):
+            # The first of YYYY/MM/<stamp>Z.jsonl.gz, YYYY/MM/<stamp>Z/<n>.<name>
+            # (from dbimport --upload), or checkpoints/<stamp>Z.jsonl.gz. Resumed
+            # backups are <stamp>Z.resumed<stamp>Z.jsonl.gz and use when they ran
+            for part in path.split("/"):
+                if re.match(r"^\d{14}Z", part):
+                    return re.findall(r"\d{14}Z", part)[-1]
+
+        def _is_checkpoint(path):
+            return "checkpoints" in path.split("/")[:-1]
+
+        def _name(path):
+            return path.rsplit("/", 1)[-1]
+
+        checkpoints = [path for path in paths if _is_checkpoint(path) and _stamp(path)]
+        if not checkpoints:
+            return sorted(paths, key=_name)
+
+        checkpoint = max(checkpoints, key=_stamp)
+        cstamp = _stamp(checkpoint)
+        after = [
+            path
+            for path in paths
+            if not _is_checkpoint(path) and (_stamp(path) or "Z") > cstamp
+        ]
+        logger.info(
+            f"Starting from checkpoint {_name(checkpoint)!r}. "
+            f"Skipping {len(paths) - len(after) - 1} older snapshot file(s)"
+        )
+        return [checkpoint] + sorted(after, key=_name)
+
+    def checkpoint(self, every=None):
+        """
+        Write a single compacted snapshot of all snapshots so far to
+        .dfb/snapshots/checkpoints/ so that refresh and dbimport can start from it.
+        Entries are deduplicated (last one wins) and pruned entries are removed.
 
-                if line.get("isref", False):
-                    self._snapshot_dict_ref[line["ref_rpath"]] = line
+        It is built from the snapshots and not the database so that it is exactly
+        equivalent to replaying them.
+
+        If 'every' is set, will only write one if there are at least that many
+        snapshot files since the last checkpoint.
+        """
+        self.push_snapshots()  # Anything left over locally is included
+
+        snaps = self._sync_snapshots()
+        nnew = len([snap for snap in snaps if snap.parent.name != "checkpoints"])
+        if every and nnew < every:
+            logger.debug(f"{nnew} snapshot(s) since last checkpoint. Not writing")
+            return
+        if not nnew:
+            logger.info("No snapshots since the last checkpoint. Not writing")
+            return
+
+        # Private, temporary DB. Will spill to disk as needed
+        db = sqlite3.connect("")
+        db.execute(
+            """
+            CREATE TABLE stage(
+                isref INTEGER, 
+                key TEXT, 
+                rpath TEXT, 
+                line TEXT, 
+                PRIMARY KEY (isref, key)
+            )"""
+        )
+        db.execute("CREATE TABLE pruned(rpath TEXT)")
+
+        for snap in snaps:
+            rows, prunes = [], []
+            for line in smart_open(str(snap), "rt"):
+                item = json.loads(line)
+                action = item.get("_action", None)
+                if action == "comment":
+                    continue
+                elif action == "prune":
+                    prunes.append((item["rpath"],))
                 else:
-                    self._snapshot_dict[line["rpath"]] = line
+                    rows.append(self._stage_key(item) + (item["rpath"], line.strip()))
+            with db:
+                db.executemany("REPLACE INTO stage VALUES (?,?,?,?)", rows)
+                db.executemany("INSERT INTO pruned VALUES (?)", prunes)
 
+        # Like dbimport, prunes apply at the end
+        with db:
+            db.execute("DELETE FROM stage WHERE rpath IN (SELECT rpath FROM pruned)")
+
+        cfile = self.config.snap_cache_dir / f"checkpoints/{self.config.now.dt}Z.jsonl"
+        cfile.parent.mkdir(parents=True, exist_ok=True)
+        c = 0
+        with cfile.open(mode="wt") as fp:
+            comment = {
+                "_V": 1,
+                "_action": "comment",
+                "checkpoint": f"{self.config.now.dt}Z",
+                "snapshots": nnew,
+            }
+            print(json.dumps(comment), file=fp)
+            for (line,) in db.execute("SELECT line FROM stage ORDER BY rpath"):
+                print(line, file=fp)
                 c += 1
-            logger.info(f"Loaded {c} items from {snap.name}")
+        db.close()
 
-    def _apply_snapshot_file(self, file):
+        logger.info(f"Checkpoint of {c} entries from {len(snaps)} snapshot file(s)")
+        self.push_snapshots()
+
+    @staticmethod
+    def _stage_key(item):
+        """
+        Key for the staging table. Listed unresolved references (isref = 2) match
+        snapshot references by their own rpath which is the ref_rpath in the snapshot
+        """
+        if isref := item.get("isref", False):
+            return 1, item["rpath"] if isref == 2 else item["ref_rpath"]
+        return 0, item["rpath"]
+
+    @staticmethod
+    def _staged_snapshots(db, files):
+        """Return {key: snapshot item} for the files found in the staging table"""
+        keys = list({DFBDST._stage_key(file) for file in files})
+        snaps = {}
+        for ii in range(0, len(keys), 400):
+            chunk = keys[ii : ii + 400]
+            res = db.execute(
+                f"""
+                SELECT isref, key, line FROM snapstage 
+                WHERE (isref, key) IN (VALUES {','.join('(?,?)' for _ in chunk)})""",
+                [v for key in chunk for v in key],
+            )
+            snaps.update(((row[0], row[1]), json.loads(row[2])) for row in res)
+        return snaps
+
+    def _apply_snapshot_file(self, file, snapfile):
         if file.get("isref", False) == 2:
-            if snapfile := self._snapshot_dict_ref.get(file["rpath"]):
+            if snapfile:
                 logger.info(
                     f"Updated reference for {file['rpath']!r} "
                     f"from {snapfile['rpath']!r}"
@@ -375,7 +1064,7 @@ class DFBDST:
             return file
         # ONLY apply if the file is listed already. Otherwise, see dbimport. This
         # includes ignore prune entries
-        if not (snapfile := self._snapshot_dict.get(file["rpath"], None)):
+        if not snapfile:
             return file
 
         # They should be the same by rpath but just do a quick sanity check.
@@ -403,7 +1092,7 @@ class DFBDST:
             raise ValueError("Refresh Disabled")
 
         if reset:
-            self.dbpath.unlink()
+            self._unlink()
             self.init()
 
         rc = self.config.rc.start()
@@ -442,9 +1131,10 @@ class DFBDST:
             params["dstFs"] = rcpathjoin(str(imp), randstr(6))
             rc.call("sync/sync", params=params)
 
-        # The "sorted" is not really needed but it is likely to keep the
-        # database cleaner
-        loadfiles = sorted(imp.rglob("*.jsonl*"), key=lambda file: file.name)
+        # The sorting is not really needed but it is likely to keep the database
+        # cleaner. If there are checkpoints, start from the newest
+        loadfiles = [file.relative_to(imp).as_posix() for file in imp.rglob("*.jsonl*")]
+        loadfiles = [imp / file for file in self._select_snapshots(loadfiles)]
 
         prune = []  # prune is OUTSIDE the file loop as noted above
         for exportfile in loadfiles:
@@ -466,10 +1156,12 @@ class DFBDST:
 
             with self.db() as db:
                 db.executemany(
-                    f"""INSERT OR REPLACE INTO items 
-                        VALUES ({','.join('?' for _ in DFBDST.COLS)})""",
+                    self._insert_sql("INSERT OR REPLACE"),
                     [DFBDST.dict2fullrow(file) for file in files],
                 )
+                self._write_checksums(db, files)
+                self._update_dirs(db)
+                self._update_latest(db, (file["apath"] for file in files))
             msg = f"  Imported {len(files)} files"
             if pcount:
                 msg += f" and will prune {pcount}"
@@ -477,12 +1169,7 @@ class DFBDST:
 
         if prune:
             with self.db() as db:
-                db.executemany(
-                    """
-                    DELETE FROM items 
-                    WHERE rpath = ?""",
-                    ((file["rpath"],) for file in prune),
-                )
+                self._delete_rpaths(db, (file["rpath"] for file in prune))
             logger.info(f"Pruned {len(prune)} files from all exports")
 
         if upload:
@@ -495,10 +1182,14 @@ class DFBDST:
 
             self.push_snapshots(compress=False)
 
-    def insert_or_replace_many(self, files, *, insert, replace):
+    def insert_or_replace_many(self, files, *, insert, replace, on_commit=None):
         """
         Allows inserting or replacing. This requires being explicit to avoid wrong
-        insertions
+        insertions.
+
+        If inside of group_commit(), will be queued for the writer instead.
+        'on_commit(files)', if set, is called with the files once they are committed
+        (from the writer thread when queued).
         """
         action = []
         if insert:
@@ -506,18 +1197,18 @@ class DFBDST:
         if replace:
             action.append("REPLACE")
         action = " OR ".join(action)
-        sql = f"{action} INTO items VALUES ({','.join('?' for _ in DFBDST.COLS)})"
+        sql = self._insert_sql(action)
 
         # Collect them all. We will do it anyway in the DB and this way it can be yielded
         files = list(files)
-        # Insert into DB in the main thread
-        rows = map(DFBDST.dict2fullrow, files)
-        # ALWAYS wait before an executemany since that could lock the DB
-        rows = list(rows)
+
+        if self._writer:
+            self._writer.put(sql, files, on_commit=on_commit)
+            return files
 
         db = self.db()
         with db:
-            db.executemany(sql, rows)
+            self._write_files(db, sql, files)
         # db.commit()
         # db.close()
 
@@ -525,12 +1216,43 @@ class DFBDST:
             for file in files:
                 print(json.dumps(file), file=fp, flush=True)
 
+        if on_commit:
+            on_commit(files)
         return files
 
+    def _write_files(self, db, sql, files):
+        rows = map(DFBDST.dict2fullrow, files)
+        # ALWAYS wait before an executemany since that could lock the DB
+        rows = list(rows)
+
+        db.executemany(sql, rows)
+        self._write_checksums(db, files)
+        self._update_dirs(db)
+        self._update_latest(db, (file["apath"] for file in files))
+
+    @contextmanager
+    def group_commit(self, **kwargs):
+        """
+        Context manager where all inserts and replaces are sent to a single
+        GroupCommitWriter. kwargs are passed to it. All pending writes are committed
+        on exit.
+
+            >>> with dstdb.group_commit():
+            ...     dstdb.insert(file)  # queued
+        """
+        if self._writer:
+            raise ValueError("Already in group_commit")
+        self._writer = GroupCommitWriter(self, **kwargs).start()
+        try:
+            yield self._writer
+        finally:
+            writer, self._writer = self._writer, None
+            writer.close()
+
     insert_many = partialmethod(insert_or_replace_many, insert=True, replace=False)
     replace_many = partialmethod(insert_or_replace_many, insert=False, replace=True)
 
-    def _insert_or_replace(self, file, *, insert, replace):
+    def _insert_or_replace(self, file, *, insert, replace, on_commit=None):
         """
         Allows inserting or replacing. This requires being explicit to avoid wrong
         insertions.
@@ -542,7 +1264,9 @@ class DFBDST:
             both:      : db._insert_or_replace(file,insert=True,replace=True)
 
         """
-        return self.insert_or_replace_many([file], insert=insert, replace=replace)
+        return self.insert_or_replace_many(
+            [file], insert=insert, replace=replace, on_commit=on_commit
+        )
 
     insert = partialmethod(_insert_or_replace, insert=True, replace=False)
     replace = partialmethod(_insert_or_replace, insert=False, replace=True)
@@ -556,10 +1280,12 @@ class DFBDST:
         after=None,
         select="*",
         groupselect="*",
+        latestselect=None,
         export=False,
         remove_delete=True,
         delete_only=False,
         conditions=None,
+        checksums=False,
         query_prefix="snap",
     ):
         """
@@ -587,6 +1313,12 @@ class DFBDST:
             Select inside the GROUP BY statement. Useful for additional values
             but MUST also include "*"
 
+        latestselect [None]
+            Select used instead of groupselect when the query can be answered from
+            the 'latest' table (no before, after, or export). If None, the latest
+            table is only used when groupselect is "*". Aggregates over all versions
+            must be written as subqueries on items since there is no GROUP BY.
+
         export [False]
             If True, includes multiples. Will override remove_delete and delete_only
 
@@ -604,6 +1336,15 @@ class DFBDST:
             WARNING: Do not do ('size >= ?',0) since that will then include the non-deleted
                      version. It is better to filter it later.
 
+            Note that conditions should only be on apath since they may be applied to
+            the latest table rather than all versions.
+
+        checksums [False]
+            Whether to also look up the checksums. Requires 'apath' and 'timestamp'
+            be selected.
+
+            fullrow2dict will then set 'checksum'
+
         query_prefix: Prefix to be used for all query parameters. Can be useful if building
                  subqueries
 
@@ -625,6 +1366,11 @@ class DFBDST:
         if export:
             remove_delete = delete_only = False
 
+        # The current state is materialized in the latest table. Use it if possible
+        if latestselect is None and groupselect == "*":
+            latestselect = "*"
+        use_latest = latestselect is not None and not (before or after or export)
+
         # Build the snapshot. Note that the select is never *user*
         # specified so there isn't an SQL injection risk.
 
@@ -639,14 +1385,15 @@ class DFBDST:
         query.extend(
             [
                 "SELECT",
-                groupselect,
-                "FROM items",
+                latestselect if use_latest else groupselect,
+                "FROM latest" if use_latest else "FROM items",
             ]
         )
 
         if path:
             path = path.removesuffix("/").removeprefix("./")
-            conditions.append((f"apath LIKE :{qp}_path", {f"{qp}_path": f"{path}/%"}))
+            subdirs = SUBDIRS_QUERY.replace("PATH", f":{qp}_path")
+            conditions.append((f"dir_id IN ({subdirs})", {f"{qp}_path": path}))
 
         if before:
             b0 = before
@@ -675,7 +1422,7 @@ class DFBDST:
             query.append(" AND ".join(cond[0] for cond in conditions))
             params |= {k: v for c in conditions for k, v in c[1].items()}
 
-        if not export:
+        if not export and not use_latest:
             query.append("GROUP BY apath HAVING MAX(timestamp)")
         # query.append("ORDER BY LOWER(apath)")
 
@@ -690,7 +1437,9 @@ class DFBDST:
         # Build the nested query even if not needed to capture the different
         # select and groupselect
         query = "-- Subquery with everything that is then filtered\n" + query
-        query = f"SELECT {select} FROM (\n{indent(query,' '*4)}\n)"
+        if checksums:
+            select = f"{select}, {HASHES_SELECT.replace('TABLE', 'snapq')}"
+        query = f"SELECT {select} FROM (\n{indent(query,' '*4)}\n) AS snapq"
         if outq_cond:
             query += "\nWHERE\n" + " AND ".join(outq_cond)
 
@@ -762,139 +1511,196 @@ class DFBDST:
         """
         subdir = subdir.removeprefix("./").removesuffix("/")
         db = self.db()
+        try:
 
-        # This method makes essentially two queries that look a lot like snapshots
-        #     1. Snapshot like query that then filters using the above-noted clever SQL
-        #        to filter subdirs. (The old version of this did something similar w/o
-        #        filters for the latest then checked each dir. This is more efficient)
-        #
-        #     2. Files: Add conditions to apath to make sure it only lists in that
-        #        parent directory
-
-        conditions = conditions or []
-
-        ## Files
-        fcond = conditions.copy()
-
-        if not recursive:
-            fcond.append(
-                [
-                    "apath NOT LIKE :onedepth",
-                    {"onedepth": os.path.join(subdir, "%", "%")},
-                ]
+            # This method makes essentially two queries that look a lot like snapshots
+            #     1. Snapshot like query that then filters using the above-noted clever SQL
+            #        to filter subdirs. (The old version of this did something similar w/o
+            #        filters for the latest then checked each dir. This is more efficient)
+            #
+            #     2. Files: Add conditions to apath to make sure it only lists in that
+            #        parent directory
+
+            conditions = conditions or []
+
+            # ids of the directory. Could be more than one since it isn't case-sensitive
+            dir_ids = db.execute(
+                "SELECT id FROM dirs WHERE path = ? COLLATE NOCASE", (subdir,)
+            ).fetchall()
+            dir_ids = [row["id"] for row in dir_ids]
+            if not dir_ids:
+                return [], []
+            dir_params = {f"ls_dir{ii}": dir_id for ii, dir_id in enumerate(dir_ids)}
+            dir_in = f"({','.join(':' + key for key in dir_params)})"
+
+            ## Files
+            fcond = conditions.copy()
+            fpath = subdir
+            if not recursive:
+                # Just this directory so don't need the path
+                fcond.append([f"dir_id IN {dir_in}", dir_params])
+                fpath = ""
+
+            groupselect = dedent(
+                """
+                *, 
+                COUNT(*) AS versions,
+                SUM(
+                    CASE  
+                        WHEN size > 0 THEN size 
+                        ELSE 0
+                    END
+                ) as tot_size -- Need to account for -1 vals
+                """
             )
 
-        groupselect = dedent(
-            """
-            *, 
-            COUNT(*) AS versions,
-            SUM(
-                CASE  
-                    WHEN size > 0 THEN size 
-                    ELSE 0
-                END
-            ) as tot_size -- Need to account for -1 vals
-            """
-        )
-
-        fquery, fparams = self._snapshot_query_builder(
-            path=subdir,
-            before=before,
-            after=after,
-            select="*",
-            groupselect=groupselect,
-            remove_delete=remove_delete,
-            delete_only=delete_only,
-            conditions=fcond,
-        )
-
-        files = [DFBDST.fullrow2dict(r) for r in db.execute(fquery, fparams)]
-
-        ## Directories.
-        if recursive:
-            # Do this in Python as it is cleaner than SQL
-            directories = {os.path.dirname(file["apath"]) for file in files}
-
-            for directory in directories.copy():
-                if not directory:  # At root
-                    continue
-
-                directory = os.path.relpath(directory, subdir)  # remove subdir
-                while directory:
-                    if directory := os.path.dirname(directory):
-                        directories.add(os.path.join(subdir, directory))
+            # Same but for the latest table where there is no GROUP BY
+            latestselect = dedent(
+                """
+                *, 
+                (
+                    SELECT COUNT(*) FROM items WHERE items.apath = latest.apath
+                ) AS versions,
+                (
+                    SELECT SUM(
+                        CASE  
+                            WHEN size > 0 THEN size 
+                            ELSE 0
+                        END
+                    ) FROM items WHERE items.apath = latest.apath
+                ) AS tot_size
+                """
+            )
 
-            directories.difference_update({"", "./"})
-        else:
-            # Use the snapshot query builder with all of the conditions to make a query with
-            # all valid files. Then use the fancy SQL to down-select directories. If it is a
-            # subdir, it needs an additional filter to remove the subdir from the apath names.
-            # The "QQQQ" sub is purely cosmetic to get the indents of the subquery *after* the
-            # dedents of the outer query
-            dir_query, dir_params = self._snapshot_query_builder(
-                path=subdir,
+            fquery, fparams = self._snapshot_query_builder(
+                path=fpath,
                 before=before,
                 after=after,
-                select="apath",
+                select="*",
+                groupselect=groupselect,
+                latestselect=latestselect,
                 remove_delete=remove_delete,
                 delete_only=delete_only,
-                conditions=conditions,
+                conditions=fcond,
             )
 
-            params = dir_params.copy()
-            if subdir:
-                query = dedent(
+            files = [DFBDST.fullrow2lazy(r) for r in db.execute(fquery, fparams)]
+
+            ## Directories.
+            if recursive:
+                # Do this in Python as it is cleaner than SQL
+                directories = {os.path.dirname(file["apath"]) for file in files}
+
+                for directory in directories.copy():
+                    if not directory:  # At root
+                        continue
+
+                    directory = os.path.relpath(directory, subdir)  # remove subdir
+                    while directory:
+                        if directory := os.path.dirname(directory):
+                            directories.add(os.path.join(subdir, directory))
+
+                directories.difference_update({"", "./"})
+            elif not (before or after or conditions):
+                # Child directories that have anything current below them. Each is an
+                # index range on latest so it is O(children) rather than O(subtree)
+                size = ""
+                if remove_delete:
+                    size = "AND size >= 0"
+                if delete_only:
+                    size += " AND size < 0"
+
+                res = db.execute(
                     f"""
-                    WITH
-                        snappaths AS (
-                        QQQQ
-                        ),
-                        subpaths AS (
-                            SELECT SUBSTR(snappaths.apath, {len(subdir) + 2}) AS apath
-                            FROM snappaths
-                            WHERE snappaths.apath LIKE :subdir
-                        )
-                        
-                    """
-                ).replace("QQQQ", indent(dir_query, " " * 8))
-                params["subdir"] = f"{subdir}/%"
+                    SELECT path FROM dirs 
+                    WHERE 
+                        parent IN {dir_in}
+                        AND EXISTS (
+                            SELECT 1 FROM latest 
+                            WHERE 
+                                apath > dirs.path || '/' 
+                                AND apath < dirs.path || '0' -- '0' is after '/'
+                                {size}
+                        )""",
+                    dir_params,
+                )
+                names = (row["path"].rsplit("/", 1)[-1] for row in res)
+                directories = [os.path.join(subdir, name) + "/" for name in names]
             else:
-                query = dedent(
-                    f"""
-                    WITH
-                        subpaths AS (
-                        QQQQ
-                        )"""
-                ).replace("QQQQ", indent(dir_query, " " * 8))
+                # Use the snapshot query builder with all of the conditions to make a query with
+                # all valid files. Then use the fancy SQL to down-select directories. If it is a
+                # subdir, it needs an additional filter to remove the subdir from the apath names.
+                # The "QQQQ" sub is purely cosmetic to get the indents of the subquery *after* the
+                # dedents of the outer query
+                dir_query, dir_params = self._snapshot_query_builder(
+                    path=subdir,
+                    before=before,
+                    after=after,
+                    select="apath",
+                    remove_delete=remove_delete,
+                    delete_only=delete_only,
+                    conditions=conditions,
+                )
 
-            query += dedent(
-                """
-                -- Get just the next path element
-                -- https://www.reddit.com/r/sqlite/comments/123bivr/comment/jdu9xvl/?context=3
-                SELECT DISTINCT 
-                        SUBSTR(
-                            apath,
-                            1,
-                            CASE INSTR(apath, '/')
-                                WHEN 0
-                                THEN LENGTH(apath)
-                                ELSE INSTR(apath, '/')
-                            END
-                        ) AS sub
-                FROM subpaths
-                """
-            )
-            apaths = (r["sub"] for r in db.execute(query, params))
-            apaths = (apath for apath in apaths if apath.endswith("/"))
-            directories = [os.path.join(subdir, apath) for apath in apaths]
+                params = dir_params.copy()
+                if subdir:
+                    query = dedent(
+                        f"""
+                        WITH
+                            snappaths AS (
+                            QQQQ
+                            ),
+                            subpaths AS (
+                                SELECT SUBSTR(snappaths.apath, {len(subdir) + 2}) AS apath
+                                FROM snappaths
+                                WHERE snappaths.apath LIKE :subdir
+                            )
+                        
+                        """
+                    ).replace("QQQQ", indent(dir_query, " " * 8))
+                    params["subdir"] = f"{subdir}/%"
+                else:
+                    query = dedent(
+                        f"""
+                        WITH
+                            subpaths AS (
+                            QQQQ
+                            )"""
+                    ).replace("QQQQ", indent(dir_query, " " * 8))
+
+                query += dedent(
+                    """
+                    -- Get just the next path element
+                    -- https://www.reddit.com/r/sqlite/comments/123bivr/comment/jdu9xvl/?context=3
+                    SELECT DISTINCT 
+                            SUBSTR(
+                                apath,
+                                1,
+                                CASE INSTR(apath, '/')
+                                    WHEN 0
+                                    THEN LENGTH(apath)
+                                    ELSE INSTR(apath, '/')
+                                END
+                            ) AS sub
+                    FROM subpaths
+                    """
+                )
+                apaths = (r["sub"] for r in db.execute(query, params))
+                apaths = (apath for apath in apaths if apath.endswith("/"))
+                directories = [os.path.join(subdir, apath) for apath in apaths]
 
-        return directories, files
+            return directories, files
+        finally:
+            db.close()
 
     def file_versions(self, filepath, count_refs=False):
         db = self.db()
         with db:
             versions = db.execute(
-                "SELECT * FROM items WHERE apath = ? ORDER BY timestamp", (filepath,)
+                f"""
+                SELECT *, {HASHES_SELECT.replace('TABLE', 'items')} FROM items 
+                WHERE apath = ? ORDER BY timestamp""",
+                (filepath,),
             )
         versions = [self.fullrow2dict(v) for v in versions]
 
@@ -947,7 +1753,7 @@ class DFBDST:
                     LOWER(apath),timestamp""",
                 qvals,
             )
-            Qres = map(DFBDST.fullrow2dict, Qres)
+            Qres = map(DFBDST.fullrow2lazy, Qres)
 
         row = next(Qres)
         try:
@@ -1006,23 +1812,253 @@ class DFBDST:
         """Take a dict of the file and convert it to a DB row"""
         rowdict = rowdict.copy()
 
-        if cs := rowdict.get("checksum", None):
-            rowdict["checksum"] = json.dumps(cs)
+        # Stored in the checksums table. See _write_checksums
+        rowdict.pop("checksum", None)
 
         row = [rowdict.pop(key, None) for key, _ in cls.COLS[:-1]]
-        row.append(json.dumps(rowdict) if rowdict else None)  # remain
+        remain = json.dumps(rowdict, separators=(",", ":")) if rowdict else None
+        row.append(remain)
         return row
 
     @staticmethod
     def fullrow2dict(row):
         row = dict(row)
+        row.pop("dir_id", None)  # Internal to the DB
 
-        try:
-            row["checksum"] = json.loads(row["checksum"])
-        except (KeyError, TypeError, json.JSONDecodeError):
-            pass
+        checksum = row.pop("checksum", None)
+        if hashes := row.pop("hashes", None):
+            row["checksum"] = dict(h.split(":", 1) for h in hashes.split(" "))
+        elif checksum:  # Older DBs before migration
+            try:
+                row["checksum"] = json.loads(checksum)
+            except (TypeError, json.JSONDecodeError):
+                pass
 
         if remain := row.pop("remain", None):
             row.update(json.loads(remain))
 
         return row
+
+    def checksums(self, files):
+        """
+        The stored checksums of 'files' (dicts with apath and timestamp) as
+        {(apath, timestamp): {hashtype: value}}. For rows loaded without them
+        """
+        keys = json.dumps([[file["apath"], file["timestamp"]] for file in files])
+        db = self.db()
+        try:
+            res = db.execute(
+                """
+                SELECT c.* FROM json_each(?) AS k
+                JOIN checksums c 
+                    ON c.apath = json_extract(k.value, '$[0]') 
+                    AND c.timestamp = json_extract(k.value, '$[1]')""",
+                (keys,),
+            )
+            hashes = {}
+            for row in res:
+                key = row["apath"], row["timestamp"]
+                hashes.setdefault(key, {})[row["hashtype"]] = row["value"]
+            return hashes
+        finally:
+            db.close()
+
+    @staticmethod
+    def fullrow2lazy(row):
+        """
+        Like fullrow2dict but returns a LazyRow that only decodes what is accessed.
+        Use it for large, read-mostly listings
+        """
+        return LazyRow(row)
+
+
+class LazyRow(MutableMapping):
+    """
+    Mapping over a DB row that matches fullrow2dict without building the dict.
+
+    Plain columns are read from the underlying (tuple-backed) row. 'checksum' and
+    anything stored in 'remain' are decoded only when accessed. Iterating, writing,
+    or asking for a missing key decodes the full dict once and uses it from then on.
+    copy() returns a plain dict.
+    """
+
+    __slots__ = ("_row", "_dict")
+
+    # Internal columns that fullrow2dict removes or decodes
+    HIDDEN = frozenset({"dir_id", "hashes", "remain", "checksum"})
+
+    def __init__(self, row):
+        self._row = row
+        self._dict = None
+
+    def todict(self):
+        if self._dict is None:
+            self._dict = DFBDST.fullrow2dict(self._row)
+            self._row = None
+        return self._dict
+
+    def __getitem__(self, key):
+        if self._dict is None:
+            if key not in self.HIDDEN:
+                try:
+                    return self._row[key]
+                except IndexError:  # Not a column. May be in remain
+                    pass
+            elif key == "checksum":
+                try:
+                    hashes = self._row["hashes"]
+                except IndexError:
+                    hashes = None
+                if hashes:
+                    return dict(h.split(":", 1) for h in hashes.split(" "))
+        return self.todict()[key]
+
+    def __setitem__(self, key, value):
+        self.todict()[key] = value
+
+    def __delitem__(self, key):
+        del self.todict()[key]
+
+    def __iter__(self):
+        return iter(self.todict())
+
+    def __len__(self):
+        return len(self.todict())
+
+    def copy(self):
+        return self.todict().copy()
+
+    def __repr__(self):
+        return f"LazyRow({self.todict()!r})"
+
+
+class GroupCommitWriter(Thread):
+    """
+    Single long-lived writer for the dstdb. Writes are queued from any thread and
+    committed, along with the snapshot lines, in groups of at most 'max_rows' rows or
+    after 'max_latency' seconds, whichever comes first. This keeps one connection
+    and one open snapshot file rather than one of each per file.
+
+    If a group fails to commit, it is retried one put() and then one file at a time so
+    that only the offending rows fail. Those are logged and kept in 'failed'. The
+    'on_commit' of each put() is called with its files that were committed.
+
+    Use with DFBDST.group_commit()
+    """
+
+    def __init__(self, dstdb, max_rows=1000, max_latency=1.0):
+        self.dstdb = dstdb
+        self.max_rows = max_rows
+        self.max_latency = max_latency
+
+        self.queue = queue.Queue()
+        self.error = None
+        self.count = 0
+        self.failed = []  # Files that could not be written
+
+        super().__init__(daemon=True)
+
+    def start(self, *args, **kwargs):
+        super().start(*args, **kwargs)
+        return self
+
+    def put(self, sql, files, on_commit=None):
+        if self.error:
+            raise self.error
+        # Encode now in the calling thread in case the dicts are later modified
+        lines = [json.dumps(file) for file in files]
+        self.queue.put((sql, files, lines, on_commit))
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+        if self.error:
+            raise self.error
+
+    def run(self):
+        db = self.dstdb.db()
+        fp = self.dstdb.snap_file.open(mode="at")
+        pending = []
+        nrows = 0
+        deadline = None
+        item = "start"
+
+        try:
+            while True:
+                timeout = None if deadline is None else max(0, deadline - time.time())
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = "timeout"
+
+                if isinstance(item, tuple):
+                    pending.append(item)
+                    nrows += len(item[1])
+                    if deadline is None:
+                        deadline = time.time() + self.max_latency
+
+                if pending and (not isinstance(item, tuple) or nrows >= self.max_rows):
+                    self._commit(db, fp, pending)
+                    pending, nrows, deadline = [], 0, None
+
+                if item is None:
+                    break
+        except Exception as EE:
+            logger.error(f"dstdb writer failed. {EE}")
+            self.error = EE
+            # Drain until closed so that callers are never blocked. They will get the
+            # error on the next put() or on close()
+            while item is not None:
+                item = self.queue.get()
+        finally:
+            fp.close()
+            db.close()
+
+    def _commit(self, db, fp, pending):
+        try:
+            with db:
+                for sql, files, _, _ in pending:
+                    self.dstdb._write_files(db, sql, files)
+        except sqlite3.Error as EE:
+            # Rolled back. Retry so that the rest of the group is still written
+            logger.debug(f"dstdb group commit failed. Retrying in parts. {EE}")
+            pending = [self._retry(db, *item) for item in pending]
+
+        for _, _, lines, _ in pending:
+            for line in lines:
+                print(line, file=fp)
+        fp.flush()
+
+        n = sum(len(files) for _, files, _, _ in pending)
+        self.count += n
+        logger.debug(f"dstdb writer committed {n} rows ({self.count} total)")
+
+        for _, files, _, on_commit in pending:
+            if on_commit and files:
+                on_commit(files)
+
+    def _retry(self, db, sql, files, lines, on_commit):
+        """
+        Write one put() on its own and, if that fails, one file at a time. Returns the
+        (sql, files, lines, on_commit) that were written
+        """
+        if len(files) > 1:
+            try:
+                with db:
+                    self.dstdb._write_files(db, sql, files)
+                return sql, files, lines, on_commit
+            except sqlite3.Error:
+                pass
+
+        written = []
+        for file, line in zip(files, lines):
+            try:
+                with db:
+                    self.dstdb._write_files(db, sql, [file])
+            except sqlite3.Error as EE:
+                logger.error(f"Could not record {file.get('apath')!r} in dstdb. {EE}")
+                self.failed.append(file)
+                continue
+            written.append((file, line))
+        files = [file for file, _ in written]
+        return sql, files, [line for _, line in written], on_commit
@@ -0,0 +1,231 @@
+"""
+Local cache of source file hashes so that unchanged files are not read and hashed
+again on every backup. See the 'hash_cache' setting.
+
+Files are judged unchanged by (path, size, mtime, inode). Only new or changed files are
+hashed, in a process pool, for the types that can be computed with the same output as
+rclone.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import multiprocessing
+import sqlite3
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .utils import MyRow, listify
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 1024 * 1024
+WRITE_BATCH = 50_000  # Paths seen and hashes computed are written in batches
+
+
+class _CRC32:
+    """hashlib-like CRC32 with rclone's output"""
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self):
+        return f"{self.value:08x}"
+
+
+# rclone hash name to a hashlib-like constructor
+HASHERS = {
+    "md5": hashlib.md5,
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    "sha512": hashlib.sha512,
+    "crc32": _CRC32,
+}
+
+
+def hash_file(path, hashtypes):
+    """Hash the file at 'path' with each of 'hashtypes'. Run in the process pool"""
+    hashers = {name: HASHERS[name]() for name in hashtypes}
+    with open(path, "rb") as fp:
+        while block := fp.read(BLOCK_SIZE):
+            for hasher in hashers.values():
+                hasher.update(block)
+    return {name: hasher.hexdigest() for name, hasher in hashers.items()}
+
+
+class HashCache:
+    """
+    Cache of the hashes of the files of a local source. Use fill() on the listed
+    files (without hashes). Must be used from one thread.
+    """
+
+    def __init__(self, config, root, hashtypes, *, prune=True, processes=None):
+        self.config = config
+        self.root = root
+        self.hashtypes = hashtypes
+        self.prune = prune  # Remove what is not seen. Do not use with a subdir
+        self.processes = processes or os.cpu_count()
+
+        self.path = config.dbcache_dir / f"{config.config_id}.hashes.db"
+        self.db = sqlite3.connect(self.path)
+        self.db.row_factory = MyRow
+        with self.db:
+            self.db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS hashes(
+                    path TEXT PRIMARY KEY,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    inode INTEGER,
+                    hashes TEXT
+                )"""
+            )
+            self.db.execute("CREATE TEMP TABLE seen(path TEXT PRIMARY KEY)")
+
+        self.counts = {"cached": 0, "hashed": 0, "rclone": 0}
+
+    @classmethod
+    def from_config(cls, config, root, **kwargs):
+        """
+        Set up the cache if it can be used, otherwise None. 'root' is the local path of
+        the source or empty if it is not local.
+        """
+        if not config.hash_cache:
+            return
+        if not root:
+            logger.warning("'hash_cache' is only for local sources. Not used")
+            return
+
+        hashtypes = listify(config.hash_type)
+        if not hashtypes:  # All that rclone would give
+            hashtypes = config.rc.features(config.src).get("Hashes", [])
+
+        if skipped := [h for h in hashtypes if h not in HASHERS]:
+            logger.warning(
+                f"'hash_cache' cannot compute {skipped}. Only using "
+                f"{[h for h in hashtypes if h in HASHERS]}. Set 'hash_type' to some "
+                f"of {list(HASHERS)} to avoid this warning"
+            )
+        if not (hashtypes := [h for h in hashtypes if h in HASHERS]):
+            logger.warning("No hash types for 'hash_cache'. Not used")
+            return
+
+        return cls(config, root, hashtypes, **kwargs)
+
+    def fill(self, files):
+        """
+        Set the 'checksum' of each file dict and yield it. Cached ones come right
+        away; the rest as they are hashed. Order is not kept.
+        """
+        ctx = multiprocessing.get_context("spawn")  # Safe with the other threads
+        pending = deque()
+        updates = []
+        seen = []
+
+        def _result(file, key, future):
+            try:
+                hashes = future.result()
+            except OSError as EE:
+                logger.debug(f"Could not hash {file['apath']!r} locally: {EE}")
+                return self._rclone_hashes(file)
+            self.counts["hashed"] += 1
+            if key:
+                updates.append((file["apath"], *key, json.dumps(hashes)))
+                if len(updates) >= WRITE_BATCH:
+                    self._flush_updates(updates)
+            file["checksum"] = hashes
+            return file
+
+        complete = False
+        try:
+            with ProcessPoolExecutor(self.processes, mp_context=ctx) as pool:
+                for file in files:
+                    apath = file["apath"]
+                    seen.append((apath,))
+                    if len(seen) >= WRITE_BATCH:
+                        self._flush_seen(seen)
+
+                    local = os.path.join(self.root, apath)
+                    try:
+                        st = os.stat(local)
+                    except OSError:  # e.g. .rclonelink files
+                        yield self._rclone_hashes(file)
+                        continue
+
+                    key = (st.st_size, st.st_mtime_ns, st.st_ino)
+                    if hashes := self._lookup(apath, key):
+                        self.counts["cached"] += 1
+                        file["checksum"] = hashes
+                        yield file
+                        continue
+
+                    future = pool.submit(hash_file, local, self.hashtypes)
+                    pending.append((file, key, future))
+
+                    # Keep the pool busy but do not get too far ahead
+                    while pending and (
+                        pending[0][2].done() or len(pending) > 16 * self.processes
+                    ):
+                        yield _result(*pending.popleft())
+
+                while pending:
+                    yield _result(*pending.popleft())
+            complete = True
+        finally:
+            # Keep what was hashed even if stopped early but only prune what was not
+            # seen after a full listing
+            self._flush_updates(updates)
+            if complete and self.prune:
+                self._flush_seen(seen)
+                with self.db:
+                    self.db.execute(
+                        "DELETE FROM hashes WHERE path NOT IN (SELECT path FROM seen)"
+                    )
+            self.db.close()
+
+        logger.info(
+            f"Source hashes: {self.counts['cached']} cached, "
+            f"{self.counts['hashed']} hashed, {self.counts['rclone']} from rclone"
+        )
+
+    def _lookup(self, apath, key):
+        row = self.db.execute(
+            "SELECT size, mtime_ns, inode, hashes FROM hashes WHERE path = ?", (apath,)
+        ).fetchone()
+        if not row or tuple(row)[:3] != key:
+            return
+        hashes = json.loads(row["hashes"])
+        if not all(h in hashes for h in self.hashtypes):
+            return
+        return {h: hashes[h] for h in self.hashtypes}
+
+    def _flush_updates(self, updates):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO hashes VALUES (?,?,?,?,?)", updates
+            )
+        updates.clear()
+
+    def _flush_seen(self, seen):
+        self.db.executemany("INSERT OR IGNORE INTO seen VALUES (?)", seen)
+        seen.clear()
+
+    def _rclone_hashes(self, file):
+        """Fallback for files that can't be hashed locally. Not cached"""
+        self.counts["rclone"] += 1
+        try:
+            item = self.config.rc.stat(
+                (self.config.src, file["apath"]),
+                hashes=True,
+                hashtypes=self.hashtypes,
+            )
+            if hashes := (item or {}).get("Hashes"):
+                file["checksum"] = hashes
+        except Exception as EE:
+            logger.warning(f"Could not get hashes for {file['apath']!r}: {EE}")
+        return file
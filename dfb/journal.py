@@ -0,0 +1,170 @@
+"""
+Journal of the plan of a backup so that an interrupted one can be resumed with
+'dfb backup --resume'. See the 'resume_journal' setting.
+
+The plan (new, modified, moves, and deleted with their file dicts and the timestamp)
+is saved in '<config_id>.plan.db' alongside the database before anything is
+transferred. Items are marked done as they are recorded in the destination database.
+That database has the final say: anything already in it at the plan's timestamp is
+also skipped when resuming.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+from threading import Lock
+
+from .utils import MyRow
+
+logger = logging.getLogger(__name__)
+
+# Done items are committed at least this often
+FLUSH_COUNT = 1000
+FLUSH_SECONDS = 1.0
+
+
+class NoPlanError(ValueError):
+    pass
+
+
+class PlanJournal:
+    """
+    The saved plan. Use create() for a new plan or load() for the last one. done()
+    can be called from any thread. close() when the backup is over.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.path = config.dbcache_dir / f"{config.config_id}.plan.db"
+
+        self._lock = Lock()
+        self._pending = []
+        self._flushed = time.monotonic()
+        self.db = None
+
+    @classmethod
+    def create(cls, config, backup):
+        """Save the plan of 'backup', replacing any previous one"""
+        journal = cls(config)
+        if journal.path.exists():
+            old = cls.load(config)
+            if remain := old.count(done=False):
+                logger.info(
+                    f"Replacing the plan from {old.info['dt']} with {remain} items "
+                    "not done"
+                )
+            old.db.close()
+            journal.path.unlink()
+
+        journal._connect()
+        cliconfig = config.cliconfig
+        info = {
+            "ts": config.now.ts,
+            "dt": config.now.dt,
+            "src": config.src,
+            "dst": config.dst,
+            "subdir": cliconfig.subdir or "",
+            "rename_method": config.rename_method,
+        }
+
+        def _items():
+            for kind in ["new", "modified"]:
+                for apath in getattr(backup, kind):
+                    yield apath, kind, dict(backup.src_files[apath])
+            for dfile, sfile in backup.moves:
+                yield sfile["apath"], "move", [dict(dfile), dict(sfile)]
+            for apath in backup.deleted:
+                yield apath, "delete", dict(backup.dst_files[apath])
+
+        with journal.db:
+            journal.db.executemany(
+                "INSERT INTO info VALUES (?,?)",
+                [(key, json.dumps(val)) for key, val in info.items()],
+            )
+            journal.db.executemany(
+                "INSERT INTO items(apath, kind, file) VALUES (?,?,?)",
+                ((apath, kind, json.dumps(file)) for apath, kind, file in _items()),
+            )
+        journal.info = info
+        logger.debug(f"Saved the plan of {journal.count()} items to {journal.path}")
+        return journal
+
+    @classmethod
+    def load(cls, config):
+        """The saved plan. Raises NoPlanError if there is none"""
+        journal = cls(config)
+        if not journal.path.exists():
+            hint = "" if config.resume_journal else ". Plans need 'resume_journal'"
+            raise NoPlanError(
+                f"No backup plan to resume at {str(journal.path)!r}{hint}"
+            )
+        journal._connect()
+        rows = journal.db.execute("SELECT key, val FROM info")
+        journal.info = {row["key"]: json.loads(row["val"]) for row in rows}
+        return journal
+
+    def _connect(self):
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.row_factory = MyRow
+        with self.db:
+            self.db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS info(
+                    key TEXT PRIMARY KEY,
+                    val TEXT
+                )"""
+            )
+            self.db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS items(
+                    apath TEXT PRIMARY KEY,
+                    kind TEXT,
+                    file TEXT,
+                    done INTEGER DEFAULT 0
+                )"""
+            )
+
+    def count(self, done=None):
+        sql = "SELECT COUNT(*) FROM items"
+        if done is not None:
+            sql += f" WHERE done = {int(done)}"
+        return self.db.execute(sql).fetchone()[0]
+
+    def remaining(self):
+        """Yield (kind, file) of the items not done"""
+        rows = self.db.execute("SELECT kind, file FROM items WHERE done = 0")
+        for row in rows:
+            yield row["kind"], json.loads(row["file"])
+
+    def done(self, apath):
+        with self._lock:
+            self._pending.append((apath,))
+            if (
+                len(self._pending) >= FLUSH_COUNT
+                or time.monotonic() - self._flushed >= FLUSH_SECONDS
+            ):
+                self._flush()
+
+    def _flush(self):
+        with self.db:
+            sql = "UPDATE items SET done = 1 WHERE apath = ?"
+            self.db.executemany(sql, self._pending)
+        self._pending.clear()
+        self._flushed = time.monotonic()
+
+    def close(self):
+        """Commit what is done. The journal is removed if everything is"""
+        with self._lock:
+            self._flush()
+        remain = self.count(done=False)
+        self.db.close()
+        if remain:
+            logger.info(
+                f"{remain} planned item{'s' if remain != 1 else ''} not done. "
+                "Use 'backup --resume' to retry only those"
+            )
+            return
+        os.unlink(self.path)
+        logger.debug("Plan done. Removed the journal")
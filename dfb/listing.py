@@ -32,6 +32,7 @@ def snapshot(config):
         export=args.export,  # below is ignored if export.
         remove_delete=args.deleted == 0,
         delete_only=args.deleted > 1,
+        checksums=True,
         add_query="ORDER BY LOWER(apath)",
     )
     rows = (dstdb.fullrow2dict(row) for row in rows)
@@ -80,13 +81,14 @@ def tree(config):
         before=args.before,
         after=args.after,
         groupselect=groupselect,
+        latestselect=groupselect,  # Also valid for the latest table
         conditions=conditions,
         remove_delete=args.deleted == 0,
         delete_only=args.deleted > 1,
         add_query="ORDER BY LOWER(apath)",
     )
 
-    rows = [dstdb.fullrow2dict(row) for row in rows]
+    rows = [dstdb.fullrow2lazy(row) for row in rows]
 
     treedict = {}
     for row in rows:
@@ -99,7 +101,7 @@ def tree(config):
                 current_node[part] = {}
             current_node = current_node[part]
 
-        # 'row' is a dict so wrap it in a tuple for later type check
+        # 'row' is a mapping so wrap it in a tuple for later type check
         current_node[parts[-1]] = (row,)
 
     def _print_tree(treedict, indent="", depth=1):
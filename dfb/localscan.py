@@ -0,0 +1,515 @@
+"""
+Native lister for local sources. Walks the source with os.scandir in threads and yields
+the same items as 'rclone lsjson --recursive' (as Backup.iter_src uses them) without
+the subprocess and the JSON round trip. See the 'local_scanner' setting.
+
+The rclone filters are compiled into regular expressions that follow rclone's glob
+rules (https://rclone.org/filtering/). Anything that is not supported raises
+Unsupported when the scanner is set up, before anything is listed, so the caller can
+fall back to rclone.
+"""
+
+import os
+import re
+import stat
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+
+from .utils import listify
+
+logger = logging.getLogger(__name__)
+
+LINK_SUFFIX = ".rclonelink"
+
+_SURROGATES = re.compile("[\udc80-\udcff]")
+
+# Flags that take a value
+_VALUE_FLAGS = {
+    "--include",
+    "--include-from",
+    "--exclude",
+    "--exclude-from",
+    "--filter",
+    "--filter-from",
+    "--exclude-if-present",
+    "--min-size",
+    "--max-size",
+}
+_BOOL_FLAGS = {"--ignore-case", "--one-file-system", "-x", "--delete-excluded"}
+
+
+class Unsupported(ValueError):
+    """The source, filters, or flags can't be listed natively"""
+
+
+def glob2regex(glob, ignore_case=False):
+    """
+    Convert an rclone glob to a compiled regex. Follows rclone's GlobToRegexp: leading
+    '/' anchors to the root, '*' doesn't cross '/', '**' does, '{a,b}' alternates, and
+    '[...]' is passed through.
+    """
+    if "{{" in glob:
+        raise Unsupported(f"Regular expressions in filters are not supported: {glob!r}")
+
+    out = ["(?i)"] if ignore_case else []
+    if glob.startswith("/"):
+        glob = glob[1:]
+        out.append("^")
+    else:
+        out.append("(^|/)")
+
+    stars = 0
+    in_braces = False
+    in_brackets = 0
+    slashed = False
+    for c in glob:
+        if slashed:
+            out.append(c)
+            slashed = False
+            continue
+        if c != "*" and stars:
+            if stars > 2:
+                raise Unsupported(f"Too many stars in {glob!r}")
+            out.append("[^/]*" if stars == 1 else ".*")
+            stars = 0
+        if in_brackets:
+            if c == "[":
+                raise Unsupported(f"Nested or character class brackets in {glob!r}")
+            out.append(c)
+            if c == "]":
+                in_brackets -= 1
+            continue
+
+        if c == "\\":
+            out.append(c)
+            slashed = True
+        elif c == "*":
+            stars += 1
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            out.append(c)
+            in_brackets += 1
+        elif c == "]":
+            raise Unsupported(f"Mismatched ']' in {glob!r}")
+        elif c == "{":
+            if in_braces:
+                raise Unsupported(f"Nested '{{' in {glob!r}")
+            in_braces = True
+            out.append("(")
+        elif c == "}":
+            if not in_braces:
+                raise Unsupported(f"Mismatched '}}' in {glob!r}")
+            in_braces = False
+            out.append(")")
+        elif c == ",":
+            out.append("|" if in_braces else ",")
+        elif c in ".+()|^$":
+            out.append("\\" + c)
+        else:
+            out.append(c)
+
+    if stars > 2:
+        raise Unsupported(f"Too many stars in {glob!r}")
+    if stars:
+        out.append("[^/]*" if stars == 1 else ".*")
+    if in_brackets or in_braces or slashed:
+        raise Unsupported(f"Unterminated pattern {glob!r}")
+    out.append("$")
+
+    return re.compile("".join(out))
+
+
+def dir_globs(glob):
+    """
+    The directory globs that must be matched to reach the files of a glob, deepest
+    first. Follows rclone: every parent and everything up to a '**'. A glob with no
+    '/' could be in any directory.
+    """
+    if "/" not in glob and "**" not in glob:
+        return ["/**"]
+
+    out = []
+    for ii in range(len(glob) - 1, -1, -1):
+        if glob[ii] == "/":
+            dglob = glob[: ii + 1]
+        elif glob[ii - 1 : ii + 1] == "**" and ii > 0:
+            dglob = glob[: ii + 1] + "/"
+        else:
+            continue
+        if dglob not in out and dglob not in {"/", glob}:
+            out.append(dglob)
+    return out
+
+
+class RcloneFilter:
+    """
+    Compiled rclone filters. Raises Unsupported if the flags can't be matched exactly.
+
+    Rules are (include, regex) and the first match wins. File rules are checked on the
+    path and directory rules on the path with a trailing '/'. Like rclone, include rules
+    also include the directories leading to them and '--include' adds an implicit
+    '- /**' at the end.
+    """
+
+    def __init__(self, filter_flags):
+        self.file_rules = []
+        self.dir_rules = []
+        self.if_present = []
+        self.one_file_system = False
+        self.min_size = self.max_size = None
+
+        flags = self._parse(filter_flags)
+        self.ignore_case = bool(flags.pop("--ignore-case", False))
+        self.one_file_system = bool(
+            flags.pop("--one-file-system", False) or flags.pop("-x", False)
+        )
+        flags.pop("--delete-excluded", None)  # Doesn't affect listing
+        self.if_present = flags.pop("--exclude-if-present", [])
+
+        if vals := flags.pop("--min-size", None):
+            self.min_size = parse_size(vals[-1])
+        if vals := flags.pop("--max-size", None):
+            self.max_size = parse_size(vals[-1])
+
+        # rclone reads them in this order regardless of the command line order
+        include = exclude = False  # Warn like rclone
+        for glob in flags.pop("--include", []):
+            self.add(True, glob)
+            include = True
+        for path in flags.pop("--include-from", []):
+            for glob in _read_lines(path):
+                self.add(True, glob)
+            include = True
+        for glob in flags.pop("--exclude", []):
+            self.add(False, glob)
+            exclude = True
+        for path in flags.pop("--exclude-from", []):
+            for glob in _read_lines(path):
+                self.add(False, glob)
+            exclude = True
+        if include and exclude:
+            logger.warning(
+                "Using --filter is recommended instead of both --include and --exclude "
+                "as the order they are parsed in is indeterminate"
+            )
+
+        for rule in flags.pop("--filter", []):
+            self.add_rule(rule)
+        for path in flags.pop("--filter-from", []):
+            for rule in _read_lines(path):
+                self.add_rule(rule)
+
+        if include:
+            self.add(False, "/**")
+
+        if flags:
+            raise Unsupported(f"Unsupported filter flags {sorted(flags)}")
+
+    @staticmethod
+    def _parse(filter_flags):
+        flags = {}
+        filter_flags = [str(f) for f in listify(filter_flags)]
+        ii = 0
+        while ii < len(filter_flags):
+            flag = filter_flags[ii]
+            ii += 1
+            flag, eq, val = flag.partition("=")
+            if flag in _BOOL_FLAGS:
+                if eq and val.lower() not in {"true", "1"}:
+                    continue
+                flags[flag] = True
+            elif flag in _VALUE_FLAGS:
+                if not eq:
+                    if ii >= len(filter_flags):
+                        raise Unsupported(f"Missing value for {flag}")
+                    val = filter_flags[ii]
+                    ii += 1
+                flags.setdefault(flag, []).append(val)
+            else:
+                flags[flag] = True  # Will raise Unsupported
+        return flags
+
+    def add(self, include, glob):
+        is_dir = glob.endswith("/")
+        is_file = not is_dir
+        if is_dir and not include:  # Excluding "dir/" excludes "dir/**"
+            glob += "**"
+        if "**" in glob:
+            is_dir = is_file = True
+        if is_file:
+            self.file_rules.append((include, glob2regex(glob, self.ignore_case)))
+            if include or glob == "*":
+                for dglob in dir_globs(glob):
+                    regex = glob2regex(dglob, self.ignore_case)
+                    self.dir_rules.append((include, regex))
+        if is_dir:
+            self.dir_rules.append((include, glob2regex(glob, self.ignore_case)))
+
+    def add_rule(self, rule):
+        if rule == "!":
+            self.file_rules.clear()
+            self.dir_rules.clear()
+        elif rule.startswith("+ "):
+            self.add(True, rule[2:])
+        elif rule.startswith("- "):
+            self.add(False, rule[2:])
+        else:
+            raise Unsupported(f"Malformed filter rule {rule!r}")
+
+    def include_file(self, path, size):
+        if self.min_size is not None and size < self.min_size:
+            return False
+        if self.max_size is not None and size > self.max_size:
+            return False
+        return _first_match(self.file_rules, path)
+
+    def include_dir(self, path):
+        return _first_match(self.dir_rules, path + "/")
+
+    def include_path(self, path, size=0, is_dir=False):
+        """
+        Whether 'path' (from the root) is listed, including that none of its parent
+        directories are excluded. Does not check '--exclude-if-present'
+        """
+        names = path.split("/")
+        for ii in range(1, len(names)):
+            if not self.include_dir("/".join(names[:ii])):
+                return False
+        return self.include_dir(path) if is_dir else self.include_file(path, size)
+
+
+def _first_match(rules, path):
+    for include, regex in rules:
+        if regex.search(path):
+            return include
+    return True
+
+
+def _read_lines(path):
+    with open(path, encoding="utf8") as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line[0] in "#;":
+                continue
+            yield line
+
+
+def parse_size(size):
+    """rclone SizeSuffix: KiB unless a suffix (b, k, m, g, t, p) is given"""
+    size = size.strip().lower()
+    if size == "off":
+        return None
+    mult = {"b": 1, "k": 1, "m": 2, "g": 3, "t": 4, "p": 5}
+    power = 1
+    if size and size[-1] in mult:
+        power = mult[size[-1]] if size[-1] != "b" else 0
+        size = size[:-1]
+    try:
+        return int(float(size) * 1024**power)
+    except ValueError:
+        raise Unsupported(f"Can't parse size {size!r}")
+
+
+def ns2epoch(ns):
+    """Nanoseconds to the same epoch float as timestamp_parser on rclone's ModTime"""
+    sec, frac = divmod(ns, 1_000_000_000)
+    us = round(float(f".{frac:09d}") * 1e6)  # Rounded like timestamp_parser
+    return (sec * 1_000_000 + us) / 1_000_000
+
+
+class LocalScanner:
+    """
+    Lists 'root' like 'rclone lsjson --recursive' with the filters. Directories are
+    scanned concurrently with 'threads'. Items are dicts with Path, Size, ModTime (epoch
+    float, like rclone's after timestamp_parser), and IsDir. Order is not rclone's.
+    """
+
+    def __init__(self, root, *, filter_flags=None, rclone_flags=None, threads=None):
+        self.root = os.path.abspath(root)
+        self.filters = RcloneFilter(filter_flags)
+        self.threads = threads or min(32, (os.cpu_count() or 1) + 4)
+
+        self.links = None  # Like rclone without link flags: skip with a notice
+        for flag in (str(f) for f in listify(rclone_flags)):
+            flag = flag.split("=")[0]
+            if flag in {"-l", "--links"}:
+                self.links = "link"
+            elif flag == "--skip-links":
+                self.links = "skip"
+            elif flag in {"-L", "--copy-links"} or flag.startswith("--local-"):
+                raise Unsupported(f"rclone flag {flag!r} is not supported")
+
+        if not os.path.isdir(self.root):
+            raise Unsupported(f"{self.root!r} is not a directory")
+        self.dev = os.stat(self.root).st_dev
+
+    def __iter__(self):
+        if self._excluded_by_marker(self.root):
+            return
+        yield from self._walk([(self.root, "")])
+
+    def scoped(self, files=(), trees=()):
+        """
+        Like iterating but only 'files' and, recursively, 'trees' (paths relative to the
+        root). The filters still apply from the root, including to the parents of each
+        path. Paths that are missing or excluded are skipped.
+        """
+        seen = set()  # Links can be called with and without the suffix
+        for rel in files:
+            item = self._lookup(rel)
+            if item and not item["IsDir"] and item["Path"] not in seen:
+                seen.add(item["Path"])
+                yield item
+
+        starts = []
+        for rel in trees:
+            if not rel.strip("/"):
+                yield from self
+            elif (item := self._lookup(rel)) and item["IsDir"]:
+                yield item
+                starts.append((os.path.join(self.root, rel), item["Path"]))
+        yield from self._walk(starts)
+
+    def _walk(self, starts):
+        """Recursively list the (local path, path) directories of 'starts'"""
+        with ThreadPoolExecutor(self.threads) as pool:
+            pending = {pool.submit(self._scan, *start) for start in starts}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    items, subdirs = future.result()
+                    pending.update(pool.submit(self._scan, *d) for d in subdirs)
+                    yield from items
+
+    def _lookup(self, rel):
+        """The item for one path or None if it or any parent is missing or excluded"""
+        if self._excluded_by_marker(self.root):
+            return
+
+        names = [name for name in rel.split("/") if name]
+        if not names:
+            return
+
+        full, path = self.root, ""
+        for ii, name in enumerate(names):
+            full = os.path.join(full, name)
+            try:
+                st = os.lstat(full)
+            except (FileNotFoundError, NotADirectoryError):
+                # Called by its listed name such as from a previous backup
+                if not (
+                    ii == len(names) - 1
+                    and self.links == "link"
+                    and name.endswith(LINK_SUFFIX)
+                ):
+                    return
+                full = full.removesuffix(LINK_SUFFIX)
+                try:
+                    st = os.lstat(full)
+                except FileNotFoundError:
+                    return
+                if not stat.S_ISLNK(st.st_mode):
+                    return
+                name = name.removesuffix(LINK_SUFFIX)
+
+            kind = stat.S_IFMT(st.st_mode)
+            item = self._item(_clean_name(name), path, full, kind, lambda st=st: st)
+            if not item:
+                return
+            if ii < len(names) - 1 and not item["IsDir"]:
+                return
+            path = item["Path"]
+        return item
+
+    def _excluded_by_marker(self, path):
+        return any(
+            os.path.lexists(os.path.join(path, name))
+            for name in self.filters.if_present
+        )
+
+    def _scan(self, full, rel):
+        """Scan one directory. Returns the items and the subdirectories to scan"""
+        items = []
+        subdirs = []
+        try:
+            entries = list(os.scandir(full))
+        except OSError as EE:  # rclone also logs and moves on
+            logger.error(f"ERROR: {rel or '.'!r}: error reading directory: {EE}")
+            return items, subdirs
+
+        for entry in entries:
+            try:
+                item = self._entry(entry, rel)
+            except OSError as EE:  # Such as removed since the scandir
+                logger.error(f"ERROR: {entry.path!r}: {EE}")
+                continue
+            if not item:
+                continue
+            items.append(item)
+            if item["IsDir"]:
+                subdirs.append((entry.path, item["Path"]))
+        return items, subdirs
+
+    def _entry(self, entry, rel):
+        """The item for a directory entry or None if it is excluded"""
+        if entry.is_symlink():
+            kind = stat.S_IFLNK
+        elif entry.is_dir(follow_symlinks=False):
+            kind = stat.S_IFDIR
+        elif entry.is_file(follow_symlinks=False):
+            kind = stat.S_IFREG
+        else:
+            kind = None
+        st = partial(entry.stat, follow_symlinks=False)  # Cached by the entry
+        return self._item(_clean_name(entry.name), rel, entry.path, kind, st)
+
+    def _item(self, name, rel, full, kind, st):
+        """
+        The item for 'name' in the directory 'rel' or None if it is excluded. 'full' is
+        the local path, 'kind' the stat.S_IF* file type, and 'st' a function for the
+        lstat result
+        """
+        filters = self.filters
+        path = f"{rel}/{name}" if rel else name
+
+        if kind == stat.S_IFLNK:
+            if self.links is None:
+                logger.info(f"NOTICE: {path}: Can't follow symlink")
+                return
+            if self.links == "skip":
+                return
+            path += LINK_SUFFIX
+            size = len(os.readlink(os.fsencode(full)))
+            if not filters.include_file(path, size):
+                return
+        elif kind == stat.S_IFDIR:
+            if not filters.include_dir(path):
+                return
+            if filters.one_file_system and st().st_dev != self.dev:
+                return
+            if self._excluded_by_marker(full):
+                return
+            size = st().st_size  # rclone's local backend reports this, not -1
+        elif kind == stat.S_IFREG:
+            size = st().st_size
+            if not filters.include_file(path, size):
+                return
+        else:
+            logger.info(f"NOTICE: {path}: Can't transfer non file/directory")
+            return
+
+        return {
+            "Path": path,
+            "Size": size,
+            "ModTime": ns2epoch(st().st_mtime_ns),
+            "IsDir": kind == stat.S_IFDIR,
+        }
+
+
+def _clean_name(name):
+    """rclone replaces each invalid UTF-8 byte"""
+    if not name.isascii():
+        name = _SURROGATES.sub("\ufffd", name)
+    return name
@@ -14,6 +14,7 @@ import gzip as gz
 from operator import itemgetter
 
 from . import LOCK
+from .concurrency import concurrency_limit
 from .utils import human_readable_bytes, smart_open
 from .timestamps import timestamp_parser
 from .dstdb import DFBDST
@@ -166,7 +167,8 @@ class Prune:
                 with LOCK:
                     self.errcount += 1
 
-        rpaths = tmap(_delete, rpaths, Nt=self.config.concurrency)
+        Nt = concurrency_limit(self.config, name="prunes")
+        rpaths = tmap(_delete, rpaths, Nt=Nt)
         rpaths = filter(bool, rpaths)  # Remove errors
         rpaths = map(self.dstdb.delete_rpath, rpaths)  # on main thread only
         for _ in rpaths:
@@ -346,12 +348,7 @@ class PruneableDFBDST(DFBDST):
         """
         db = self.db()
         with db:
-            db.execute(
-                """
-                DELETE FROM items 
-                WHERE rpath = ?""",
-                (rpath,),
-            )
+            self._delete_rpaths(db, [rpath])
         db.commit()
         db.close()
 
@@ -34,6 +34,9 @@ import warnings
 import types
 import time
 import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from functools import partialmethod, cached_property, partial
 
 from .timestamps import timestamp_parser
@@ -311,6 +314,139 @@ class RcloneCLI:
 
     ls = listremote
 
+    def listremote_partitioned(
+        self,
+        subdir="",
+        *,
+        partitions=1,
+        depth=1,
+        filter_flags=None,
+        only=None,
+        **kwargs,
+    ):
+        """
+        Like listremote but split into partitions listed concurrently. Useful on
+        remotes without ListR where a single recursive listing is latency-bound.
+
+        The directories at 'depth' (and the files above them) are found with a shallow
+        '--max-depth' listing. Those directories are then split among concurrent
+        recursive listings of the same root, each excluding what the others list, so
+        that the filters (including anchored ones) mean the same thing. The items are
+        yielded as they come in, not in rclone's order.
+
+        Falls back to a plain listremote if partitions <= 1 or the filters can't be
+        combined with the exclusions (e.g. --include, --files-from, --ignore-case).
+
+        Inputs:
+        -------
+        partitions [1]
+            Number of concurrent listings
+
+        depth [1]
+            Depth of the directories to split on
+
+        filter_flags, only, **kwargs
+            Passed to listremote. See listremote
+        """
+        filter_flags = [str(f) for f in _flagify(filter_flags)]
+        kwargs.pop("maxdepth", None)  # Always full depth
+
+        # Filters may also be in the other flags
+        flags = self.uflags + [str(f) for f in _flagify(kwargs.get("flags"))]
+        if partitions <= 1 or (reason := _no_partition_reason(filter_flags + flags)):
+            if partitions > 1:
+                logger.info(f"Not partitioning the listing: {reason}")
+            yield from self.listremote(
+                subdir, filter_flags=filter_flags, only=only, **kwargs
+            )
+            return
+
+        def want(item):
+            return only != ("dirs" if not item["IsDir"] else "files")
+
+        # Shallow listing for the files and directories at or above depth
+        dirs = []
+        for item in self.listremote(
+            subdir, filter_flags=filter_flags, maxdepth=depth, **kwargs
+        ):
+            if item["IsDir"] and item["Path"].count("/") + 1 == depth:
+                dirs.append(item["Path"])
+            if want(item):
+                yield item
+
+        if not dirs:
+            return
+
+        # More groups than listings to even them out
+        ngroups = min(len(dirs), 4 * partitions)
+        groups = [set(dirs[ii::ngroups]) for ii in range(ngroups)]
+        logger.debug(f"Listing {len(dirs)} directories in {ngroups} partitions")
+
+        # Exclude the files above depth (already listed) and all other groups
+        above = [f"/{'/'.join(['*'] * ii)}" for ii in range(1, depth + 1)]
+
+        results = queue.Queue(maxsize=64)
+        stop = threading.Event()
+        DONE = object()
+
+        def _list(tmpdir, ii, group):
+            try:
+                others = [_glob_escape(d) for d in dirs if d not in group]
+                exclude = above + [f"/{{{','.join(others)}}}/**"] if others else above
+                exfile = os.path.join(tmpdir, f"exclude{ii}.txt")
+                with open(exfile, "wt", encoding="utf8") as fp:
+                    fp.write("\n".join(exclude) + "\n")
+
+                chunk = []
+                for item in self.listremote(
+                    subdir,
+                    filter_flags=filter_flags + ["--exclude-from", exfile],
+                    **kwargs,
+                ):
+                    if stop.is_set():
+                        return
+                    path = item["Path"]
+                    if path.count("/") < depth:  # Parents. Already listed
+                        continue
+                    if "/".join(path.split("/")[:depth]) not in group:  # New since
+                        continue
+                    if want(item):
+                        chunk.append(item)
+                    if len(chunk) >= 1000:
+                        _put(chunk)
+                        chunk = []
+                _put(chunk)
+                _put(DONE)
+            except BaseException as EE:
+                _put(EE)
+
+        def _put(obj):
+            while not stop.is_set():
+                try:
+                    return results.put(obj, timeout=0.1)
+                except queue.Full:
+                    pass
+
+        with tempfile.TemporaryDirectory() as tmpdir, ThreadPoolExecutor(
+            partitions
+        ) as pool:
+            for ii, group in enumerate(groups):
+                pool.submit(_list, tmpdir, ii, group)
+            try:
+                remaining = len(groups)
+                while remaining:
+                    obj = results.get()
+                    if obj is DONE:
+                        remaining -= 1
+                    elif isinstance(obj, BaseException):
+                        raise obj
+                    else:
+                        yield from obj
+            finally:
+                stop.set()
+                # Don't start the queued listings. The running ones see 'stop'
+                pool.shutdown(wait=False, cancel_futures=True)
+
     def iteminfo(self, remoteitem, **kwargs):
         """
         List a single item. This is a convenience function around listremote that just
@@ -1096,6 +1232,57 @@ def popen_streamer(proc, allow_error=False):
     errthread.join()
 
 
+# Filtering flags that take a value, possibly as the next item
+_FILTER_VALUE_FLAGS = {
+    "--include",
+    "--include-from",
+    "--exclude",
+    "--exclude-from",
+    "--exclude-if-present",
+    "--filter",
+    "--filter-from",
+    "--files-from",
+    "--files-from-raw",
+}
+
+
+def _no_partition_reason(flags):
+    """
+    Why listremote_partitioned can't add its exclusions to these flags (filter and
+    other flags together) or None
+    """
+    skip = False
+    for ii, flag in enumerate(flags):
+        if skip:  # The value of the last flag
+            skip = False
+            continue
+
+        flag, eq, val = flag.partition("=")
+        if not eq and flag in _FILTER_VALUE_FLAGS:
+            if ii + 1 >= len(flags):
+                return f"{flag} has no value"
+            val, skip = flags[ii + 1], True
+
+        if flag in {"--include", "--include-from"}:  # Would be read before them
+            return f"{flag} is not supported. Use --filter"
+        if flag.startswith("--files-from") or flag == "--ignore-case":
+            return f"{flag} is not supported"
+        if flag == "--filter" and val.strip() == "!":  # Would clear them
+            return "'!' in --filter is not supported"
+        if flag == "--filter-from":
+            try:
+                with open(val) as fp:
+                    if any(line.strip() == "!" for line in fp):
+                        return "'!' in --filter-from is not supported"
+            except OSError as EE:
+                return f"Could not read --filter-from {val!r}: {EE}"
+
+
+def _glob_escape(name):
+    """Escape a name for rclone's filter globs"""
+    return "".join(f"\\{c}" if c in "\\*?[]{}," else c for c in name)
+
+
 def _flagify(flags):
     flags = flags or []
     if isinstance(flags, str):
@@ -28,6 +28,8 @@ from requests.auth import HTTPBasicAuth
 logger = logging.getLogger(__name__)
 serve_logger = logging.getLogger(f"{__name__}-rc-server")
 
+_MULTIPART_ESCAPED = re.compile(r'["\\%\x00-\x1f\x7f]')
+
 
 class RcloneError(ValueError):
     pass
@@ -236,6 +238,28 @@ class RC:
             params.pop("remote", None)
             return self._write_fallback(dst, content, use_async=use_async, **params)
 
+    def write_many(self, dst_dir, contents, **params):
+        """
+        Write the 'contents' dict of {name: content} into the 'dst_dir' directory with
+        one multi-file 'operations/uploadfile' call. There is no fallback; on an error,
+        some may have been written. Names must pass multi_writable().
+        """
+        params["fs"], params["remote"] = rcpathsplit(dst_dir)
+
+        files = []
+        for ii, (name, content) in enumerate(contents.items()):
+            if not multi_writable(name):
+                raise ValueError(f"Cannot write {name!r} in a multi-file upload")
+            if isinstance(content, str):
+                content = content.encode()
+            files.append((f"file{ii}", (name, content)))
+
+        return self.call(
+            "operations/uploadfile",
+            params=params,
+            postkw=dict(files=files),
+        )
+
     def _write_fallback(self, dst, content, use_async=False, **params):
         _config = params.get("_config", {})
         _config["NoCheckDest"] = True
@@ -739,6 +763,15 @@ class _RawRcloneFileObj(io.RawIOBase):
         return n
 
 
+def multi_writable(name):
+    """
+    Whether 'name' is sent as-is as the filename of a multipart upload. Quotes,
+    backslashes, and control characters get escaped by the encoding and '%' could be
+    read as an escape
+    """
+    return not _MULTIPART_ESCAPED.search(name)
+
+
 def rcpathsplit(path):
     """
     Splits the fs and the remote while acounting for special remotes and connection
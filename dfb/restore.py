@@ -8,6 +8,7 @@ import shlex
 import logging
 
 from . import LOCK
+from .concurrency import concurrency_limit
 from .dstdb import DFBDST
 from .rclonerc import rcpathjoin, rcpathsplit
 from .utils import human_readable_bytes, star, listify, shell_header
@@ -66,7 +67,7 @@ class Restore:
             after=args.after,
             select="apath,rpath,size",
         )
-        snap = map(self.dstdb.fullrow2dict, snap)
+        snap = map(self.dstdb.fullrow2lazy, snap)
 
         # transfers: remote-source (rel to remote), final dest
         transfers = (
@@ -196,7 +197,8 @@ class Restore:
 
         transfers = iter(self.transfers)
         transfers = (t[:2] for t in transfers)
-        transfers = tmap(star(_transfer_rc), transfers, Nt=config.concurrency)
+        Nt = concurrency_limit(config, name="restores")
+        transfers = tmap(star(_transfer_rc), transfers, Nt=Nt)
         for _ in transfers:
             pass
 
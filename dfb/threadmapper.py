@@ -1,6 +1,6 @@
 import logging
 import os
-from threading import Thread
+from threading import Condition, Event, Thread
 from queue import Queue
 
 
@@ -14,7 +14,8 @@ class _KILL:
 class ReturnThread(Thread):
     """
     Like a regular thread except when you `join`, it returns the function
-    result. And .start() will return itself to enable cleaner code.
+    result or raises its exception. And .start() will return itself to enable
+    cleaner code.
 
         >>> mythread = ReturnThread(...).start() # instantiate and start
 
@@ -25,19 +26,72 @@ class ReturnThread(Thread):
         self.target = target
         super().__init__(target=self._target, **kwargs)
         self._res = None
+        self._exc = None
 
     def start(self, *args, **kwargs):
         super().start(*args, **kwargs)
         return self
 
     def _target(self, *args, **kwargs):
-        self._res = self.target(*args, **kwargs)
+        try:
+            self._res = self.target(*args, **kwargs)
+        except BaseException as EE:
+            self._exc = EE
 
     def join(self, *args, **kwargs):
         super().join(*args, **kwargs)
+        if self._exc is not None:
+            raise self._exc
         return self._res
 
 
+class Limit:
+    """
+    Adjustable number of calls that thread_map_unordered runs at once. Pass it as Nt:
+    'max' threads are started but only 'value' of them call the function at a time.
+    'value' can be set from any thread and is kept within [min, max].
+
+    open() and close() are called when thread_map_unordered starts and ends.
+    """
+
+    def __init__(self, value, *, min=1, max=None):
+        self.min = min
+        self.max = max or value
+        self.active = 0  # Calls running now
+        self._cond = Condition()
+        self._value = self._clamp(value)
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        with self._cond:
+            self._value = self._clamp(value)
+            self._cond.notify_all()
+
+    def _clamp(self, value):
+        return max(self.min, min(self.max, int(value)))
+
+    def __enter__(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self.active < self._value)
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+
 # I like my thread_map_unordered more since it provides better control of the buffers
 # and I am pretty sure it works just fine. I have an alternative in comments that I used
 # when I was getting a deadlock. It turned out to be an sqlite3 one (due to an
@@ -71,7 +125,8 @@ def thread_map_unordered(
         Sequence
 
     Nt [None]
-        Number of threads. Defaults to os.cpu_count()
+        Number of threads. Defaults to os.cpu_count(). Can also be a Limit to change
+        the number that run at once while mapping
 
     Nin_buffer [1]
         Number of input items to pull at a time. Set to -1 to be infinite (will exhaust
@@ -103,23 +158,36 @@ def thread_map_unordered(
         never faster. This could bottleneck upstream but that is a good thing for memory usage and control
 
     (2) Can automatically wrap exceptions without an additional code. See options above
+
+    If it is stopped early (an exception or close()), no more items are pulled or
+    started and the calls already running are waited for.
     """
     # Use to know if an exceptoion was raised here and ONLY here. Will be replaced
     thread_map_unordered_exception = os.urandom(5)
     kill = _KILL()
 
+    limit = None
+    if isinstance(Nt, Limit):
+        limit, Nt = Nt, Nt.max
     Nt = Nt or os.cpu_count()
 
     # Limit the input queue so as to not pull the input iterator too quickly
     qin = Queue(maxsize=Nin_buffer)
     qout = Queue(maxsize=Nout_buffer or Nt)
 
+    stop = Event()
+
     def _adder():
         for ii, item in enumerate(seq):
+            if stop.is_set():
+                break
             qin.put((ii, item))
         for _ in range(Nt):
             qin.put((-1, kill))
 
+    if limit:
+        limit.open()
+
     adder_thread = Thread(target=_adder)
     adder_thread.start()
 
@@ -131,8 +199,16 @@ def thread_map_unordered(
                 qin.task_done()
                 break
 
+            if stop.is_set():  # Skip what is left
+                qin.task_done()
+                continue
+
             try:
-                res = fun(item)
+                if limit:
+                    with limit:
+                        res = fun(item)
+                else:
+                    res = fun(item)
             except Exception as _res:
                 res = _res  # I don't get it but this is needed
                 res.seq_index = ii
@@ -146,28 +222,40 @@ def thread_map_unordered(
         worker_thread.start()
 
     tcount = 0
-    while tcount < Nt:
-        res = qout.get()
-
-        # Handle exceptions back in the main thread
-        if (
-            isinstance(res, Exception)
-            and getattr(res, "thread_map_unordered_exception", False)
-            == thread_map_unordered_exception
-        ):
-            res.thread_map_unordered_exception = True  # reset
-            if raise_exceptions:
-                raise res
-
-        if res is kill:
-            tcount += 1
+    try:
+        while tcount < Nt:
+            res = qout.get()
+
+            # Handle exceptions back in the main thread
+            if (
+                isinstance(res, Exception)
+                and getattr(res, "thread_map_unordered_exception", False)
+                == thread_map_unordered_exception
+            ):
+                res.thread_map_unordered_exception = True  # reset
+                if raise_exceptions:
+                    qout.task_done()
+                    raise res
+
+            if res is kill:
+                tcount += 1
+                qout.task_done()
+                continue
+            yield res
             qout.task_done()
-            continue
-        yield res
-        qout.task_done()
+    finally:
+        if tcount < Nt:  # Stopped early. Let the threads finish and discard the rest
+            stop.set()
+            while tcount < Nt:
+                tcount += qout.get() is kill
+                qout.task_done()
+            if limit:
+                limit.close()
 
     qin.join()
     qout.join()
     adder_thread.join()
     for worker_thread in worker_threads:
         worker_thread.join()
+    if limit:
+        limit.close()
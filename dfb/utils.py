@@ -4,6 +4,9 @@ Utilities
 
 import os, sys
 import datetime
+import json
+import heapq
+import tempfile
 import sqlite3
 import random
 import subprocess
@@ -12,6 +15,7 @@ import mimetypes
 import re
 import logging
 from collections import namedtuple
+from itertools import islice
 
 from .timestamps import timestamp_parser, iso8601_parser
 
@@ -320,6 +324,36 @@ def dictify(mydict):
     return mydict
 
 
+def spill_sorted(iterable, key, chunk_size=200_000):
+    """
+    Sort an iterable of JSON-serializable items that may not fit in memory.
+
+    Items are sorted in chunks of 'chunk_size' and each chunk is spilled to a temporary
+    file. The input is consumed before this returns. Returns an iterator that lazily
+    merges the chunks so only one item per chunk is in memory while reading.
+    """
+    iterable = iter(iterable)
+    files = []
+    while chunk := list(islice(iterable, chunk_size)):
+        chunk.sort(key=key)
+        if not files and len(chunk) < chunk_size:  # Fits. No need to spill
+            return iter(chunk)
+
+        fp = tempfile.TemporaryFile(mode="w+t", encoding="utf-8")
+        for item in chunk:
+            fp.write(json.dumps(item, ensure_ascii=False) + "\n")
+        fp.seek(0)
+        files.append(fp)
+        del chunk
+
+    def _read(fp):
+        with fp:
+            for line in fp:
+                yield json.loads(line)
+
+    return heapq.merge(*map(_read, files), key=key)
+
+
 def shell_header(config, cd=True):
     from .rclonerc import RC
 
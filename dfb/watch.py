@@ -0,0 +1,347 @@
+"""
+Watch a local source with inotify and only back up what changed. See `dfb watch`.
+
+Events are coalesced into sets of changed files and directories (that are relisted
+recursively). Every interval, a scoped backup lists and compares only those against
+the destination database. A full backup is run at the start, when the kernel's event
+queue overflowed, and on a schedule, to catch anything that was missed. Directories
+that could not be watched are retried and relisted every interval until they are.
+"""
+
+import os
+import time
+import errno
+import select
+import shutil
+import struct
+import logging
+import ctypes, ctypes.util
+
+from .backup import Backup, Scope, DFB_EMPTY
+from .localscan import LINK_SUFFIX, Unsupported
+
+logger = logging.getLogger(__name__)
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+    | IN_EXCL_UNLINK
+)
+
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len. Followed by the name
+_READ_SIZE = 64 * 1024
+
+
+class Inotify:
+    """Minimal inotify(7) with ctypes. Linux only"""
+
+    def __init__(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            self._init = libc.inotify_init1
+            self._add = libc.inotify_add_watch
+            self._rm = libc.inotify_rm_watch
+        except (OSError, AttributeError) as EE:
+            raise Unsupported(f"inotify is not available: {EE}")
+        self._add.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self.fd = self._init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._add(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            self._raise(path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm(self.fd, wd)  # Errors mean it is already gone
+
+    def read(self, timeout=None):
+        """
+        List of (wd, mask, cookie, name) events. Waits up to 'timeout' seconds (None is
+        forever) for any
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, _READ_SIZE)
+        except BlockingIOError:
+            return []
+
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, size = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            name = data[pos : pos + size].rstrip(b"\0")
+            pos += size
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+    @staticmethod
+    def _raise(path=None):
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), path)
+
+
+class Watcher:
+    """
+    Tracks what changed under 'root' as paths relative to it. Call poll() to process
+    events and take() for the Scope of the changes since the last take().
+
+    If 'overflow' is set, some events were lost and only a full backup is safe.
+    Directories that could not be watched are in 'failed' until retry() watches them.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.inotify = Inotify()
+        self.wds = {}  # wd: directory relative to root
+
+        self.files = set()
+        self.trees = set()
+        self.parents = set()  # Directories of the changed files
+        self.overflow = False
+        self.failed = set()  # Not watched. Not reset by take()
+
+        self.watch_tree("")
+        logger.info(f"Watching {len(self.wds)} directories in {self.root!r}")
+
+    def watch_tree(self, rel, *, retry=False):
+        """Add watches to 'rel' and all of its directories"""
+        log = logger.debug if retry else logger.error
+        for dirpath, dirnames, _ in os.walk(os.path.join(self.root, rel)):
+            path = os.path.relpath(dirpath, self.root)
+            path = "" if path == "." else path
+            try:
+                wd = self.inotify.add_watch(dirpath)
+            except OSError as EE:
+                dirnames.clear()
+                if EE.errno in {errno.ENOENT, errno.ENOTDIR}:  # Already gone
+                    continue
+                if EE.errno == errno.ENOSPC:
+                    log("Out of inotify watches. Increase fs.inotify.max_user_watches")
+                else:
+                    log(f"Could not watch {dirpath!r}: {EE}")
+                self.failed.add(path)  # Changes there will be missed
+                continue
+            self.wds[wd] = path
+
+    def retry(self):
+        """
+        Try to watch the failed directories again. All of them, watched or not, are
+        relisted by the next take() since their changes were missed
+        """
+        failed, self.failed = self.failed, set()
+        self.trees.update(failed)
+        for rel in sorted(failed):
+            self.watch_tree(rel, retry=True)
+        if failed:
+            logger.debug(
+                f"Watched {len(failed) - len(self.failed)} of {len(failed)} "
+                "failed directories"
+            )
+
+    def poll(self, timeout=None):
+        """Process events. Waits up to 'timeout' for the first ones"""
+        for wd, mask, _, name in self.inotify.read(timeout):
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify event queue overflowed")
+                self.overflow = True
+                continue
+
+            if mask & IN_IGNORED:  # Watch removed
+                self.wds.pop(wd, None)
+                continue
+
+            if (parent := self.wds.get(wd)) is None:
+                continue
+
+            if not name:  # The watched directory itself
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF) and not parent:
+                    logger.warning(f"{self.root!r} was moved or deleted")
+                    self.overflow = True
+                continue  # Otherwise, there is also an event in its parent
+
+            path = os.path.join(parent, name)
+            if mask & IN_ISDIR:
+                if not mask & (IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE):
+                    continue  # Only the contents of directories are backed up
+                self.trees.add(path)
+                if mask & IN_MOVED_FROM:
+                    self._unwatch(path)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.watch_tree(path)
+            else:
+                self.files.add(path)
+                self.parents.add(parent)
+
+    def take(self):
+        """The Scope of the changes so far and reset"""
+        files = set(self.files)
+        # Links are backed up with the suffix when using '--links'
+        files.update(path + LINK_SUFFIX for path in self.files)
+
+        # Update the empty directory marker of the parents. Empty ones are relisted
+        trees = set(self.trees)
+        for parent in self.parents:
+            try:
+                empty = not os.listdir(os.path.join(self.root, parent))
+            except OSError:  # Removed. Will be in trees from its parent
+                continue
+            if empty:
+                trees.add(parent)
+            else:
+                files.add(os.path.join(parent, DFB_EMPTY))
+
+        self.files.clear()
+        self.trees.clear()
+        self.parents.clear()
+        self.overflow = False
+        return Scope(files, trees)
+
+    def close(self):
+        self.inotify.close()
+
+    def _unwatch(self, rel):
+        """Remove the watches of 'rel' and below. They are re-added if moved inside"""
+        for wd, path in list(self.wds.items()):
+            if path == rel or path.startswith(rel + "/"):
+                self.inotify.rm_watch(wd)
+                del self.wds[wd]
+
+
+class Watch:
+    """
+    Back up the changes of a local source as they happen. 'config' is used for the
+    first (full) backup and 'new_config()' must return a new, parsed Config for each
+    of the following ones.
+    """
+
+    def __init__(self, config, new_config, *, interval=60, full_every=86400):
+        self.config = config
+        self.new_config = new_config
+        self.interval = interval
+        self.full_every = full_every
+
+        self.scoped = True  # Set to False if changes can't be listed on their own
+        self.last_full = time.time()
+
+        features = config.rc.features(config.src)
+        root = features.get("Root", "")
+        if not (features.get("String", "").startswith("Local file") and root):
+            raise ValueError("'watch' is only for local sources")
+        if not os.path.isdir(root):
+            raise ValueError(f"Source {root!r} is not a directory")
+        self.root = root
+
+    def run(self, cycles=None):
+        """Start then back up changes forever or for 'cycles' intervals"""
+        self.start()
+        try:
+            while cycles is None or cycles > 0:
+                self.step()
+                if cycles is not None:
+                    cycles -= 1
+        finally:
+            self.watcher.close()
+
+    def start(self):
+        # Watch before listing so that no change is missed
+        self.watcher = Watcher(self.root)
+        self.watcher.overflow = False
+        return self._backup(self.config, full=True)
+
+    def step(self):
+        """
+        Wait the interval and back up the changes, if any. Returns the Backup object
+        or None if nothing was run
+        """
+        deadline = time.time() + self.interval
+        while (timeout := deadline - time.time()) > 0:
+            self.watcher.poll(timeout)
+        self.watcher.poll(0)
+
+        self.watcher.retry()
+
+        due = self.full_every and time.time() - self.last_full >= self.full_every
+        overflow = self.watcher.overflow or "" in self.watcher.failed  # Root unwatched
+        scope = self.watcher.take()
+        if not (scope or overflow or due):
+            logger.debug("No changes")
+            return
+
+        if overflow:
+            logger.info("Some changes may have been missed. Running a full backup")
+        elif due:
+            logger.info("Running the scheduled full backup")
+
+        full = overflow or due or not self.scoped
+        return self._backup(self.new_config(), scope=scope, full=full)
+
+    def _backup(self, config, scope=None, full=False):
+        try:
+            if not full:
+                try:
+                    back = Backup(config, scope=scope)
+                    back.run()
+                    return back
+                except Unsupported as EE:
+                    logger.warning(
+                        f"Cannot back up only the changes: {EE}. Using full backups"
+                    )
+                    self.scoped = False
+
+            back = Backup(config)
+            back.run()
+            self.last_full = time.time()
+            return back
+        except Exception as EE:
+            # Changes may not be backed up. Keep watching and make the next one full
+            logger.exception(f"Backup failed: {EE}")
+            self.watcher.overflow = True
+        finally:
+            config.rc.stop()
+            if config.cliconfig.temp_dir is None and not _keep_tmpdir():
+                shutil.rmtree(config.tmpdir, ignore_errors=True)
+
+
+def _keep_tmpdir():
+    from . import configuration
+
+    return bool(configuration._TEMPDIR)  # Testing
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+Benchmark the dstdb secondary indexes.
+
+Builds a synthetic items table (without indexes, like a pre-20261017 DB), prints the
+query plan and timing for the hot queries, applies the index migration, and repeats.
+
+    $ python bench_dstdb_indexes.py [N files] [versions per file]
+
+This is not part of the test suite.
+"""
+
+import os, sys
+import random
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+p = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+if p not in sys.path:
+    sys.path.insert(0, p)
+
+from dfb.dstdb import DFBDST, apath2rpath
+
+QUERIES = {
+    "rpath lookup (_update_references, prune-file, delete_rpath)": (
+        "SELECT * FROM items WHERE rpath = :rpath AND NOT isref",
+        None,
+    ),
+    "unresolved refs (_update_references)": (
+        "SELECT * FROM items WHERE isref = 2",
+        {},
+    ),
+    "snapshot --at (_snapshot_query_builder)": (
+        """
+        SELECT * FROM (
+            SELECT * FROM items WHERE timestamp <= :before
+            GROUP BY apath HAVING MAX(timestamp)
+        ) WHERE size >= 0""",
+        None,
+    ),
+    "timestamps (_timestamps_query)": (
+        """
+        SELECT
+            timestamp,
+            COUNT(timestamp) AS num_total,
+            SUM(CASE WHEN size < 0 THEN 1 ELSE 0 END) AS num_del,
+            SUM(CASE WHEN isref = 1 THEN 1 ELSE 0 END) AS num_mv,
+            SUM(CASE WHEN (size >= 0 AND (isref IS NULL OR isref = 0) )
+                     THEN size
+                     ELSE 0
+                     END) AS size
+        FROM items
+        WHERE timestamp >= :after
+        GROUP BY timestamp
+        ORDER BY timestamp""",
+        None,
+    ),
+    "group_by_apath": (
+        "SELECT * FROM items ORDER BY LOWER(apath),timestamp",
+        {},
+    ),
+}
+
+
+def build(dbpath, N, V):
+    db = sqlite3.connect(dbpath)
+    items = ",".join((" ".join(row)) for row in DFBDST.COLS)
+    db.execute(f"CREATE TABLE items({items}, PRIMARY KEY (apath, timestamp))")
+
+    ts0 = 1_600_000_000
+    rows = []
+    for ii in range(N):
+        apath = f"dir{ii % 97}/sub{ii % 13}/File{ii}.txt"
+        for vv in range(V):
+            ts = ts0 + 86400 * vv + ii % 7
+            flag = random.choices(["", "D", "R"], [90, 5, 5])[0]
+            isref = 2 if flag == "R" else 0
+            rows.append(
+                (
+                    apath2rpath(apath, ts, flag=flag, verify=False),
+                    apath,
+                    ts,
+                    -1 if flag == "D" else random.randint(0, 10**6),
+                    ts - 100.0,
+                    None,
+                    isref,
+                    None,
+                    0,
+                    None,
+                )
+            )
+        if len(rows) > 100_000:
+            db.executemany(f"INSERT INTO items VALUES ({','.join('?'*10)})", rows)
+            rows.clear()
+    db.executemany(f"INSERT INTO items VALUES ({','.join('?'*10)})", rows)
+    db.commit()
+    return db, ts0
+
+
+def run(db, params):
+    for name, (query, qparams) in QUERIES.items():
+        qparams = params if qparams is None else qparams
+        plan = db.execute(f"EXPLAIN QUERY PLAN {query}", qparams).fetchall()
+        t0 = time.perf_counter()
+        n = sum(1 for _ in db.execute(query, qparams))
+        dt = time.perf_counter() - t0
+        print(f"  {name}: {n} rows in {dt:0.4f} s")
+        for row in plan:
+            print(f"      {row[-1]}")
+
+
+def main():
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    V = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    random.seed(1)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db, ts0 = build(Path(tmpdir) / "bench.db", N, V)
+        rpath = db.execute("SELECT rpath FROM items LIMIT 1 OFFSET ?", (N,)).fetchone()
+        params = {"rpath": rpath[0], "before": ts0 + 86400, "after": ts0 + 86400 * 3}
+
+        print(f"{N} files x {V} versions")
+        print("Before:")
+        run(db, params)
+
+        t0 = time.perf_counter()
+        DFBDST._migrate_indexes(db)
+        print(f"Index migration: {time.perf_counter() - t0:0.2f} s")
+
+        print("After:")
+        run(db, params)
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Benchmark LazyRow against the plain dicts from fullrow2dict.
+
+Builds a synthetic snapshot (one row per file, like the latest table), then for each
+row type reads every row, holds them all in memory (like Backup.dst_files), and
+accesses the columns that compare() uses. Reports rows/sec and retained bytes/row.
+
+    $ python bench_lazy_rows.py [N files]
+
+This is not part of the test suite.
+"""
+
+import os, sys
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+p = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+if p not in sys.path:
+    sys.path.insert(0, p)
+
+from dfb.dstdb import DFBDST, apath2rpath
+from dfb.utils import MyRow
+
+# Like a snapshot with checksums=True
+QUERY = "SELECT *, 'md5:' || rpath AS hashes FROM items"
+
+
+def build(dbpath, N):
+    db = sqlite3.connect(dbpath)
+    items = ",".join((" ".join(row)) for row in DFBDST.COLS)
+    db.execute(f"CREATE TABLE items({items}, dir_id INTEGER, PRIMARY KEY (apath))")
+
+    ts0 = 1_600_000_000
+    rows = []
+    for ii in range(N):
+        apath = f"dir{ii % 97}/sub{ii % 13}/File{ii}.txt"
+        ts = ts0 + ii % 7
+        rows.append(
+            (
+                apath2rpath(apath, ts, verify=False),
+                apath,
+                ts,
+                random.randint(0, 10**6),
+                ts - 100.0,
+                None,
+                0,
+                None,
+                0,
+                '{"Tier":"hot"}' if ii % 10 == 0 else None,
+                ii % 1261,
+            )
+        )
+        if len(rows) > 100_000:
+            db.executemany(f"INSERT INTO items VALUES ({','.join('?'*11)})", rows)
+            rows.clear()
+    db.executemany(f"INSERT INTO items VALUES ({','.join('?'*11)})", rows)
+    db.commit()
+    db.row_factory = MyRow
+    return db
+
+
+def run(db, name, conv):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    files = {file["apath"]: file for file in map(conv, db.execute(QUERY))}
+    dt_read = time.perf_counter() - t0
+    mem, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    t0 = time.perf_counter()
+    for file in files.values():
+        file["size"], file.get("mtime"), file["dstinfo"]
+    dt_access = time.perf_counter() - t0
+
+    N = len(files)
+    print(
+        f"  {name:>12}: read {N / dt_read:12,.0f} rows/s, "
+        f"access {N / dt_access:12,.0f} rows/s, "
+        f"{mem / N:6.0f} bytes/row"
+    )
+
+
+def main():
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    random.seed(1)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = build(Path(tmpdir) / "bench.db", N)
+        print(f"{N} rows")
+        run(db, "fullrow2dict", DFBDST.fullrow2dict)
+        run(db, "LazyRow", DFBDST.fullrow2lazy)
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Benchmark listing a local source with 'rclone lsjson' (through RcloneCLI.listremote,
+like Backup.iter_src, including the JSON and timestamp parsing) and with the native
+LocalScanner.
+
+Builds a synthetic tree of empty files in a temporary directory. Both are run with the
+same exclude filter and the results are checked to be the same. Run it twice to see
+the effect of a warm cache on the first.
+
+    $ python bench_local_scanner.py [N files] [threads]
+
+This is not part of the test suite.
+"""
+
+import os, sys
+import tempfile
+import time
+
+p = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+if p not in sys.path:
+    sys.path.insert(0, p)
+
+from dfb.localscan import LocalScanner
+from dfb.rclonecli import RcloneCLI
+
+FILTER_FLAGS = ["--exclude", "*.tmp", "--exclude", "dir3/sub7/"]
+
+
+def build(root, N):
+    for ii in range(N):
+        path = os.path.join(
+            root, f"dir{ii % 37}", f"sub{ii % 11}", f"File_{ii:08d}.txt"
+        )
+        if ii % 50 == 0:
+            path = path.replace(".txt", ".tmp")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb"):
+            pass
+
+
+def run(name, listing):
+    t0 = time.perf_counter()
+    files = {item["Path"]: item["Size"] for item in listing() if not item["IsDir"]}
+    dt = time.perf_counter() - t0
+    print(f"  {name:>14}: {dt:7.2f} s; {len(files) / dt:12,.0f} files/s")
+    return files, dt
+
+
+def main():
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    with tempfile.TemporaryDirectory() as root:
+        build(root, N)
+        print(f"{N} files")
+
+        rclone = RcloneCLI(root)
+        rc_files, rc_dt = run(
+            "rclone lsjson",
+            lambda: rclone.listremote(
+                filter_flags=FILTER_FLAGS, mimetype=False, epoch_time=True
+            ),
+        )
+        native_files, native_dt = run(
+            "LocalScanner",
+            lambda: LocalScanner(root, filter_flags=FILTER_FLAGS, threads=threads),
+        )
+        assert native_files == rc_files
+        print(f"  Speedup: {rc_dt / native_dt:0.1f}x")
+
+
+if __name__ == "__main__":
+    main()
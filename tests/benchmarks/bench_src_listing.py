@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Benchmark the memory of the source listing as a dict of dicts (before) and as the
+columnar SourceFiles (after).
+
+Files are generated like Backup.iter_src yields them, with a checksum on a fraction
+of them to exercise the side map.
+
+    $ python bench_src_listing.py [N files] [fraction with checksums]
+
+This is not part of the test suite.
+"""
+
+import os, sys
+import gc
+import random
+import time
+import tracemalloc
+
+p = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+if p not in sys.path:
+    sys.path.insert(0, p)
+
+from dfb.backup import SourceFiles
+
+
+def files(N, frac):
+    random.seed(1)
+    for ii in range(N):
+        file = {
+            "apath": f"dir{ii % 97}/sub{ii % 13}/deeper/File_{ii:08d}.txt",
+            "size": random.randint(0, 10**7),
+            "mtime": 1_600_000_000 + random.random() * 10**8,
+        }
+        if random.random() < frac:
+            file["checksum"] = {"md5": f"{random.getrandbits(128):032x}"}
+        yield file
+
+
+def run(name, build, N, frac):
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    src = build(files(N, frac))
+    dt = time.perf_counter() - t0
+    mem, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    t0 = time.perf_counter()
+    tot = sum(src[apath]["size"] for apath in src)
+    dt_read = time.perf_counter() - t0
+
+    print(
+        f"  {name:>14}: {mem / 2**20:9.1f} MiB ({mem / N:5.0f} bytes/file); "
+        f"build {dt:6.2f} s; read all {dt_read:6.2f} s"
+    )
+    del src
+    return mem
+
+
+def main():
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000_000
+    frac = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+
+    print(f"{N} files, {frac:0.0%} with checksums")
+    before = run(
+        "dict of dicts", lambda f: {file["apath"]: file for file in f}, N, frac
+    )
+    after = run("SourceFiles", SourceFiles, N, frac)
+    print(f"  Reduction: {1 - after / before:0.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 pytest --cov dfb --cov-report html \
     test_backup_restore.py \
+    test_dstdb.py \
     test_listing.py \
     test_prune.py \
     test_rclonecli.py \
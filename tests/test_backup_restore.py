@@ -8,6 +8,8 @@ import lzma as xz
 import re
 import subprocess
 import json
+import hashlib
+import sqlite3
 import itertools
 import shlex
 from textwrap import dedent
@@ -19,6 +21,7 @@ if p not in sys.path:
 from dfb.cli import cli
 from dfb.utils import smart_splitext
 from dfb.backup import NoCommonHashError
+from dfb.hashcache import HashCache
 
 # Local
 import testutils
@@ -1411,6 +1414,721 @@ def test_empty_dirs():
     } == set(testutils.tree("restore2/", hidden=True))
 
 
+def test_merge_compare(monkeypatch):
+    """compare_method = "merge" must make the same decisions as "memory" """
+    import dfb.backup
+
+    monkeypatch.setattr(dfb.backup, "MERGE_SORT_CHUNK", 2)  # Force it to spill
+
+    test = testutils.Tester(name="merge_compare")
+
+    test.config["metadata"] = False  # Issues with atime due to run time
+    test.config["renames"] = "mtime"
+    test.config["compare_method"] = "merge"
+    test.write_config()
+
+    def dump(name, *args, offset):
+        test.backup("--dump", name, *args, offset=offset)
+        with open(name) as fp:
+            return {testutils.dict2frozen(json.loads(l)) for l in fp}
+
+    # Names that sort differently by path parts, case, and unicode
+    names = ["a/b.txt", "a.b/c.txt", "a b.txt", "A/d.txt", "é.txt", "z/y/x.txt"]
+    for name in names:
+        test.write_pre(f"src/{name}", name)
+    test.write_pre("src/modify.txt", "modify")
+    test.write_pre("src/move.txt", "will move")
+    test.write_pre("src/delete.txt", "delete")
+
+    assert dump("m1.jsonl", offset=1) == dump(
+        "s1.jsonl", "-o", "compare_method = 'memory'", offset=1
+    )
+    test.backup(offset=1)
+
+    test.write_post("src/modify.txt", "modify.")
+    test.write_post("src/a.b/new.txt", "new")
+    shutil.move("src/move.txt", "src/a/moved.txt")
+    os.unlink("src/delete.txt")
+
+    assert dump("m3.jsonl", offset=3) == dump(
+        "s3.jsonl", "-o", "compare_method = 'memory'", offset=3
+    )
+    for args in [[], ["--refresh"]]:
+        back = test.backup("--dry-run", *args, offset=3)
+        assert sorted(back.new) == ["a.b/new.txt"]
+        assert back.modified == ["modify.txt"]
+        assert back.deleted == ["delete.txt", "move.txt"]
+        assert [(d["apath"], s["apath"]) for d, s in back.moves] == [
+            ("move.txt", "a/moved.txt")
+        ]
+        # Only the changes are held
+        assert set(back.src_files) == {"a.b/new.txt", "modify.txt", "a/moved.txt"}
+        assert set(back.dst_files) == {"delete.txt", "move.txt"}
+
+    test.backup(offset=3)
+    back = test.backup(offset=5)
+    assert back.new + back.modified + back.deleted == []
+
+    test.call("restore", "restore")
+    assert test.local_files("restore") == test.local_files()
+
+
+@pytest.mark.parametrize("compare_method", ["memory", "merge"])
+def test_pipeline(compare_method):
+    """The pipelined backup must do the same as the staged one (and its --dump)"""
+    test = testutils.Tester(name="pipeline")
+
+    test.config["metadata"] = False  # Issues with atime due to run time
+    test.config["renames"] = "mtime"
+    test.config["pipeline"] = True
+    test.config["compare_method"] = compare_method
+    test.write_config()
+
+    def comp(t):
+        with open(f"t{t}.jsonl") as fp:
+            dump = {testutils.dict2frozen(json.loads(l)) for l in fp}
+        with gz.open(f"dst/.dfb/snapshots/1970/01/197001010000{t:02d}Z.jsonl.gz") as fp:
+            snap = {testutils.dict2frozen(json.loads(l)) for l in fp}
+        return dump == snap
+
+    test.write_pre("src/modify.txt", "modify")
+    test.write_pre("src/move.txt", "will move")
+    test.write_pre("src/sub/move_copy.txt", "will move by copy")
+    test.write_pre("src/delete.txt", "delete")
+
+    test.backup("--dump", "t1.jsonl", offset=1)
+    test.backup(offset=1)
+    assert comp(1)
+
+    test.write_post("src/modify.txt", "modify.")
+    test.write_post("src/new.txt", "new file")
+    test.write_post("src/sub/same_size.txt", "delete")  # Waits for track_moves
+    shutil.move("src/move.txt", "src/moved.txt")
+    os.unlink("src/delete.txt")
+
+    test.backup("--dump", "t3.jsonl", offset=3)
+    back = test.backup(offset=3)
+    assert comp(3)
+    assert sorted(back.new) == ["new.txt", "sub/same_size.txt"]
+    assert back.modified == ["modify.txt"]
+    assert sorted(back.deleted) == ["delete.txt", "move.txt"]
+    assert [(d["apath"], s["apath"]) for d, s in back.moves] == [
+        ("move.txt", "moved.txt")
+    ]
+    assert os.path.exists("dst/moved.19700101000003R.txt")
+
+    shutil.move("src/sub/move_copy.txt", "src/moved_copy.txt")
+    test.backup("--dump", "t5.jsonl", "-o", "rename_method = 'copy'", offset=5)
+    test.backup("-o", "rename_method = 'copy'", offset=5)
+    assert comp(5)
+
+    back = test.backup(offset=7)
+    assert back.new + back.modified + back.deleted == []
+
+    test.call("restore", "restore")
+    assert test.local_files("restore") == test.local_files()
+
+
+@pytest.mark.parametrize("compare", ["size", "mtime"])
+def test_vectorized_compare(compare, monkeypatch):
+    """The numpy compare must match the per-file one"""
+    import dfb.backup
+
+    np = pytest.importorskip("numpy")
+
+    test = testutils.Tester(name="vectorized_compare")
+    test.config["compare"] = compare
+    test.config["empty_directory_markers"] = True
+    test.write_config()
+
+    test.write_pre("src/same.txt", "same")
+    test.write_pre("src/size.txt", "size")
+    test.write_pre("src/sub/mtime.txt", "mtime")
+    test.write_pre("src/delete.txt", "delete")
+    test.write_pre("src/refreshed.txt", "refreshed")
+    os.makedirs("src/empty")
+    test.backup(offset=1)
+
+    test.write_post("src/size.txt", "size!")
+    test.write_post("src/sub/mtime.txt", "mtimE", add_dt=10)
+    test.write_post("src/new.txt", "new")
+    os.unlink("src/delete.txt")
+
+    def run(*args):
+        back = test.backup("--dry-run", *args, offset=3)
+        return (
+            sorted(back.new),
+            sorted(back.modified),
+            sorted(back.deleted),
+            sorted(f["apath"] for f in back.update_dstdb),
+        )
+
+    for args in [[], ["--refresh", "--no-refresh-use-snapshots"]]:
+        vectorized = run(*args)
+        with monkeypatch.context() as m:
+            m.setattr(dfb.backup, "np", None)
+            assert run(*args) == vectorized
+
+        new, modified, deleted, updated = vectorized
+        assert new == ["new.txt"]
+        if compare == "mtime":
+            assert modified == ["size.txt", "sub/mtime.txt"]
+        else:
+            assert modified == ["size.txt"]
+        assert deleted == ["delete.txt"]
+        assert bool(updated) == bool(args)  # dstinfo after a refresh
+
+
+def test_hash_cache():
+    """Cached hashes must match rclone's and be refreshed when a file changes"""
+    test = testutils.Tester(name="hash_cache")
+    test.config["metadata"] = False
+    test.config["compare"] = "hash"
+    test.config["hash_type"] = ["md5", "sha1"]
+    test.config["hash_cache"] = True
+    test.write_config()
+
+    test.write_pre("src/same_size.txt", "versions 1")
+    test.write_pre("src/sub/file.txt", "file")
+    test.write_pre("src/sub/other.txt", "other")
+
+    def checksums(*args):
+        test.backup("--dump", "dump.jsonl", *args, offset=9)
+        with open("dump.jsonl") as fp:
+            return {f["apath"]: f["checksum"] for f in map(json.loads, fp)}
+
+    assert checksums() == checksums("-o", "hash_cache = False")
+    assert "Source hashes: 0 cached, 3 hashed" in test.logs[-2][0]
+
+    test.backup(offset=1)
+    assert "Source hashes: 3 cached, 0 hashed" in test.logs[-1][0]
+
+    test.write_post("src/same_size.txt", "versions 2")  # Same size!
+    os.unlink("src/sub/other.txt")
+    back = test.backup(offset=3)
+    assert "Source hashes: 1 cached, 1 hashed" in test.logs[-1][0]
+    assert back.modified == ["same_size.txt"]
+    assert back.deleted == ["sub/other.txt"]
+
+    test.write_post("src/sub/other.txt", "other")
+    test.backup(offset=5)
+    assert "Source hashes: 2 cached, 1 hashed" in test.logs[-1][0]  # Was pruned
+
+    test.call("restore", "restore")
+    assert test.local_files("restore") == test.local_files()
+
+    # Stopped early: what was hashed is kept and nothing is pruned
+    test.write_post("src/sub/file.txt", "changed")
+    cache = HashCache(test.config_obj, os.path.abspath("src"), ["md5", "sha1"])
+    fill = cache.fill([{"apath": "sub/file.txt"}])
+    assert next(fill)["checksum"]["md5"] == hashlib.md5(b"changed").hexdigest()
+    fill.close()
+
+    db = sqlite3.connect(cache.path)
+    rows = dict(db.execute("SELECT path, hashes FROM hashes"))
+    db.close()
+    assert set(rows) == {"same_size.txt", "sub/file.txt", "sub/other.txt"}
+    assert (
+        json.loads(rows["sub/file.txt"])["md5"] == hashlib.md5(b"changed").hexdigest()
+    )
+
+
+def test_local_scanner():
+    """Listing with the local scanner must back up the same as with rclone"""
+    test = testutils.Tester(name="local_scanner")
+    test.config["metadata"] = False
+    test.config["local_scanner"] = True
+    test.config["filter_flags"] = ["--exclude", "*.tmp", "--exclude", "skip/"]
+    test.config["empty_directory_markers"] = True
+    test.write_config()
+
+    test.write_pre("src/file.txt", "file")
+    test.write_pre("src/sub/deep/file.txt", "deep file")
+    test.write_pre("src/sub/excluded.tmp", "excluded")
+    test.write_pre("src/skip/file.txt", "skipped")
+    os.makedirs("src/empty/empty")
+
+    def dump(*args):
+        test.backup("--dump", "dump.jsonl", *args, offset=9)
+        with open("dump.jsonl") as fp:
+            return {testutils.dict2frozen(json.loads(l)) for l in fp}
+
+    assert dump() == dump("-o", "local_scanner = False")
+    assert "Cannot use 'local_scanner'" not in test.logs[-2][0]
+
+    test.backup(offset=1)
+    test.write_post("src/file.txt", "modified")
+    shutil.move("src/sub/deep/file.txt", "src/sub/deep/moved.txt")
+    back = test.backup(offset=3)
+    assert back.modified == ["file.txt"]
+    assert [(d["apath"], s["apath"]) for d, s in back.moves] == [
+        ("sub/deep/file.txt", "sub/deep/moved.txt")
+    ]
+
+    # Falls back
+    test.backup("-o", "metadata = True", offset=5)
+    assert "Cannot use 'local_scanner': 'metadata' is set" in test.logs[-1][0]
+
+    test.call("restore", "restore")
+    files = test.local_files("restore")
+    assert "skip/file.txt" not in files and "sub/excluded.tmp" not in files
+    assert os.path.isdir("restore/empty/empty")
+
+
+def test_partitioned_listing():
+    """Backups and refreshes with partitioned listings must match the plain ones"""
+    test = testutils.Tester(name="partitioned_listing")
+    test.config["metadata"] = False
+    test.config["filter_flags"] = ["--exclude", "*.tmp", "--exclude", "/skip/"]
+    test.config["list_partitions"] = 3
+    test.write_config()
+
+    for path in ["file.txt", "sub/a.txt", "sub/deep/b.txt", "other/c.txt", "d/e/f.txt"]:
+        test.write_pre(f"src/{path}", path)
+    test.write_pre("src/sub/excluded.tmp", "excluded")
+    test.write_pre("src/skip/file.txt", "skipped")
+
+    def dump(*args):
+        test.backup("--dump", "dump.jsonl", *args, offset=9)
+        with open("dump.jsonl") as fp:
+            return {testutils.dict2frozen(json.loads(l)) for l in fp}
+
+    plain = dump("-o", "list_partitions = 1")
+    assert dump() == plain
+    assert dump("-o", "list_partition_depth = 2") == plain
+
+    test.backup(offset=1)
+    test.write_post("src/sub/deep/b.txt", "modified")
+    back = test.backup(offset=3)
+    assert back.modified == ["sub/deep/b.txt"]
+
+    # Refresh from the listing of the destination
+    tree = test.tree("--at", "u4")
+    test.backup("--refresh", "--no-refresh-use-snapshots", offset=5)
+    assert test.tree("--at", "u4") == tree
+
+    test.call("restore", "restore")
+    files = test.local_files("restore")
+    assert "skip/file.txt" not in files and "sub/excluded.tmp" not in files
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify")
+def test_watch():
+    """Watching must back up only the changes and leave nothing for a full backup"""
+    import dfb
+    from dfb.watch import Watch
+
+    test = testutils.Tester(name="watch")
+    test.config["metadata"] = False
+    test.config["filter_flags"] = ["--exclude", "*.tmp"]
+    test.config["empty_directory_markers"] = True
+    test.write_config()
+
+    for path in ["file.txt", "sub/a.txt", "sub/deep/b.txt", "gone/c.txt", "d/e.txt"]:
+        test.write_pre(f"src/{path}", path)
+
+    new_config = testutils.watch_configs(test.configfile)
+
+    dfb._override_offset = 1
+    watch = Watch(new_config(), new_config, interval=0.2)
+    watch.start()
+
+    test.write_post("src/file.txt", "modified")
+    shutil.move("src/sub/deep/b.txt", "src/sub/deep/moved.txt")
+    shutil.rmtree("src/gone")
+    os.remove("src/d/e.txt")  # Leaves an empty directory
+    test.write_post("src/new/deep/x.txt", "new")
+    test.write_post("src/excluded.tmp", "excluded")
+
+    dfb._override_offset = 3
+    back = watch.step()
+    assert back.scope
+    assert back.modified == ["file.txt"]
+    assert sorted(back.new) == ["d/.dfbempty", "new/deep/x.txt"]
+    assert sorted(back.deleted) == ["d/e.txt", "gone/c.txt", "sub/deep/b.txt"]
+    assert [(d["apath"], s["apath"]) for d, s in back.moves] == [
+        ("sub/deep/b.txt", "sub/deep/moved.txt")
+    ]
+
+    dfb._override_offset = 5
+    assert watch.step() is None  # No changes
+    watch.watcher.close()
+
+    # A full backup finds nothing else
+    back = test.backup("--dry-run", offset=7)
+    assert not (back.new or back.modified or back.deleted or back.moves)
+
+    test.call("restore", "restore")
+    files = {dict(f)["apath"] for f in test.local_files("restore")}
+    assert files == {"file.txt", "sub/a.txt", "sub/deep/moved.txt", "new/deep/x.txt"}
+    assert os.path.isdir("restore/d")
+
+
+@pytest.mark.parametrize("lister", ["native", "rclone"])
+def test_changed_from(lister):
+    """Backing up a list of changed paths only acts on those"""
+    test = testutils.Tester(name="changed_from")
+    test.config["metadata"] = False
+    test.config["filter_flags"] = ["--exclude", "*.tmp"]
+    if lister == "rclone":  # Hashes computed by rclone can't be listed natively
+        test.config["get_hashes"] = True
+    test.write_config()
+
+    for path in ["file.txt", "keep.txt", "sub/a.txt", "sub/b.txt", "dir/x.txt"]:
+        test.write_pre(f"src/{path}", path)
+    test.write_pre("src/dir/deep/y.txt", "y")
+    test.backup(offset=1)
+
+    test.write_post("src/file.txt", "modified")
+    test.write_post("src/keep.txt", "modified but not listed")
+    os.remove("src/sub/b.txt")
+    test.write_post("src/sub/new.tmp", "excluded")
+    shutil.rmtree("src/dir")
+    test.write_post("src/dir/z.txt", "z")
+
+    changed = [
+        os.path.abspath("src/file.txt"),
+        "sub/b.txt",
+        "sub/new.tmp",
+        "./dir/",
+        "missing.txt",
+    ]
+    with open("changed.txt", "wb") as fp:
+        fp.write(b"\0".join(os.fsencode(path) for path in changed))
+
+    back = test.backup("--changed-from", "changed.txt", offset=3)
+    assert back.modified == ["file.txt"]
+    assert back.new == ["dir/z.txt"]
+    assert sorted(back.deleted) == ["dir/deep/y.txt", "dir/x.txt", "sub/b.txt"]
+    assert ("Listing the scope with rclone" in test.logs[-1][1]) == (lister == "rclone")
+
+    # The rest was left alone
+    back = test.backup("--dry-run", offset=5)
+    assert back.modified == ["keep.txt"]
+    assert not (back.new or back.deleted)
+
+
+@pytest.mark.parametrize("pipeline", [False, True])
+def test_transfer_lanes(pipeline, monkeypatch):
+    """Large and small files are transferred in separate lanes"""
+    test = testutils.Tester(name="transfer_lanes")
+    test.config["metadata"] = False
+    test.config["pipeline"] = pipeline
+    test.config["large_file_size"] = "100 KiB"
+    test.config["large_file_rclone_config"] = {
+        "MultiThreadStreams": 4,
+        "MultiThreadChunkSize": 64 * 1024,
+    }
+    test.write_config()
+
+    for ii in range(3):
+        test.write_pre(f"src/large{ii}.bin", os.urandom((ii + 2) * 100_000), mode="wb")
+    for ii in range(20):
+        test.write_pre(f"src/small/{ii}.txt", f"small {ii}")
+
+    test.backup(offset=1)
+    assert not test.src_missing_in_dst()
+    log, debug = test.logs[-1]
+    assert "Tail after the last one started" in log
+
+    # Only the large files get the multi-thread settings
+    copies = [
+        l
+        for l in debug.split("\n")
+        if 'copyfile": with parameters' in l and f"srcFs:{test.src} " in l
+    ]
+    assert len(copies) == 23
+    large = {l for l in copies if "MultiThreadStreams" in l}
+    assert len(large) == 3 and all("large" in l for l in large)
+
+    # If recording the small files fails, the large lane is stopped and joined
+    import threading
+    from dfb.dstdb import DFBDST
+
+    insert = DFBDST.insert
+
+    def failing(self, file, **kwargs):
+        if file["apath"].startswith("small/"):
+            raise ValueError("Failed record")
+        return insert(self, file, **kwargs)
+
+    monkeypatch.setattr(DFBDST, "insert", failing)
+    for ii in range(3):
+        test.write_post(f"src/large{ii}.bin", os.urandom(200_000), mode="wb")
+    for ii in range(20):
+        test.write_post(f"src/small/{ii}.txt", f"modified {ii}")
+
+    assert test.backup(offset=3, allow_error=True) is None
+    assert all(t.daemon for t in threading.enumerate() if t.name != "MainThread")
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_batched_uploads(fail, monkeypatch):
+    """Small files are uploaded in batches and anything missed one at a time"""
+    from dfb.rclonerc import RC, RcloneError
+
+    test = testutils.Tester(name="batched_uploads")
+    test.config["metadata"] = False
+    test.config["batch_max_size"] = "1 KiB"
+    test.config["batch_files"] = 5
+    test.write_config()
+
+    for ii in range(12):
+        test.write_pre(f"src/sub/s{ii}.txt", f"small {ii}")
+    test.write_pre("src/noext", "no extension")
+    # Not batched
+    test.write_pre("src/multi.dot.txt", "more than one dot")
+    test.write_pre("src/.hidden", "hidden")
+    test.write_pre("src/large.bin", os.urandom(2000), mode="wb")
+
+    if fail:  # The whole job fails. Each file is then tried on its own
+        call0 = RC.call
+
+        def call(self, endpoint, **kwargs):
+            if endpoint == "sync/copy":
+                raise RcloneError("Failed batch")
+            return call0(self, endpoint, **kwargs)
+
+        monkeypatch.setattr(RC, "call", call)
+
+    back = test.backup(offset=1)
+    assert back.errcount == 0
+    assert not test.src_missing_in_dst()
+    log, debug = test.logs[-1]
+    assert log.count("Uploading a batch of 5 files") == 2
+    assert log.count("Uploading a batch of 3 files") == 1
+
+    copies = [
+        l
+        for l in debug.split("\n")
+        if 'copyfile": with parameters' in l and f"srcFs:{test.src} " in l
+    ]
+    assert len(copies) == (16 if fail else 3)
+    assert ("one at a time" in log) == fail
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_bulk_writes(fail, monkeypatch):
+    """Delete markers and references are written together per directory"""
+    from dfb.rclonerc import RC
+
+    test = testutils.Tester(name="bulk_writes")
+    test.config["renames"] = "mtime"
+    test.config["write_batch_files"] = 4
+    test.write_config()
+
+    for ii in range(7):
+        test.write_pre(f"src/sub/d{ii}.txt", f"delete {ii}")
+    test.write_pre("src/sub/50%.txt", "can't be in a multi-file upload")
+    for ii in range(3):
+        test.write_pre(f"src/sub/m{ii}.txt", "move" * (ii + 5))
+    test.backup(offset=1)
+
+    for ii in range(7):
+        os.unlink(f"src/sub/d{ii}.txt")
+    os.unlink("src/sub/50%.txt")
+    for ii in range(3):
+        test.move(f"src/sub/m{ii}.txt", f"src/sub2/m{ii}.txt")
+
+    if fail:
+
+        def write_many(self, dst_dir, contents, **params):
+            raise ValueError("Failed upload")
+
+        monkeypatch.setattr(RC, "write_many", write_many)
+
+    back = test.backup(offset=2)
+    assert back.errcount == 0
+    assert len(back.deleted) == 11 and len(back.moves) == 3  # Moves also delete
+    assert not test.src_missing_in_dst()
+
+    markers = {p.name for p in Path("dst/sub").iterdir() if "D" in p.name}
+    assert len(markers) == 11
+    assert all(Path("dst/sub", name).read_bytes() == b"DEL" for name in markers)
+    refs = {p.name for p in Path("dst/sub2").iterdir()}
+    assert len(refs) == 3 and all("R" in name for name in refs)
+
+    log, debug = test.logs[-1]
+    calls = [
+        l
+        for l in debug.split("\n")
+        if 'uploadfile": with parameters' in l and f"fs:{test.dst} " in l
+    ]
+    assert sum(l.endswith(" remote:sub]") for l in calls) == (11 if fail else 4)
+    assert sum(l.endswith(" remote:sub2]") for l in calls) == (3 if fail else 1)
+    assert ("one at a time" in debug) == fail
+
+
+def test_adaptive_concurrency():
+    """Runs with the worker count adjusted from rclone's stats"""
+    test = testutils.Tester(name="adaptive_concurrency")
+    test.config["concurrency"] = 2
+    test.config["adaptive_concurrency"] = True
+    test.config["adaptive_concurrency_interval"] = 0.05
+    test.write_config()
+
+    for ii in range(40):
+        test.write_pre(f"src/sub{ii % 4}/file{ii}.txt", f"file {ii}" * 1000)
+    back = test.backup(offset=1)
+    assert back.errcount == 0
+    assert not test.src_missing_in_dst()
+
+    log, debug = test.logs[-1]
+    assert "Adaptive concurrency of transfers: 2 in [1, 8]" in debug
+    assert "Final concurrency of transfers" in debug
+
+    test.call("restore", "res")
+    assert test.local_files("res") == test.local_files("src")
+
+
+def test_resume(monkeypatch):
+    """An interrupted backup is continued from its saved plan"""
+    from dfb.rclonerc import RC, RcloneError
+
+    test = testutils.Tester(name="resume")
+    test.config["renames"] = "mtime"
+    test.config["resume_journal"] = True
+    test.write_config()
+    plan = test.config_obj.dbcache_dir / "test_resume.plan.db"
+
+    test.write_pre("src/keep.txt", "keep")
+    test.write_pre("src/delete.txt", "delete me")
+    test.write_pre("src/move.txt", "move me somewhere")
+    test.backup(offset=1)
+    assert not plan.exists()  # Removed when done
+
+    test.write_pre("src/new.txt", "new")
+    for name in ["fail1", "fail2", "fail3"]:
+        test.write_pre(f"src/{name}.txt", name)
+    os.unlink("src/delete.txt")
+    test.move("src/move.txt", "src/moved.txt")
+
+    copyfile0 = RC.copyfile
+
+    def copyfile(self, **kwargs):
+        if "fail" in str(kwargs["src"]):
+            raise RcloneError("Failed upload")
+        return copyfile0(self, **kwargs)
+
+    monkeypatch.setattr(RC, "copyfile", copyfile)
+    back = test.backup(offset=2)
+    assert back.errcount == 3
+    assert plan.exists()
+    monkeypatch.undo()
+
+    # Changed and removed since the plan
+    test.write_post("src/fail2.txt", "fail2 changed")
+    os.unlink("src/fail3.txt")
+
+    back = test.backup("--resume", offset=3)
+    assert back.errcount == 0
+    assert sorted(back.new) == ["fail1.txt", "fail2.txt"]
+    assert not back.deleted and not back.moves
+    assert not plan.exists()
+    assert not test.src_missing_in_dst()
+
+    log, debug = test.logs[-1]
+    assert "Resuming the backup planned at 19700101000002" in log
+    assert "1 changed and 1 gone since planning" in log
+    copies = [
+        l
+        for l in debug.split("\n")
+        if 'copyfile": with parameters' in l and f"srcFs:{test.src} " in l
+    ]
+    assert len(copies) == 2
+    # Uploaded at the planned time and not the resumed one
+    assert test.read("dst/fail2.19700101000002.txt") == "fail2 changed"
+    assert not any(p.name.startswith("fail3") for p in Path("dst").iterdir())
+    assert os.path.exists("dst/.dfb/logs/19700101000003Z.log")
+
+    # The snapshot is named for the planned time too without replacing the first
+    snaps = sorted(p.name for p in Path("dst/.dfb/snapshots/1970/01").iterdir())
+    assert snaps == [
+        "19700101000001Z.jsonl.gz",
+        "19700101000002Z.jsonl.gz",
+        "19700101000002Z.resumed19700101000003Z.jsonl.gz",
+    ]
+    with gz.open(f"dst/.dfb/snapshots/1970/01/{snaps[-1]}", "rt") as fp:
+        rows = [json.loads(line) for line in fp]
+    assert sorted((r["apath"], r["timestamp"]) for r in rows) == [
+        ("fail1.txt", 2),
+        ("fail2.txt", 2),
+    ]
+
+    # Nothing left
+    assert test.backup("--resume", offset=4, allow_error=True) is None
+    assert "No backup plan to resume" in test.logs[-1][0]
+    args = ("--resume", "-o", "resume_journal = False")
+    assert test.backup(*args, offset=4, allow_error=True) is None
+    assert "Plans need 'resume_journal'" in test.logs[-1][0]
+
+    # Pipelined backups are not journaled
+    test.write_pre("src/piped.txt", "piped")
+    test.backup("-o", "pipeline = True", offset=5)
+    assert "'resume_journal' is not used with 'pipeline'" in test.logs[-1][0]
+    assert not plan.exists()
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify")
+def test_watch_failed(monkeypatch):
+    """Directories that could not be watched are relisted until they are watched"""
+    import errno
+    import dfb
+    from dfb.watch import Watch, Inotify
+
+    test = testutils.Tester(name="watch_failed")
+    test.config["metadata"] = False
+    test.write_config()
+
+    for path in ["file.txt", "sub/a.txt", "sub/deep/b.txt"]:
+        test.write_pre(f"src/{path}", path)
+
+    new_config = testutils.watch_configs(test.configfile)
+
+    full = True
+    add_watch = Inotify.add_watch
+
+    def failing(self, path, *args, **kwargs):
+        if full and path.endswith("/sub"):
+            raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC), path)
+        return add_watch(self, path, *args, **kwargs)
+
+    monkeypatch.setattr(Inotify, "add_watch", failing)
+
+    dfb._override_offset = 1
+    watch = Watch(new_config(), new_config, interval=0.2)
+    watch.start()
+    assert watch.watcher.failed == {"sub"}
+
+    # Not watched but still found. Stays failed
+    test.write_post("src/sub/deep/new.txt", "new")
+    dfb._override_offset = 3
+    back = watch.step()
+    assert back.scope
+    assert back.new == ["sub/deep/new.txt"]
+    assert watch.watcher.failed == {"sub"}
+
+    # Watched now. Relisted one more time for what changed in between
+    full = False
+    test.write_post("src/sub/a.txt", "modified")
+    dfb._override_offset = 5
+    back = watch.step()
+    assert back.modified == ["sub/a.txt"]
+    assert not watch.watcher.failed
+
+    test.write_post("src/sub/deep/b.txt", "modified")
+    dfb._override_offset = 7
+    back = watch.step()
+    assert back.modified == ["sub/deep/b.txt"]
+
+    dfb._override_offset = 9
+    assert watch.step() is None  # No changes
+    watch.watcher.close()
+
+    back = test.backup("--dry-run", offset=11)
+    assert not (back.new or back.modified or back.deleted or back.moves)
+
+
 if __name__ == "__main__":
     test_main("reference")
     #     test_main("copy")
@@ -1438,6 +2156,20 @@ if __name__ == "__main__":
     #     test_min_size()
     #     test_push_snapshots()
     #     test_empty_dirs()
+    #     test_merge_compare(pytest.MonkeyPatch())
+    #     test_pipeline("memory")
+    #     test_vectorized_compare("mtime", pytest.MonkeyPatch())
+    #     test_hash_cache()
+    #     test_local_scanner()
+    #     test_partitioned_listing()
+    #     test_watch()
+    #     test_watch_failed(pytest.MonkeyPatch())
+    #     test_changed_from("native")
+    #     test_transfer_lanes(False, pytest.MonkeyPatch())
+    #     test_batched_uploads(False, pytest.MonkeyPatch())
+    #     test_bulk_writes(False, pytest.MonkeyPatch())
+    #     test_adaptive_concurrency()
+    #     test_resume(pytest.MonkeyPatch())
     print("=" * 50)
     print(" All Passed ".center(50, "="))
     print("=" * 50)
@@ -0,0 +1,648 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of the destination database itself (schema, migrations, and bookkeeping)
+"""
+
+import os, sys
+import json
+
+p = os.path.abspath("../")
+if p not in sys.path:
+    sys.path.insert(0, p)
+
+import dfb
+import dfb.rclonerc
+from dfb.dstdb import DFBDST, LazyRow
+
+# Local
+import testutils
+
+# testing
+import pytest
+
+
+def _indexes(db):
+    return {
+        r["name"]
+        for r in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        if not r["name"].startswith("sqlite_autoindex")
+    }
+
+
+def test_migrate(monkeypatch):
+    test = testutils.Tester(name="migrate")
+    test.write_config()
+
+    test.write_pre("src/file1.txt", "file1")
+    test.write_pre("src/sub/file2.txt", "file2")
+    test.backup(offset=1)
+
+    # New DBs are created with the indexes and the current version
+    db = test.dstdb.db()
+    assert {"items_rpath", "items_timestamp", "items_lower_apath"} <= _indexes(db)
+    ver = db.execute("SELECT val FROM kv WHERE key = 'version'").fetchone()["val"]
+    assert ver == dfb.__version__
+
+    # Make it look like an older DB
+    with db:
+        for name in _indexes(db):
+            db.execute(f"DROP INDEX {name}")
+        db.execute("UPDATE kv SET val = '20241121.0' WHERE key = 'version'")
+    assert not _indexes(db)
+    db.close()
+
+    # latest is rebuilt once for all of the migrations
+    rebuilds = []
+    rebuild0 = DFBDST._rebuild_latest
+
+    def _rebuild_latest(db, table="latest"):
+        rebuilds.append(table)
+        return rebuild0(db, table=table)
+
+    monkeypatch.setattr(DFBDST, "_rebuild_latest", staticmethod(_rebuild_latest))
+    dstdb = DFBDST(test.config_obj)  # Migrates on init
+    assert rebuilds == ["latest"]
+    monkeypatch.undo()
+    db = dstdb.db()
+    assert {"items_rpath", "items_timestamp", "items_lower_apath"} <= _indexes(db)
+    ver = db.execute("SELECT val FROM kv WHERE key = 'version'").fetchone()["val"]
+    assert ver == dfb.__version__
+
+    # And the data is untouched
+    assert {r["apath"] for r in dstdb.snapshot()} == {"file1.txt", "sub/file2.txt"}
+
+    plan = db.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM items WHERE rpath = ?", ("file1.txt",)
+    ).fetchall()
+    assert "items_rpath" in plan[0]["detail"]
+    db.close()
+
+
+def test_latest():
+    test = testutils.Tester(name="latest")
+    test.write_config()
+
+    def _items_snap():
+        """Snapshot directly from items. The old way"""
+        res = test.dstdb.db().execute(
+            "SELECT * FROM items GROUP BY apath HAVING MAX(timestamp)"
+        )
+        return {row["apath"]: row["rpath"] for row in res}
+
+    def _latest():
+        res = test.dstdb.db().execute("SELECT * FROM latest")
+        return {row["apath"]: row["rpath"] for row in res}
+
+    test.write_pre("src/file1.txt", "file1")
+    test.write_pre("src/file2.txt", "file2")
+    test.write_pre("src/sub/file3.txt", "file3")
+    test.backup(offset=1)
+    assert _latest() == _items_snap()
+
+    test.write_post("src/file1.txt", "file1..")  # modify
+    os.unlink("src/file2.txt")  # delete
+    test.move("src/sub/file3.txt", "src/sub/moved3.txt")  # move
+    test.backup(offset=3)
+    assert _latest() == _items_snap()
+    assert _latest()["file2.txt"] == "file2.19700101000003D.txt"
+
+    # The queries themselves
+    query, _ = test.dstdb._snapshot_query_builder()
+    assert "FROM latest" in query
+    query, _ = test.dstdb._snapshot_query_builder(before="u2")
+    assert "FROM latest" not in query
+
+    # Versions should still be counted
+    subdirs, files = test.dstdb.ls()
+    files = {file["apath"]: file["versions"] for file in files}
+    assert files == {"file1.txt": 2}
+
+    # Should also be correct after a refresh
+    test.call("refresh")
+    assert _latest() == _items_snap()
+
+    # Break it, check it, fix it
+    db = test.dstdb.db()
+    with db:
+        db.execute("DELETE FROM latest WHERE apath = 'file1.txt'")
+        db.execute("UPDATE latest SET size = 100 WHERE apath = 'sub/moved3.txt'")
+    db.close()
+
+    bad = test.call("advanced", "dbcheck", "--no-fix")
+    assert bad == ["file1.txt", "sub/moved3.txt"]
+    assert _latest() != _items_snap()
+
+    bad = test.call("advanced", "dbcheck")
+    assert bad == ["file1.txt", "sub/moved3.txt"]
+    assert _latest() == _items_snap()
+
+    assert test.call("advanced", "dbcheck") == []
+
+
+def test_group_commit():
+    test = testutils.Tester(name="group_commit")
+    test.write_config()
+
+    test.write_pre("src/file1.txt", "file1")
+    test.backup(offset=1)
+
+    db = test.dstdb.db()
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    db.close()
+
+    dstdb = DFBDST(test.config_obj)
+    files = [
+        {"apath": f"new{ii}.txt", "rpath": f"new{ii}.19700101000002.txt"}
+        | {"timestamp": 2, "size": ii, "mtime": 2.0}
+        for ii in range(25)
+    ]
+
+    with dstdb.group_commit(max_rows=10, max_latency=60) as writer:
+        for file in files[:5]:
+            dstdb.insert(file)
+        dstdb.insert_many(files[5:])
+        with pytest.raises(ValueError):
+            with dstdb.group_commit():
+                pass
+    assert writer.count == 25
+    assert dstdb._writer is None
+
+    snap = {r["apath"]: r["size"] for r in dstdb.snapshot()}
+    assert snap == {"file1.txt": 5} | {f"new{ii}.txt": ii for ii in range(25)}
+    assert len(dstdb.snap_file.read_text().splitlines()) == 25
+    assert dstdb.check_latest(fix=False) == []
+
+    # A bad row only fails itself, not the rest of the group
+    more = [
+        {"apath": f"more{ii}.txt", "rpath": f"more{ii}.19700101000003.txt"}
+        | {"timestamp": 3, "size": ii, "mtime": 3.0}
+        for ii in range(6)
+    ]
+    committed = []
+
+    def on_commit(files):
+        committed.extend(file["apath"] for file in files)
+
+    with dstdb.group_commit(max_latency=60) as writer:
+        dstdb.insert_many(more[:3], on_commit=on_commit)
+        dstdb.insert_many([more[3], files[0]], on_commit=on_commit)  # Already there
+        dstdb.insert(more[4], on_commit=on_commit)
+        dstdb.insert(more[5])
+        assert not committed  # Only queued
+    assert writer.count == 6
+    assert [file["apath"] for file in writer.failed] == ["new0.txt"]
+    assert sorted(committed) == [f"more{ii}.txt" for ii in range(5)]
+    snap = {r["apath"]: r["size"] for r in dstdb.snapshot()}
+    assert snap["new0.txt"] == 0
+    assert all(snap[f"more{ii}.txt"] == ii for ii in range(6))
+    assert dstdb.check_latest(fix=False) == []
+
+    # Other errors get raised in the caller
+    def _write_files(db, sql, files):
+        raise RuntimeError("not a bad row")
+
+    dstdb._write_files = _write_files
+    with pytest.raises(RuntimeError):
+        with dstdb.group_commit():
+            dstdb.insert(more[0])
+    del dstdb._write_files
+
+
+def test_reset_chunked(monkeypatch):
+    test = testutils.Tester(name="reset_chunked")
+    test.write_config()
+
+    for ii in range(7):
+        test.write_pre(f"src/file{ii}.txt", f"file{ii}")
+    test.backup(offset=1)
+    test.write_post("src/file1.txt", "file1..")
+    test.move("src/file2.txt", "src/moved2.txt")
+    os.unlink("src/file3.txt")
+    test.backup(offset=2)
+
+    def _items():
+        res = test.dstdb.db().execute("SELECT * FROM items ORDER BY rpath")
+        keys = ["rpath", "apath", "timestamp", "size"]
+        return [tuple(row[k] for k in keys) + (bool(row["isref"]),) for row in res]
+
+    before = _items()
+
+    # Small chunks so that it takes multiple transactions
+    monkeypatch.setattr(DFBDST, "RESET_CHUNK", 2)
+    test.call("refresh")
+    assert _items() == before
+    assert test.dstdb.check_latest(fix=False) == []
+
+
+def test_references_cached(monkeypatch):
+    test = testutils.Tester(name="references_cached")
+    test.config["renames"] = "mtime"
+    test.config["rename_method"] = "reference"
+    test.write_config()
+
+    for ii in range(5):
+        test.write_pre(f"src/file{ii}.txt", "f" * (ii + 1))  # Unique sizes
+    test.backup(offset=1)
+    for ii in range(4):
+        test.move(f"src/file{ii}.txt", f"src/moved{ii}.txt")
+    test.backup(offset=2)
+
+    def _snap():
+        return {
+            row["apath"]: (row["rpath"], row["ref_rpath"])
+            for row in test.dstdb.snapshot()
+        }
+
+    before = _snap()
+    assert before["moved0.txt"] == (
+        "file0.19700101000001.txt",
+        "moved0.19700101000002R.txt",
+    )
+
+    monkeypatch.setattr(test.config_obj, "reference_concurrency", 3)
+    test.call("refresh", "--no-use-snapshots")
+    assert _snap() == before
+
+    cache = test.dstdb.refcache()
+    assert cache.execute("SELECT COUNT(*) FROM refs").fetchone()[0] == 4
+    cache.close()
+
+    # Should not read the references again
+    def _read(*args, **kwargs):
+        raise AssertionError("Should be cached")
+
+    monkeypatch.setattr(dfb.rclonerc.RC, "read", _read)
+    test.call("refresh", "--no-use-snapshots")
+    assert _snap() == before
+    assert test.dstdb.check_latest(fix=False) == []
+
+
+def test_reset_staged_snapshots(monkeypatch):
+    test = testutils.Tester(name="reset_staged_snapshots")
+    test.config["renames"] = "mtime"
+    test.config["rename_method"] = "reference"
+    test.config["refresh_memory_budget"] = "1 mb"
+    test.write_config()
+    assert test.config_obj.refresh_memory_budget == 1_000_000
+
+    for ii in range(5):
+        test.write_pre(f"src/file{ii}.txt", "f" * (ii + 1))  # Unique sizes
+    test.backup(offset=1)
+    test.move("src/file0.txt", "src/moved0.txt")
+    test.write_post("src/file1.txt", "modified")
+    test.backup(offset=2)
+
+    def _snap():
+        return {
+            row["apath"]: (row["rpath"], row["ref_rpath"], row["size"])
+            for row in test.dstdb.snapshot()
+        }
+
+    before = _snap()
+
+    # Everything, including references, should come from the snapshots
+    def _read(*args, **kwargs):
+        raise AssertionError("Should come from the snapshots")
+
+    monkeypatch.setattr(dfb.rclonerc.RC, "read", _read)
+    monkeypatch.setattr(DFBDST, "RESET_CHUNK", 2)
+    test.call("refresh")
+    assert _snap() == before
+
+    db = test.dstdb.db()
+    # Delete markers are not taken from the snapshots
+    res = db.execute("SELECT * FROM items WHERE dstinfo AND size >= 0")
+    assert not res.fetchall()
+    db.close()
+
+
+def test_checkpoint():
+    import shutil
+
+    test = testutils.Tester(name="checkpoint")
+    test.config["renames"] = "mtime"
+    test.config["rename_method"] = "reference"
+    test.write_config()
+
+    for ii in range(5):
+        test.write_pre(f"src/file{ii}.txt", "f" * (ii + 1))  # Unique sizes
+    test.backup(offset=1)
+    test.move("src/file0.txt", "src/moved0.txt")
+    test.write_post("src/file1.txt", "modified")
+    os.unlink("src/file2.txt")
+    test.backup(offset=2)
+    test.call("advanced", "prune-file", "file1.19700101000001.txt", offset=3)
+
+    test.call("advanced", "checkpoint", offset=4)
+    assert os.path.exists("dst/.dfb/snapshots/checkpoints/19700101000004Z.jsonl.gz")
+
+    test.write_post("src/file3.txt", "modified again")
+    test.backup(offset=5)
+
+    def _snap():
+        return {
+            row["apath"]: (row["rpath"], row["ref_rpath"], row["size"], row["mtime"])
+            for row in test.dstdb.snapshot()
+        }
+
+    before = _snap()
+
+    # The older snapshots (and the local copies) are no longer needed
+    for ii in range(1, 4):
+        os.unlink(f"dst/.dfb/snapshots/1970/01/1970010100000{ii}Z.jsonl.gz")
+    shutil.rmtree(test.config_obj.dbcache_dir / test.config_obj.config_id)
+
+    test.call("refresh", "-v", offset=6)
+    assert "Starting from checkpoint '19700101000004Z.jsonl.gz'" in test.logs[-1][0]
+    assert _snap() == before
+    db = test.dstdb.db()
+    res = db.execute("SELECT * FROM items WHERE dstinfo AND size >= 0")
+    assert not res.fetchall()
+    db.close()
+
+    # The snapshots, including the checkpoint, can also be imported
+    test.call("advanced", "dbimport", "--reset", "--dirs", "dst/.dfb/snapshots")
+    assert _snap() == before
+
+    # Automatic
+    test.config["checkpoint_every"] = 2
+    test.write_config()
+    test.write_post("src/file4.txt", "modified 4")
+    test.backup(offset=7)  # 5 and 7 since the last
+    cps = ["19700101000004Z.jsonl.gz", "19700101000007Z.jsonl.gz"]
+    assert sorted(os.listdir("dst/.dfb/snapshots/checkpoints")) == cps
+    test.write_post("src/file3.txt", "modified 3")
+    test.backup(offset=8)  # Just 8
+    assert sorted(os.listdir("dst/.dfb/snapshots/checkpoints")) == cps
+
+    before = _snap()
+    test.call("refresh", offset=9)
+    assert _snap() == before
+
+    # A resumed backup's snapshot counts from when it ran, not the planned time
+    paths = [
+        "checkpoints/19700101000002Z.jsonl.gz",
+        "1970/01/19700101000002Z.jsonl.gz",
+        "1970/01/19700101000002Z.resumed19700101000003Z.jsonl.gz",
+    ]
+    assert DFBDST._select_snapshots(paths) == [paths[0], paths[2]]
+
+
+def test_dirs():
+    test = testutils.Tester(name="dirs")
+    test.write_config()
+
+    test.write_pre("src/top.txt", "top")
+    test.write_pre("src/sub/file.txt", "file")
+    test.write_pre("src/sub/deep/er/file.txt", "file")
+    test.write_pre("src/sub/gone/file.txt", "file")
+    test.write_pre("src/other/file.txt", "file")
+    test.backup(offset=1)
+    os.unlink("src/sub/gone/file.txt")
+    test.backup(offset=2)
+
+    db = test.dstdb.db()
+    dirs = {row["path"]: row["name"] for row in db.execute("SELECT * FROM dirs")}
+    assert dirs == {
+        "": "",
+        "sub": "sub",
+        "sub/deep": "deep",
+        "sub/deep/er": "er",
+        "sub/gone": "gone",
+        "other": "other",
+    }
+    assert not db.execute("SELECT * FROM items WHERE dir_id IS NULL").fetchall()
+    db.close()
+
+    def _ls(*args, **kwargs):
+        subdirs, files = test.dstdb.ls(*args, **kwargs)
+        return sorted(subdirs), sorted(file["apath"] for file in files)
+
+    assert _ls() == (["other/", "sub/"], ["top.txt"])
+    assert _ls("sub") == (["sub/deep/"], ["sub/file.txt"])
+    assert _ls("sub/deep") == (["sub/deep/er/"], [])
+    assert _ls("SUB") == (["SUB/deep/"], ["sub/file.txt"])  # Not case-sensitive
+    assert _ls("nope") == ([], [])
+    assert _ls("sub", remove_delete=False) == (
+        ["sub/deep/", "sub/gone/"],
+        ["sub/file.txt"],
+    )
+    assert _ls("sub", delete_only=True, remove_delete=False) == (["sub/gone/"], [])
+    assert _ls("sub", recursive=True) == (
+        ["sub", "sub/deep", "sub/deep/er"],
+        ["sub/deep/er/file.txt", "sub/file.txt"],
+    )
+
+    # Same as going through all versions
+    for kw in [{}, {"remove_delete": False}, {"delete_only": True}]:
+        for subdir in ["", "sub", "sub/deep"]:
+            kw.setdefault("remove_delete", not kw.get("delete_only"))
+            assert _ls(subdir, **kw) == _ls(subdir, before="now", **kw)
+
+    # No longer in the files and will go through the dirs (and latest) index
+    query, params = test.dstdb._snapshot_query_builder(path="sub")
+    assert "LIKE" not in query
+    db = test.dstdb.db()
+    plan = db.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+    assert any("latest_dir" in row["detail"] for row in plan)
+    db.close()
+
+    # Exports should not have the dir_id
+    test.call("snapshot", "--export", "--output", "export.jsonl")
+    with open("export.jsonl") as fp:
+        assert all("dir_id" not in json.loads(line) for line in fp)
+
+    # Directories are removed once everything under them is pruned
+    rpaths = ["sub/gone/file.19700101000001.txt", "sub/gone/file.19700101000002D.txt"]
+    test.call("advanced", "prune-file", *rpaths, offset=3)
+    db = test.dstdb.db()
+    dirs = {row["path"] for row in db.execute("SELECT * FROM dirs")}
+    assert dirs == {"", "sub", "sub/deep", "sub/deep/er", "other"}
+    db.close()
+
+
+def test_checksums():
+    test = testutils.Tester(name="checksums")
+    test.config["compare"] = "hash"
+    test.config["hash_type"] = "md5"
+    test.write_config()
+
+    test.write_pre("src/file1.txt", "file1")
+    test.write_pre("src/sub/file2.txt", "file2")
+    test.backup(offset=1)
+
+    md5 = "826e8142e6baabe8af779f5f490cf5f5"  # file1
+    db = test.dstdb.db()
+    rows = db.execute("SELECT * FROM checksums ORDER BY apath").fetchall()
+    assert [tuple(row) for row in rows][0] == ("file1.txt", 1, "md5", md5)
+    assert len(rows) == 2
+    assert not db.execute("SELECT * FROM items WHERE checksum IS NOT NULL").fetchall()
+    db.close()
+
+    # Only when asked for
+    snap = {r["apath"]: r for r in map(DFBDST.fullrow2dict, test.dstdb.snapshot())}
+    assert "checksum" not in snap["file1.txt"]
+    snap = test.dstdb.snapshot(checksums=True)
+    snap = {r["apath"]: r for r in map(DFBDST.fullrow2dict, snap)}
+    assert snap["file1.txt"]["checksum"] == {"md5": md5}
+
+    # Nothing to upload since they match
+    test.write_post("src/file1.txt", "file1", add_dt=10)
+    back = test.backup(offset=2)
+    assert back.new + back.modified == []
+
+    # Make it look like an older DB with JSON checksums
+    db = test.dstdb.db()
+    with db:
+        db.execute(
+            "UPDATE items SET checksum = ?, remain = ? WHERE apath = 'file1.txt'",
+            (json.dumps({"md5": md5}), json.dumps({"Other": "value"})),
+        )
+        db.execute("DELETE FROM checksums")
+        db.execute("UPDATE kv SET val = '20241121.0' WHERE key = 'version'")
+    db.close()
+
+    dstdb = DFBDST(test.config_obj)  # Migrates on init
+    db = dstdb.db()
+    rows = db.execute("SELECT * FROM checksums").fetchall()
+    assert [tuple(row) for row in rows] == [("file1.txt", 1, "md5", md5)]
+    row = db.execute("SELECT * FROM items WHERE apath = 'file1.txt'").fetchone()
+    assert row["checksum"] is None
+    assert row["remain"] == '{"Other":"value"}'
+    db.close()
+
+    (version,) = dstdb.file_versions("file1.txt")
+    assert version["checksum"] == {"md5": md5}
+    assert version["Other"] == "value"
+
+    # Pruned with the file
+    test.call("advanced", "prune-file", "file1.19700101000001.txt", offset=3)
+    db = dstdb.db()
+    assert not db.execute("SELECT * FROM checksums").fetchall()
+    db.close()
+
+
+def test_checksum_versions():
+    """Each version, delete marker, and reference keeps its own hashes"""
+    import hashlib
+
+    md5 = lambda text: hashlib.md5(text.encode()).hexdigest()
+
+    test = testutils.Tester(name="checksum_versions")
+    test.config["get_hashes"] = True
+    test.config["hash_type"] = "md5"
+    test.config["renames"] = "mtime"
+    test.write_config()
+
+    test.write_pre("src/file1.txt", "version 1")
+    test.write_pre("src/move.txt", "move me")
+    test.write_pre("src/delete.txt", "delete me")
+    test.backup(offset=1)
+
+    test.write_post("src/file1.txt", "version 22", add_dt=10)
+    test.move("src/move.txt", "src/moved.txt")
+    os.unlink("src/delete.txt")
+    test.backup(offset=2)
+
+    def stored():
+        db = test.dstdb.db()
+        rows = db.execute("SELECT apath, timestamp, value FROM checksums").fetchall()
+        db.close()
+        return {(apath, ts): value for apath, ts, value in rows}
+
+    hashes = stored()
+    assert hashes[("file1.txt", 1)] == md5("version 1")
+    assert hashes[("file1.txt", 2)] == md5("version 22")
+    assert hashes[("delete.txt", 2)] == md5("delete me")  # Delete marker
+    assert hashes[("move.txt", 1)] == md5("move me")
+    assert hashes[("moved.txt", 2)] == md5("move me")  # Reference
+
+    (ref,) = test.dstdb.file_versions("moved.txt")
+    assert ref["isref"]
+    assert ref["checksum"] == {"md5": md5("move me")}
+
+    # No orphans once pruned
+    test.call("advanced", "prune-file", "file1.19700101000001.txt", offset=3)
+    hashes = stored()
+    assert ("file1.txt", 1) not in hashes
+    assert hashes[("file1.txt", 2)] == md5("version 22")
+
+
+def test_lazy_rows():
+    test = testutils.Tester(name="lazy_rows")
+    test.config["compare"] = "hash"
+    test.config["hash_type"] = "md5"
+    test.write_config()
+
+    test.write_pre("src/file1.txt", "file1")
+    test.write_pre("src/sub/file2.txt", "file2")
+    test.backup(offset=1)
+
+    db = test.dstdb.db()
+    with db:
+        for table in ["items", "latest"]:
+            db.execute(
+                f"UPDATE {table} SET remain = ? WHERE apath = 'file1.txt'",
+                ('{"Other":1}',),
+            )
+    db.close()
+
+    for checksums in [False, True]:
+        rows = list(test.dstdb.snapshot(checksums=checksums))
+        for row in rows:
+            lazy, full = DFBDST.fullrow2lazy(row), DFBDST.fullrow2dict(row)
+            assert isinstance(lazy, LazyRow)
+
+            # Access without decoding first
+            assert lazy["apath"] == full["apath"]
+            assert lazy.get("checksum") == full.get("checksum")
+            assert lazy.get("Other") == full.get("Other")
+            assert lazy.get("dir_id", "missing") == "missing"
+            with pytest.raises(KeyError):
+                lazy["remain"]
+
+            # Then as a whole
+            assert dict(lazy) == full
+            assert lazy == full
+            assert set(lazy) == set(full)
+
+            new = lazy.copy()
+            assert type(new) is dict and new == full
+            new["size"] = -1
+            assert lazy["size"] == full["size"]
+
+            lazy["size"] = -2
+            assert lazy["size"] == -2
+            del lazy["size"]
+            assert "size" not in lazy
+
+        assert any(row["apath"] == "file1.txt" for row in rows)
+
+    # Used by the hot paths
+    back = test.backup(offset=2)
+    assert isinstance(back.dst_files["file1.txt"], LazyRow)
+    assert back.dst_files["file1.txt"]["checksum"] == {
+        "md5": "826e8142e6baabe8af779f5f490cf5f5"
+    }
+    assert back.new + back.modified == []
+    _, files = test.dstdb.ls(recursive=True)
+    assert {file["apath"] for file in files} == {"file1.txt", "sub/file2.txt"}
+
+
+if __name__ == "__main__":
+    test_migrate(pytest.MonkeyPatch())
+    test_latest()
+    test_group_commit()
+    test_reset_chunked(pytest.MonkeyPatch())
+    test_references_cached(pytest.MonkeyPatch())
+    test_reset_staged_snapshots(pytest.MonkeyPatch())
+    test_checkpoint()
+    test_dirs()
+    test_checksums()
+    test_checksum_versions()
+    test_lazy_rows()
+
+    print("=" * 50)
+    print(" All Passed ".center(50, "="))
+    print("=" * 50)
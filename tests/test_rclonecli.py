@@ -387,11 +387,126 @@ def test_context_managers():
         assert "--ignore-times" not in cap.command_history[-1]
 
 
+@pytest.mark.parametrize("depth", [1, 2])
+def test_listremote_partitioned(depth):
+    """Partitioned listings must match the plain listing with the same filters"""
+    import random
+    from collections import Counter
+
+    rmdir("testdirs/partitioned")
+    cfg = write_config("partitioned")
+    rclone = RcloneCLI(
+        "myremote:",
+        universal_flags=["--config", cfg],
+        universal_env={"RCLONE_PASSWORD_COMMAND": RcloneCLI.DELENV},
+    )
+
+    random.seed(5)
+    names = ["a", "b", "c,d", "{e}", "f*g", "[h]", "sub", "x.txt", "y.jpg", "c.tmp"]
+
+    def mk(path, level):
+        os.makedirs(path, exist_ok=True)
+        for name in random.sample(names, 7):
+            if level < 4 and "." not in name and random.random() < 0.6:
+                mk(os.path.join(path, name), level + 1)
+            else:
+                with open(os.path.join(path, name), "wt") as fp:
+                    fp.write(name)
+
+    mk("testdirs/partitioned", 0)
+    os.makedirs("testdirs/partitioned/sub/marked/deep")
+    for name in ["sub/marked/.nobackup", "sub/marked/deep/file.txt"]:
+        open(os.path.join("testdirs/partitioned", name), "wt").close()
+
+    cases = [
+        [],
+        ["--exclude", "*.tmp", "--exclude", "/a/**"],
+        ["--filter", "- /sub/", "--filter", "+ *.jpg", "--filter", "- *"],
+        ["--filter", "+ /b/**", "--filter", "- **"],
+        ["--exclude-if-present", ".nobackup"],
+    ]
+    for filter_flags in cases:
+        for only in [None, "files"]:
+            kw = dict(filter_flags=filter_flags, only=only)
+            plain = Counter(
+                (item["Path"], item["IsDir"]) for item in rclone.listremote(**kw)
+            )
+            part = Counter(
+                (item["Path"], item["IsDir"])
+                for item in rclone.listremote_partitioned(
+                    partitions=3, depth=depth, **kw
+                )
+            )
+            assert part == plain
+
+    # Stopping early doesn't run the queued partitions
+    dirs = [
+        item
+        for item in rclone.listremote(maxdepth=depth)
+        if item["IsDir"] and item["Path"].count("/") + 1 == depth
+    ]
+    ngroups = min(len(dirs), 4 * 2)
+    if ngroups <= 4:
+        return  # Nothing much queued
+
+    calls = []
+    listremote = rclone.listremote
+
+    def counted(*args, **kwargs):
+        calls.append(kwargs.get("maxdepth"))
+        return listremote(*args, **kwargs)
+
+    rclone.listremote = counted
+    listing = rclone.listremote_partitioned(partitions=2, depth=depth)
+    for item in listing:
+        if item["Path"].count("/") >= depth:  # From a partition
+            break
+    listing.close()
+    assert calls[0] == depth  # The shallow listing
+    assert len(calls) - 1 < ngroups
+
+
+def test_no_partition_reason():
+    """Filters that can't be partitioned are found in any of the flags"""
+    reason = rclonecli._no_partition_reason
+    os.makedirs("testdirs", exist_ok=True)
+    with open("testdirs/clear_filters.txt", "wt") as fp:
+        fp.write("- *.tmp\n!\n")
+
+    assert reason([]) is None
+    assert reason(["--exclude", "*.tmp", "--filter=- /a/**"]) is None
+    assert reason(["--exclude", "--include"]) is None  # A value, not a flag
+    assert "--include" in reason(["--exclude", "*.tmp", "--include", "*.txt"])
+    assert "--include" in reason(["--include=*.txt"])
+    assert "'!'" in reason(["--filter", "!"])
+    assert "'!'" in reason(["--filter-from", "testdirs/clear_filters.txt"])
+    assert "no value" in reason(["--exclude", "*.tmp", "--filter-from"])
+    assert "Could not read" in reason(["--filter-from", "testdirs/missing.txt"])
+
+    # From the other flags
+    rmdir("testdirs/partition_flags")
+    cfg = write_config("partition_flags")
+    os.makedirs("testdirs/partition_flags/sub")
+    for name in ["a.txt", "b.jpg", "sub/c.txt", "sub/d.jpg"]:
+        open(os.path.join("testdirs/partition_flags", name), "wt").close()
+
+    rclone = RcloneCLI(
+        "myremote:",
+        universal_flags=["--config", cfg],
+        universal_env={"RCLONE_PASSWORD_COMMAND": RcloneCLI.DELENV},
+    )
+    kw = dict(flags=["--include", "*.txt"], only="files")
+    listing = rclone.listremote_partitioned(partitions=2, **kw)
+    assert sorted(item["Path"] for item in listing) == ["a.txt", "sub/c.txt"]
+
+
 if __name__ == "__main__":
     test_main()
     test_fobj()
     test_streamed_output()
     test_context_managers()
+    test_listremote_partitioned(2)
+    test_no_partition_reason()
 
     print("-" * 50)
     print("-- PASSED --")
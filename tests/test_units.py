@@ -10,6 +10,10 @@ if p not in sys.path:
 
 from dfb.utils import smart_splitext, time2all, head_tail_table, parse_bytes
 from dfb.dstdb import rpath2apath, apath2rpath
+from dfb.backup import Backup, RenameIndex, SourceFiles
+from dfb.localscan import LocalScanner, RcloneFilter, Unsupported
+from dfb.threadmapper import Limit, ReturnThread, thread_map_unordered
+from dfb.concurrency import AdaptiveLimit
 
 DATED_SPLIT_TESTS = {
     # Older style names before smart-split then test with smart
@@ -405,6 +409,279 @@ def test_parse_bytes():
         assert parse_bytes(inval) == gold
 
 
+def test_source_files():
+    files = [
+        {"apath": "a.txt", "size": 10, "mtime": 1700000000.25},
+        {"apath": "sub/b.txt", "size": 0, "mtime": None, "checksum": {"md5": "x"}},
+        {"apath": "c.txt", "size": 3, "mtime": -12345},  # int stays int
+        {"apath": "d.txt", "size": 3, "mtime": "odd", "Metadata": {"mode": "0644"}},
+        {"apath": "e.txt", "size": 2**70, "mtime": 1.0},  # Too big for the array
+    ]
+    src = SourceFiles(files)
+
+    assert len(src) == 5
+    assert list(src) == [f["apath"] for f in files]
+    assert "sub/b.txt" in src and "nope" not in src
+    for file in files:
+        assert src[file["apath"]] == file
+        assert list(src[file["apath"]]) == list(file)  # key order
+    assert type(src["c.txt"]["mtime"]) is int
+    assert src.keys() - {"a.txt"} == {"sub/b.txt", "c.txt", "d.txt", "e.txt"}
+
+    # Not kept
+    src["a.txt"]["size"] = 100
+    assert src["a.txt"]["size"] == 10
+
+    # Replace
+    src.add({"apath": "sub/b.txt", "size": 1, "mtime": 2.0})
+    assert len(src) == 5
+    assert src["sub/b.txt"] == {"apath": "sub/b.txt", "size": 1, "mtime": 2.0}
+
+
+def test_rename_index():
+    """RenameIndex must match a scan with file_compare"""
+    import random
+    from types import SimpleNamespace
+
+    random.seed(3)
+    config = SimpleNamespace(dt=1.0, error_on_missing_hash=False)
+    back = Backup(config)
+
+    def rand_file(ii):
+        file = {
+            "apath": f"file{ii}",
+            "rpath": f"file{ii}.19700101000001",
+            "size": random.choice([1, 2, 3]),
+            "mtime": random.choice([None, 10.0, 10.5, 11.2, 12.0, 13]),
+        }
+        checksum = {}
+        if random.random() < 0.7:
+            checksum["md5"] = random.choice("ab")
+        if random.random() < 0.5:
+            checksum["sha1"] = random.choice("ab")
+        file["checksum"] = checksum or random.choice([None, {}])
+        return file
+
+    attribs = ["size", "mtime", "hash", False]
+    dfiles = [(rand_file(ii), random.choice(attribs)) for ii in range(200)]
+    index = RenameIndex(config)
+    for dfile, attrib in dfiles:
+        index.add(dfile, attrib)
+
+    for ii in range(200):
+        sfile = rand_file(ii)
+        scan = {
+            (id(dfile), attrib)
+            for dfile, attrib in dfiles
+            if attrib and back.file_compare(sfile, dfile, attrib=attrib)
+        }
+        res = index.candidates(sfile)
+        assert len(res) == len(scan)
+        assert {(id(dfile), attrib) for dfile, attrib in res} == scan
+
+
+def test_local_scanner():
+    """The native lister and the compiled filters must match rclone"""
+    import json, random, shutil, subprocess
+
+    root = os.path.abspath("testdirs/local_scanner/src")
+    shutil.rmtree(os.path.dirname(root), ignore_errors=True)
+
+    random.seed(3)
+    names = [
+        "a",
+        "sub",
+        "dir",
+        "x.txt",
+        "y.jpg",
+        "Z.JPG",
+        "c.tmp",
+        "e f.txt",
+        "{g}.txt",
+    ]
+
+    def mk(path, depth):
+        os.makedirs(path, exist_ok=True)
+        for name in random.sample(names, 6):
+            if depth < 3 and "." not in name and random.random() < 0.6:
+                mk(os.path.join(path, name), depth + 1)
+            else:
+                with open(os.path.join(path, name), "w") as fp:
+                    fp.write("x" * random.randint(0, 3000))
+
+    mk(root, 0)
+    os.makedirs(f"{root}/empty/empty")
+    os.makedirs(f"{root}/sub/marked")
+    for name in [".nobackup", "f.txt"]:
+        open(f"{root}/sub/marked/{name}", "w").close()
+    os.symlink("x.txt", f"{root}/link")
+    with open(f"{root}/../filters.txt", "w") as fp:
+        fp.write("# comment\n+ *.jpg\n- /sub/**\n\n- *.tmp\n")
+
+    cases = [
+        [],
+        ["--exclude", "*.tmp", "--exclude", "a/"],
+        ["--include", "*.jpg"],
+        ["--include", "/a/*.txt", "--include", "**/sub/*"],
+        ["--include", "*.{jpg,txt}", "--exclude", "dir/**"],
+        ["--filter", "- /a/", "--filter", "+ sub/**", "--filter", "- *"],
+        ["--filter-from", f"{root}/../filters.txt"],
+        ["--exclude", "*.jpg", "--ignore-case"],
+        ["--exclude-if-present", ".nobackup", "--min-size", "1k"],
+        ["--max-size=2000b", "--exclude", "[xy].*"],
+        ["--filter", "+ **/a/?.txt", "--filter", "- **"],
+    ]
+    for flags in cases:
+        for rflags in [[], ["--links"], ["--skip-links"]]:
+            filters = RcloneFilter(flags)
+            rules = ["--- File filter rules ---"]
+            rules += [
+                f"{'+-'[not inc]} {reg.pattern}" for inc, reg in filters.file_rules
+            ]
+            rules += ["--- Directory filter rules ---"]
+            rules += [
+                f"{'+-'[not inc]} {reg.pattern}" for inc, reg in filters.dir_rules
+            ]
+
+            cmd = ["rclone", "lsjson", "-R", "--no-mimetype", root, *flags, *rflags]
+            proc = subprocess.run(cmd + ["--dump", "filters"], capture_output=True)
+            dump = proc.stdout.decode().splitlines()
+            dump = dump[dump.index(rules[0]) : dump.index("--- end filters ---")]
+            assert rules == dump
+
+            proc = subprocess.run(cmd, capture_output=True, check=True)
+            rclone = {
+                (item["Path"], item["IsDir"], item["Size"])
+                for item in json.loads(proc.stdout)
+            }
+            scanner = LocalScanner(root, filter_flags=flags, rclone_flags=rflags)
+            native = {(item["Path"], item["IsDir"], item["Size"]) for item in scanner}
+            assert native == rclone, flags
+
+    for flags in [["--files-from", "list.txt"], ["--include", "{{.*}}"]]:
+        try:
+            RcloneFilter(flags)
+            assert False
+        except Unsupported:
+            pass
+    try:
+        LocalScanner(root, rclone_flags=["--copy-links"])
+        assert False
+    except Unsupported:
+        pass
+
+
+def test_limit():
+    """Only 'value' calls run at once and it can change while mapping"""
+    import threading
+
+    limit = Limit(2, max=6)
+    running = []
+    lock = threading.Lock()
+
+    def _fun(ii):
+        with lock:
+            running.append((limit.value, limit.active))
+        if ii == 20:
+            limit.value = 5
+        time.sleep(0.01)
+        return ii
+
+    res = list(thread_map_unordered(_fun, range(60), Nt=limit, Nin_buffer=-1))
+    assert sorted(res) == list(range(60))
+    assert max(active for value, active in running if value == 2) <= 2
+    assert max(active for value, active in running) == 5
+
+    limit.value = 100
+    assert limit.value == 6
+    limit.value = -3
+    assert limit.value == 1
+
+
+def test_stopped_early():
+    """Stopping a mapping early doesn't leave threads running. Threads raise on join"""
+    import threading
+
+    pulled = []
+
+    def _seq():
+        for ii in range(100):
+            pulled.append(ii)
+            yield ii
+
+    def _fun(ii):
+        if ii == 10:
+            raise ValueError(ii)
+        time.sleep(0.01)
+        return ii
+
+    before = threading.active_count()
+    mapped = thread_map_unordered(_fun, _seq(), Nt=4)
+    try:
+        list(mapped)
+        assert False
+    except ValueError:
+        pass
+    assert len(pulled) < 20
+    assert threading.active_count() == before
+
+    mapped = thread_map_unordered(_fun, _seq(), Nt=4)
+    next(mapped)
+    mapped.close()
+    assert len(pulled) < 100 + 20
+    assert threading.active_count() == before
+
+    thread = ReturnThread(target=_fun, args=(10,)).start()
+    try:
+        thread.join()
+        assert False
+    except ValueError:
+        pass
+    assert ReturnThread(target=_fun, args=(1,)).start().join() == 1
+
+
+def test_adaptive_limit():
+    limit = AdaptiveLimit(None, 4, min=2, max=8)
+
+    def _stats(nbytes, done, errors=0):
+        return {"bytes": nbytes, "transfers": done, "errors": errors}
+
+    limit.update(_stats(0, 0), 1)  # First is the baseline
+    assert limit.value == 4
+
+    limit.waits = 3  # More work than workers: add one
+    limit.update(_stats(1000, 10), 1)
+    assert limit.value == 5
+
+    limit.waits = 3  # Throughput held. Keep adding
+    limit.update(_stats(2000, 20), 1)
+    assert limit.value == 6
+
+    limit.waits = 3  # Throughput fell after the increase: undo it
+    limit.update(_stats(2500, 25), 1)
+    assert limit.value == 5
+
+    limit.waits = 3  # Not right after a decrease
+    limit.update(_stats(3000, 30), 1)
+    assert limit.value == 5
+
+    limit.update(_stats(4000, 40), 1)  # No waits. Keep it
+    assert limit.value == 5
+
+    limit.waits = 3  # Errors take priority and halve it, within the bounds
+    limit.update(_stats(5000, 50, errors=2), 1)
+    assert limit.value == 2
+    limit.update(_stats(6000, 60, errors=3), 1)
+    assert limit.value == 2
+
+    limit.waits = 1  # Stats reset. New baseline
+    limit.update(_stats(10, 1), 1)
+    assert limit.value == 2
+    limit.waits = 1
+    limit.update(_stats(1000, 10), 1)
+    assert limit.value == 3
+
+
 if __name__ == "__main__":
     # Names and split
     test_smart_splitext()
@@ -415,6 +692,12 @@ if __name__ == "__main__":
     test_time2all()
     test_head_tail_table()
     test_parse_bytes()
+    test_source_files()
+    test_rename_index()
+    test_local_scanner()
+    test_limit()
+    test_stopped_early()
+    test_adaptive_limit()
 
     print("=" * 50)
     print(" All Passed ".center(50, "="))
@@ -325,6 +325,20 @@ def change_time(path, time_adj):
     os.utime(path, (stat.st_atime + time_adj, stat.st_mtime + time_adj))
 
 
+def watch_configs(configfile):
+    """Function to make a new, parsed config for each 'watch' run like the CLI"""
+    cliconfig = dfb.cli.parse(["watch", "--config", configfile])
+
+    def new_config():
+        config = dfb.configuration.Config(configfile)
+        config.cliconfig = cliconfig
+        config.parse()
+        config._set_auto()
+        return config
+
+    return new_config
+
+
 def tree(path, hidden=False):
     files = []
     for dirpath, dirnames, filenames in os.walk(path, followlinks=True):